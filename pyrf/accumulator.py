@@ -0,0 +1,153 @@
+import numpy as np
+
+MAX_HOLD = 'max_hold'
+MIN_HOLD = 'min_hold'
+AVERAGE = 'average'
+EXPONENTIAL_AVERAGE = 'exponential_average'
+COUNT_AVERAGE = 'count_average'
+
+ACCUMULATOR_MODES = (MAX_HOLD, MIN_HOLD, AVERAGE, EXPONENTIAL_AVERAGE,
+    COUNT_AVERAGE)
+
+
+class SpectrumAccumulatorError(Exception):
+    pass
+
+
+class SpectrumAccumulator(object):
+    """
+    Combine successive power spectra from
+    :class:`pyrf.sweep_device.SweepDevice` or
+    :class:`pyrf.capture_device.CaptureDevice` results.
+
+    Each update takes time proportional to the number of bins and the
+    memory used does not grow with the number of spectra accumulated.
+    Averages are computed on linear power, not on dB values.  NaN and
+    other non-finite bins, such as parts of a sweep not collected, are
+    left out of the hold and average of that bin.
+
+    The accumulator resets itself when fstart, fstop or the number of
+    bins passed to :meth:`update` changes.
+
+    :param mode: one of 'max_hold', 'min_hold', 'average' (mean of all
+                 spectra since reset), 'exponential_average' or
+                 'count_average' (mean of the last *count* spectra)
+    :param count: number of spectra averaged in 'count_average' mode
+    :param alpha: weight of each new spectrum in 'exponential_average'
+                  mode, between 0 and 1
+    """
+    def __init__(self, mode, count=5, alpha=0.1):
+        if mode not in ACCUMULATOR_MODES:
+            raise SpectrumAccumulatorError('unknown mode: %r' % (mode,))
+        if count < 1:
+            raise SpectrumAccumulatorError('count must be at least 1')
+        if not 0 < alpha <= 1:
+            raise SpectrumAccumulatorError('alpha must be in (0, 1]')
+        self.mode = mode
+        self.count = count
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self):
+        """
+        Discard all accumulated spectra
+        """
+        self.spectra = 0
+        self._key = None
+        self._data = None
+        self._history = None
+        self._history_index = 0
+        self._mean = None
+
+    def update(self, fstart, fstop, bins):
+        """
+        Add a spectrum and return the accumulated result
+
+        :param fstart: frequency of the first bin in Hz
+        :param fstop: frequency of the last bin in Hz
+        :param bins: power levels in dBm
+        :returns: numpy array of accumulated power levels in dBm
+        """
+        bins = np.asarray(bins, dtype=float)
+        key = (fstart, fstop, len(bins))
+        if key != self._key:
+            self.reset()
+            self._key = key
+
+        if self.mode == MAX_HOLD:
+            self._hold(np.fmax, bins)
+            return self._data.copy()
+        if self.mode == MIN_HOLD:
+            self._hold(np.fmin, bins)
+            return self._data.copy()
+
+        power = np.power(10.0, bins / 10.0)
+        if self.mode == AVERAGE:
+            self._average(power)
+        elif self.mode == EXPONENTIAL_AVERAGE:
+            self._exponential_average(power)
+        else:
+            self._count_average(power)
+        return 10 * np.log10(self._data)
+
+    def callback(self, callback):
+        """
+        Return a function suitable for use as a
+        :class:`pyrf.sweep_device.SweepDevice` async_callback that
+        passes the accumulated result on to *callback*
+        """
+        def accumulate(fstart, fstop, bins):
+            if not len(bins):
+                return callback(fstart, fstop, bins)
+            return callback(fstart, fstop, self.update(fstart, fstop, bins))
+        return accumulate
+
+    def _hold(self, fn, bins):
+        if self._data is None:
+            self._data = bins.copy()
+        else:
+            fn(self._data, bins, out=self._data)
+        self.spectra += 1
+
+    def _average(self, power):
+        self.spectra += 1
+        valid = np.isfinite(power)
+        if self._mean is None:
+            self._mean = np.zeros(len(power))
+            self._counts = np.zeros(len(power), dtype=int)
+        self._counts += valid
+        self._mean[valid] += ((power[valid] - self._mean[valid])
+            / self._counts[valid])
+        self._data = np.where(self._counts > 0, self._mean, np.nan)
+
+    def _exponential_average(self, power):
+        self.spectra += 1
+        valid = np.isfinite(power)
+        if self._data is None:
+            self._data = np.where(valid, power, np.nan)
+            return
+        first = valid & np.isnan(self._data)
+        self._data[first] = power[first]
+        valid &= ~first
+        self._data[valid] += self.alpha * (power[valid] - self._data[valid])
+
+    def _count_average(self, power):
+        if self._history is None:
+            self._history = np.zeros((self.count, len(power)))
+            self._valid = np.zeros((self.count, len(power)), dtype=bool)
+            self._sum = np.zeros(len(power))
+            self._counts = np.zeros(len(power), dtype=int)
+        index = self._history_index
+        if self.spectra == self.count:
+            self._sum -= self._history[index]
+            self._counts -= self._valid[index]
+        else:
+            self.spectra += 1
+        valid = np.isfinite(power)
+        self._history[index] = np.where(valid, power, 0)
+        self._valid[index] = valid
+        self._history_index = (index + 1) % self.count
+        self._sum += self._history[index]
+        self._counts += valid
+        self._data = np.where(self._counts > 0,
+            self._sum / np.maximum(self._counts, 1), np.nan)
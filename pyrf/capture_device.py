@@ -1,6 +1,11 @@
 import math
+from collections import deque
 
-from pyrf.util import compute_usable_bins, adjust_usable_fstart_fstop
+from pyrf.util import (compute_usable_bins, capture_geometry,
+    capture_center_freq)
+
+# settings assumed for received data when they were never configured
+DEFAULT_CAPTURE_SETTINGS = {'decimation': 1, 'fshift': 0}
 
 
 class CaptureDeviceError(Exception):
@@ -18,8 +23,19 @@ class CaptureDevice(object):
     :param device_settings: initial device settings to use, passed to
                             :meth:`pyrf.capture_dvice.CaptureDevice.configure_device`
                             if given
+    :param pipeline_depth: number of capture requests to keep outstanding.
+                           With more than one, data is returned for
+                           captures requested earlier while newer ones
+                           are in flight; each result uses the settings
+                           its capture was requested with.  In async
+                           mode the pipeline continues when
+                           :meth:`capture_time_domain` is called from
+                           async_callback and restarts otherwise.  In
+                           sync mode call :meth:`stop` before using
+                           real_device for anything else.
     """
-    def __init__(self, real_device, async_callback=None, device_settings=None):
+    def __init__(self, real_device, async_callback=None, device_settings=None,
+            pipeline_depth=1):
 
         self.real_device = real_device
         if real_device.async_connector():
@@ -33,6 +49,11 @@ class CaptureDevice(object):
                 raise CaptureDeviceError(
                     "async_callback not applicable for sync operation")
         self.async_callback = async_callback
+        if pipeline_depth < 1:
+            raise CaptureDeviceError("pipeline_depth must be at least 1")
+        self.pipeline_depth = pipeline_depth
+        self._pending = deque()
+        self._in_callback = False
         self._configure_device_flag = False
         self._device_set = {}
         if device_settings is not None:
@@ -87,57 +108,97 @@ class CaptureDevice(object):
 
         full_bw = prop.FULL_BW[rfe_mode]
 
-        self.real_device.abort()
-        self.real_device.flush()
-        self.real_device.request_read_perm()
-        self._vrt_context = {}
+        if not self._pending or (self.async_callback and not self._in_callback):
+            self.real_device.abort()
+            self.real_device.flush()
+            self.real_device.request_read_perm()
+            self._vrt_context = {}
+            self._pending.clear()
 
         points = round(max(min_points, full_bw / rbw))
         points = 2 ** math.ceil(math.log(points, 2))
 
         fshift = self._device_set.get('fshift', 0)
         decimation = self._device_set.get('decimation', 1)
-        self.usable_bins = compute_usable_bins(prop, rfe_mode, points,
-            decimation, fshift)
+        if not self._pending:
+            self.usable_bins = compute_usable_bins(prop, rfe_mode, points,
+                decimation, fshift)
 
         if self.async_callback:
             self.real_device.set_async_callback(self.read_data)
+        while len(self._pending) < self.pipeline_depth:
+            # points and settings snapshot matched to the data
+            # received, in order
+            self._pending.append((points, dict(self._device_set)))
             self.real_device.capture(points, 1)
+        if self.async_callback:
             return
 
-        self.real_device.capture(points, 1)
         result = None
         while result is None:
             result = self.read_data(self.real_device.read())
         return result
 
+    def stop(self):
+        """
+        Discard any outstanding captures
+        """
+        if not self._pending:
+            return
+        self.real_device.abort()
+        self.real_device.flush()
+        self._pending.clear()
+
+    def _recapture(self):
+        """
+        Request again the captures that were lost when the connection
+        dropped, with the points and settings each was requested with
+        """
+        self._vrt_context = {}
+        for points, device_set in self._pending:
+            # a later capture may have changed settings missing from
+            # an earlier one
+            self.real_device.apply_device_settings(
+                dict(DEFAULT_CAPTURE_SETTINGS, **device_set))
+            self.real_device.capture(points, 1)
+
     def read_data(self, packet):
         if packet.is_context_packet():
+            if 'reconnect_gap' in packet.fields:
+                self._recapture()
+                return
             self._vrt_context.update(packet.fields)
             return
         data= {
-            'context_pkt' : self._vrt_context,
+            'context_pkt' : dict(self._vrt_context),
             'data_pkt' : packet}
 
-        rfe_mode = self._device_set['rfe_mode']
-        # FIXME: add a "can I tune in this mode?" device property instead
-        # of listing modes here
-        if rfe_mode in ('DD', 'IQIN'):
-            freq = self.real_device.properties.MIN_TUNABLE[rfe_mode]
+        if self._pending:
+            device_set = self._pending.popleft()[1]
         else:
-            freq = self._device_set['freq']
-        decimation = self._device_set.get('decimation', 1)
-
-        self.usable_bins, fstart, fstop = adjust_usable_fstart_fstop(
+            device_set = self._device_set
+        rfe_mode = device_set['rfe_mode']
+        freq = capture_center_freq(self.real_device.properties, rfe_mode,
+            device_set['freq'])
+        decimation = device_set.get('decimation',
+            DEFAULT_CAPTURE_SETTINGS['decimation'])
+
+        geometry = capture_geometry(
             self.real_device.properties,
             rfe_mode,
             len(packet.data),
             decimation,
+            device_set.get('fshift', DEFAULT_CAPTURE_SETTINGS['fshift']),
             freq,
-            packet.spec_inv,
-            self.usable_bins)
+            packet.spec_inv)
+        self.usable_bins = list(geometry.usable_bins)
+        fstart, fstop = geometry.fstart, geometry.fstop
 
         if self.async_callback:
-            self.async_callback(fstart, fstop, data)
+            self._in_callback = True
+            try:
+                self.async_callback(fstart, fstop, data)
+            finally:
+                self._in_callback = False
             return
         return (fstart, fstop, data)
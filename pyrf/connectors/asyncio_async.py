@@ -0,0 +1,284 @@
+try:
+    import asyncio
+    from asyncio import Protocol
+except ImportError:
+    # to allow docstrings to be visible even when asyncio
+    # imports fail
+    asyncio = None
+    Protocol = object
+
+import time
+from collections import deque
+
+from pyrf.connectors.base import (sync_async, SCPI_PORT, VRT_PORT,
+    VRTReceiveBuffer)
+from pyrf.vrt import parse_vrt_packet, generate_speca_packet
+
+import logging
+logger = logging.getLogger(__name__)
+
+class AsyncioConnectorError(Exception):
+    pass
+
+class AsyncioConnector(object):
+    """
+    A connector that makes SCPI/VRT connections asynchronously using
+    asyncio.
+
+    Methods decorated with :func:`pyrf.connectors.base.sync_async`
+    return asyncio futures that may be awaited or given callbacks.
+
+    A callback may be assigned to vrt_callback that will be called
+    with VRT packets as they arrive.  When .vrt_callback is None
+    (the default) arriving packets will be ignored.
+
+    :param loop: event loop to use, defaults to the current event loop
+    :param scpi_port: TCP port of the SCPI connection
+    :param vrt_port: TCP port of the VRT connection
+    :param stats: a :class:`pyrf.connectors.stats.ConnectorStats` to
+                  update, or None
+    """
+    def __init__(self, loop=None, vrt_callback=None, scpi_port=SCPI_PORT,
+            vrt_port=VRT_PORT, stats=None):
+        if asyncio is None:
+            raise AsyncioConnectorError('asyncio is not available')
+        self._loop = loop or asyncio.get_event_loop()
+        self.vrt_callback = vrt_callback
+        self.scpi_port = scpi_port
+        self.vrt_port = vrt_port
+        self.stats = stats
+        self._scpi = None
+        self._vrt = None
+
+    def connect(self, host):
+        result = self._loop.create_future()
+
+        def connected_scpi(f):
+            if f.exception():
+                result.set_exception(f.exception())
+                return
+            transport, self._scpi = f.result()
+            f = asyncio.ensure_future(self._loop.create_connection(
+                lambda: VRTProtocol(self._vrt_callback, self.stats), host,
+                self.vrt_port),
+                loop=self._loop)
+            f.add_done_callback(connected_vrt)
+
+        def connected_vrt(f):
+            if f.exception():
+                self._scpi.transport.close()
+                result.set_exception(f.exception())
+                return
+            transport, self._vrt = f.result()
+            result.set_result(None)
+
+        f = asyncio.ensure_future(self._loop.create_connection(
+            lambda: SCPIProtocol(self._loop), host, self.scpi_port),
+            loop=self._loop)
+        f.add_done_callback(connected_scpi)
+        return result
+
+    def set_recording_output(self, output_file=None):
+        self._vrt.set_recording_output(output_file)
+
+    def inject_recording_state(self, state):
+        self._vrt.inject_recording_state(state)
+
+    def disconnect(self):
+        self._vrt.transport.close()
+        self._scpi.transport.close()
+
+    def scpiset(self, cmd):
+        if self.stats is not None:
+            self.stats.command_sent(cmd)
+        self._scpi.scpiset("%s\n" % cmd)
+
+    def scpiset_many(self, cmds):
+        if self.stats is not None:
+            for cmd in cmds:
+                self.stats.command_sent(cmd)
+        self._scpi.scpiset(''.join("%s\n" % cmd for cmd in cmds))
+
+    def scpiget(self, cmd):
+        if self.stats is None:
+            return self._scpi.scpiget("%s\n" % cmd)
+        self.stats.command_sent(cmd)
+        start = time.time()
+        f = self._scpi.scpiget("%s\n" % cmd)
+        f.add_done_callback(
+            lambda f: self.stats.scpi_round_trip(time.time() - start))
+        return f
+
+    def sync_async(self, gen):
+        """
+        Handler for the @sync_async decorator.  The generator is
+        advanced each time a future it yields completes and the
+        returned future is set to the last value sent to it.
+        """
+        result = self._loop.create_future()
+
+        def advance(value):
+            while True:
+                try:
+                    f = gen.send(value)
+                except StopIteration:
+                    result.set_result(value)
+                    return
+                except Exception as e:
+                    result.set_exception(e)
+                    return
+                if not asyncio.isfuture(f):
+                    value = f
+                    continue
+                f.add_done_callback(resolved)
+                return
+
+        def resolved(f):
+            if f.exception():
+                result.set_exception(f.exception())
+                return
+            advance(f.result())
+
+        advance(None)
+        return result
+
+    def eof(self):
+        return self._vrt.eof
+
+    def raw_read(self, num_bytes):
+        raise AsyncioConnectorError('synchronous read() not supported.')
+
+    def _vrt_callback(self, packet):
+        if self.vrt_callback:
+            self.vrt_callback(packet)
+
+
+def _to_bytes(data):
+    if isinstance(data, bytes):
+        return data
+    return data.encode('latin-1')
+
+
+def _to_str(data):
+    if isinstance(data, str):
+        return data
+    return data.decode('latin-1')
+
+
+class VRTProtocol(Protocol):
+    """
+    An asyncio protocol for the VRT connection
+
+    :param receive_callback: a function that will be passed a vrt
+        DataPacket or ContextPacket when it is received
+    """
+    eof = False
+    transport = None
+
+    def __init__(self, receive_callback, stats=None):
+        self._receive_callback = receive_callback
+        self._stats = stats
+        self._buf = VRTReceiveBuffer()
+        self._output_file = None
+        self._new_output_file = None
+        self._inject_recording_state = None
+        self._inject_recording_count = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def set_recording_output(self, output_file=None):
+        if not output_file:
+            self._output_file = None
+            self._new_output_file = None
+        else:
+            self._new_output_file = output_file
+        self._reached_vrt_boundary()
+
+    def inject_recording_state(self, state):
+        self._inject_recording_state = state
+        self._reached_vrt_boundary()
+
+    def _reached_vrt_boundary(self):
+        """
+        Start new recordings and inject speca state packets into
+        recordings.  Only called between VRT packets.
+        """
+        if self._new_output_file:
+            self._output_file = self._new_output_file
+            self._new_output_file = None
+            self._inject_recording_count = 0
+
+        if self._inject_recording_state and self._output_file:
+            data, self._inject_recording_count = generate_speca_packet(
+                self._inject_recording_state, self._inject_recording_count)
+            self._inject_recording_state = None
+            self._output_file.write(data)
+
+    def data_received(self, data):
+        if self._stats is not None:
+            self._stats.recv_call(len(data))
+        self._buf.append(data)
+        for raw in self._buf.packets():
+            if self._output_file:
+                self._output_file.write(raw)
+            packet = parse_vrt_packet(raw)
+            if self._stats is not None:
+                self._stats.packet_received(packet.stream_id, len(raw),
+                    packet.is_data_packet())
+            self._receive_callback(packet)
+
+    def connection_lost(self, exc):
+        self.eof = True
+
+
+class SCPIProtocol(Protocol):
+    """
+    An asyncio protocol for the SCPI connection.  Commands and queries
+    are written immediately and replies, framed on newlines, are
+    matched to queries in the order they were sent.  Lines received
+    while no query is waiting are logged and dropped.
+    """
+    transport = None
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._pending = deque()
+        self._buf = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            import socket
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
+
+    def scpiset(self, cmd):
+        logger.debug('scpiset %r', cmd)
+        self.transport.write(_to_bytes(cmd))
+
+    def scpiget(self, cmd):
+        f = self._loop.create_future()
+        self._pending.append(f)
+        self.transport.write(_to_bytes(cmd))
+        logger.debug('scpiget %r', cmd)
+        return f
+
+    def data_received(self, data):
+        self._buf += data
+        while b'\n' in self._buf:
+            reply, self._buf = self._buf.split(b'\n', 1)
+            if not self._pending:
+                logger.warning('dropping unsolicited SCPI reply %r', reply)
+                continue
+            logger.debug('scpigot %r', reply)
+            f = self._pending.popleft()
+            if not f.cancelled():
+                f.set_result(_to_str(reply + b'\n'))
+
+    def connection_lost(self, exc):
+        for f in self._pending:
+            if not f.done():
+                f.set_exception(exc or AsyncioConnectorError(
+                    'SCPI connection closed'))
+        self._pending.clear()
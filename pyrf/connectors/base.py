@@ -1,5 +1,7 @@
 from functools import wraps
 
+from pyrf.vrt import InvalidDataReceived
+
 SCPI_PORT = 37001
 VRT_PORT = 37000
 
@@ -21,3 +23,43 @@ def sync_async(f):
     return wrapper
 
 
+
+
+class VRTReceiveBuffer(object):
+    """
+    Buffer for VRT data received in arbitrary chunks, used by the
+    asynchronous connectors.  Consuming data only advances an offset
+    and the buffer is compacted once at least half of it has been
+    consumed, so the cost per byte stays constant.
+    """
+    def __init__(self):
+        self._buf = bytearray()
+        self._offset = 0
+
+    def __len__(self):
+        return len(self._buf) - self._offset
+
+    def append(self, data):
+        """
+        Add received data to the end of the buffer
+        """
+        if self._offset and self._offset >= len(self._buf) // 2:
+            del self._buf[:self._offset]
+            self._offset = 0
+        self._buf.extend(data)
+
+    def packets(self):
+        """
+        Remove every complete VRT packet from the buffer, yielding
+        each one as a string of bytes
+        """
+        buf = self._buf
+        while len(buf) - self._offset >= 4:
+            start = self._offset
+            size = ((buf[start + 2] << 8) | buf[start + 3]) * 4
+            if size < 4:
+                raise InvalidDataReceived('invalid VRT packet size: %d' % size)
+            if len(buf) - start < size:
+                return
+            self._offset = start + size
+            yield bytes(buf[start:start + size])
@@ -1,51 +1,482 @@
 import socket
+import select
+import struct
+import time
+import threading
+from functools import wraps
 
 from pyrf.connectors.base import sync_async, SCPI_PORT, VRT_PORT
+from pyrf.vrt import (InvalidDataReceived, VRTDATA, parse_vrt_packet,
+    read_view, generate_gap_packet)
 
 import logging
 logger = logging.getLogger(__name__)
 
+# bytes requested from the VRT socket for each recv call
+DEFAULT_READ_CHUNK_SIZE = 256 * 1024
+
+# seconds between reconnect attempts, doubling up to the maximum
+DEFAULT_RECONNECT_DELAY = 0.1
+DEFAULT_RECONNECT_MAX_DELAY = 5.0
+# give up reconnecting after this many seconds
+DEFAULT_RECONNECT_TIMEOUT = 60.0
+
+
+def _to_str(data):
+    if isinstance(data, str):
+        return data
+    return data.decode('latin-1')
+
+
+def _to_bytes(data):
+    if isinstance(data, bytes):
+        return data
+    return data.encode('latin-1')
+
+
+def _reconnecting(f):
+    """
+    Decorator for SCPI methods that retries once after reconnecting
+    when the connection has dropped and reconnect is enabled
+    """
+    @wraps(f)
+    def wrapper(self, *args):
+        generation = self._generation
+        try:
+            return f(self, *args)
+        except socket.error as e:
+            if not self.reconnect or self._disconnecting:
+                raise
+            logger.warning('SCPI connection lost: %s', e)
+            self._reconnect(generation)
+            return f(self, *args)
+    return wrapper
+
+
 class PlainSocketConnector(object):
     """
     This connector makes SCPI/VRT socket connections using plain sockets.
+
+    VRT data is received in large chunks into a buffer so that many
+    packets are parsed for each system call.  Data packet payloads are
+    returned from :meth:`raw_read` as memoryviews of that buffer
+    without copying.  When the end of the buffer is reached the
+    unread data is moved to its start, or to a spare buffer while
+    views of the current one are still referenced, so a view stays
+    valid for as long as it is referenced.
+
+    :param recv_buffer_size: socket receive buffer size (SO_RCVBUF) for
+                             the VRT socket in bytes, or None to use the
+                             system default
+    :param read_chunk_size: bytes to receive from the VRT socket at once
+    :param reconnect: True to re-establish dropped connections, see below
+    :param reconnect_timeout: seconds to keep trying to reconnect
+    :param reconnect_delay: seconds before the second attempt, doubled
+                            for each following attempt
+    :param reconnect_max_delay: maximum seconds between attempts
+    :param scpi_port: TCP port of the SCPI connection
+    :param vrt_port: TCP port of the VRT connection
+    :param stats: a :class:`pyrf.connectors.stats.ConnectorStats` to
+                  update, or None
+
+    When *reconnect* is enabled and either connection drops, both are
+    re-established with exponential backoff and reconnect_callback is
+    called so the device can replay its settings.
+    :meth:`read_packet` then returns a context packet with a
+    'reconnect_gap' field holding the seconds lost before resuming.
+    The reconnects, last_gap and total_gap attributes record the
+    reconnections made and the time they took.
     """
 
+    def __init__(self, recv_buffer_size=None,
+            read_chunk_size=DEFAULT_READ_CHUNK_SIZE,
+            reconnect=False,
+            reconnect_timeout=DEFAULT_RECONNECT_TIMEOUT,
+            reconnect_delay=DEFAULT_RECONNECT_DELAY,
+            reconnect_max_delay=DEFAULT_RECONNECT_MAX_DELAY,
+            scpi_port=SCPI_PORT,
+            vrt_port=VRT_PORT,
+            stats=None):
+        self.recv_buffer_size = recv_buffer_size
+        self.read_chunk_size = read_chunk_size
+        self.reconnect = reconnect
+        self.reconnect_timeout = reconnect_timeout
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.scpi_port = scpi_port
+        self.vrt_port = vrt_port
+        self.stats = stats
+        self.reconnect_callback = None
+        self.reconnects = 0
+        self.last_gap = None
+        self.total_gap = 0.0
+        self._reconnect_lock = threading.RLock()
+        self._generation = 0
+        self._pending_gap = None
+        self._disconnecting = False
+        self._sock_scpi = None
+        self._sock_vrt = None
+        self._vrt_buf = bytearray()
+        self._vrt_spare = bytearray()
+        self._vrt_start = 0
+        self._vrt_end = 0
+        self._vrt_eof = False
+        self._scpi_buf = ''
+
     def connect(self, host):
+        self._host = host
+        self._disconnecting = False
+        self._pending_gap = None
+        self._open_sockets()
+
+    def _open_sockets(self):
         self._sock_scpi = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._sock_scpi.connect((host, SCPI_PORT))
+        self._sock_scpi.connect((self._host, self.scpi_port))
         self._sock_scpi.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
         self._sock_vrt = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._sock_vrt.connect((host, VRT_PORT))
+        if self.recv_buffer_size:
+            self._sock_vrt.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                self.recv_buffer_size)
+        if self.reconnect:
+            # notice a device that disappears without closing
+            for sock in (self._sock_scpi, self._sock_vrt):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, True)
+        self._sock_vrt.connect((self._host, self.vrt_port))
+        self._scpi_buf = ''
+        self._vrt_buf = bytearray()
+        self._vrt_start = 0
+        self._vrt_end = 0
+        self._vrt_eof = False
+
+    def _close_sockets(self):
+        for sock in (self._sock_scpi, self._sock_vrt):
+            if sock is None:
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sock.close()
+
+    def _reconnect(self, generation):
+        """
+        Re-establish both connections, retrying with exponential
+        backoff, then call reconnect_callback.  Does nothing if another
+        thread already reconnected since *generation* was read.
+        """
+        with self._reconnect_lock:
+            if generation != self._generation:
+                return
+            start = time.time()
+            delay = self.reconnect_delay
+            while True:
+                self._close_sockets()
+                try:
+                    self._open_sockets()
+                    break
+                except socket.error as e:
+                    if time.time() - start + delay > self.reconnect_timeout:
+                        raise
+                    logger.warning('reconnecting to %s failed: %s, '
+                        'retrying in %gs', self._host, e, delay)
+                    time.sleep(delay)
+                    delay = min(2 * delay, self.reconnect_max_delay)
+            self._generation += 1
+            self.reconnects += 1
+            if self.reconnect_callback:
+                self.reconnect_callback()
+            self.last_gap = time.time() - start
+            self.total_gap += self.last_gap
+            self._pending_gap = generate_gap_packet(self.last_gap)
+            logger.warning('reconnected to %s after %.3fs', self._host,
+                self.last_gap)
 
     def disconnect(self):
+        self._disconnecting = True
         self._sock_scpi.shutdown(socket.SHUT_RDWR)
         self._sock_scpi.close()
         self._sock_vrt.shutdown(socket.SHUT_RDWR)
         self._sock_vrt.close()
 
+    @_reconnecting
     def scpiset(self, cmd):
         cmd = "%s\n" % cmd
         logger.debug('scpiset %r', cmd)
-        self._sock_scpi.send(cmd)
+        if self.stats is not None:
+            self.stats.command_sent(cmd)
+        self._sock_scpi.send(_to_bytes(cmd))
 
+    @_reconnecting
+    def scpiset_many(self, cmds):
+        """
+        Send a list of SCPI commands in a single write
+        """
+        data = ''.join("%s\n" % cmd for cmd in cmds)
+        logger.debug('scpiset %r', data)
+        if self.stats is not None:
+            for cmd in cmds:
+                self.stats.command_sent(cmd)
+        self._sock_scpi.sendall(_to_bytes(data))
+
+    @_reconnecting
     def scpiget(self, cmd):
         cmd = "%s\n" % cmd
         logger.debug('scpiset %r', cmd)
-        self._sock_scpi.send(cmd)
-        buf = self._sock_scpi.recv(1024)
+        if self.stats is not None:
+            self.stats.command_sent(cmd)
+            start = time.time()
+        self._sock_scpi.sendall(_to_bytes(cmd))
+        buf = self._read_scpi_line()
         logger.debug('scpigot %r', buf)
+        if self.stats is not None:
+            self.stats.scpi_round_trip(time.time() - start)
         return buf
 
+    @_reconnecting
+    def scpiget_many(self, cmds):
+        """
+        Send a list of SCPI queries in a single write and return the
+        list of responses
+        """
+        data = ''.join("%s\n" % cmd for cmd in cmds)
+        logger.debug('scpiset %r', data)
+        if self.stats is None:
+            self._sock_scpi.sendall(_to_bytes(data))
+            responses = [self._read_scpi_line() for cmd in cmds]
+        else:
+            for cmd in cmds:
+                self.stats.command_sent(cmd)
+            start = time.time()
+            self._sock_scpi.sendall(_to_bytes(data))
+            responses = []
+            for cmd in cmds:
+                responses.append(self._read_scpi_line())
+                self.stats.scpi_round_trip(time.time() - start)
+        logger.debug('scpigot %r', responses)
+        return responses
+
+    def _read_scpi_line(self):
+        """
+        Return the next newline-terminated response, including the
+        newline
+        """
+        while '\n' not in self._scpi_buf:
+            data = self._sock_scpi.recv(4096)
+            if not data:
+                raise socket.error('SCPI connection closed')
+            self._scpi_buf += _to_str(data)
+        line, self._scpi_buf = self._scpi_buf.split('\n', 1)
+        return line + '\n'
+
     def eof(self):
-        # FIXME: lies
-        return False
+        """
+        Return True if the VRT connection was closed and every packet
+        received before that has been read
+        """
+        return self._vrt_eof and not self._packet_buffered()
 
     def has_data(self):
-        # FIXME: broken
-        return self._vrt.has_data()
+        """
+        Return True if a complete packet is waiting to be read, so a
+        read would not block.  Data already received is buffered, but
+        a partial packet does not count.
+        """
+        self._wait_for_packet(0)
+        return bool(self._pending_gap) or self._packet_buffered()
 
     def raw_read(self, num):
-        return socketread(self._sock_vrt, num)
+        """
+        Return the next *num* bytes received from the VRT socket, as a
+        memoryview for reads of pyrf.vrt.ZERO_COPY_MIN bytes or more, or
+        False if the connection was closed.
+        """
+        if self._vrt_end - self._vrt_start < num:
+            if not self._fill_vrt_buffer(num):
+                return False
+        start = self._vrt_start
+        self._vrt_start += num
+        return read_view(memoryview(self._vrt_buf), start, num)
+
+    def read_packet(self, timeout=None):
+        """
+        Read and parse the next VRT packet.  If reconnect is enabled and
+        the connection dropped, a context packet with a 'reconnect_gap'
+        field is returned once the connection is re-established.
+
+        :param timeout: seconds to wait for a packet, or None to wait
+                        forever
+        :returns: a :class:`pyrf.vrt.DataPacket` or
+                  :class:`pyrf.vrt.ContextPacket`, False if the
+                  connection was closed or None if no packet arrived
+                  within *timeout*
+        """
+        data = self.read_raw_packet(timeout)
+        if data is None or data is False:
+            return data
+        return parse_vrt_packet(data)
+
+    def read_raw_packet(self, timeout=None):
+        """
+        Return the bytes of the next VRT packet without parsing it, as
+        a memoryview valid until the next read, False if the connection
+        was closed or None if no packet arrived within *timeout*
+        seconds
+        """
+        if timeout is not None and not self._wait_for_packet(timeout):
+            return None
+        return self._receive_vrt_packet()
+
+    def read_many(self, max_packets, timeout=None):
+        """
+        Wait for a VRT packet, then return it along with the packets
+        that follow it without waiting any longer
+
+        :param max_packets: maximum number of packets to return
+        :param timeout: seconds to wait for the first packet, or None
+                        to wait forever
+        :returns: a list of parsed packets, empty if none arrived
+                  within *timeout* or the connection was closed
+        """
+        packets = []
+        while len(packets) < max_packets:
+            packet = self.read_packet(timeout)
+            if packet is None or packet is False:
+                break
+            packets.append(packet)
+            timeout = 0
+        return packets
+
+    def _packet_buffered(self):
+        """
+        Return True if a complete VRT packet is in the buffer
+        """
+        available = self._vrt_end - self._vrt_start
+        if available < 4:
+            return False
+        return available >= self._buffered_packet_size()
+
+    def _buffered_packet_size(self):
+        (word,) = struct.unpack('>I',
+            bytes(self._vrt_buf[self._vrt_start:self._vrt_start + 4]))
+        return (word & 0xffff) * 4
+
+    def _wait_for_packet(self, timeout):
+        """
+        Receive until a complete VRT packet is buffered or the
+        connection is closed, for at most *timeout* seconds.  Returns
+        False if there is still nothing to read after *timeout*.
+        """
+        deadline = time.time() + timeout
+        while not (self._pending_gap or self._packet_buffered()):
+            if self._vrt_eof:
+                return True
+            readable, _w, _x = select.select([self._sock_vrt], [], [],
+                max(0, deadline - time.time()))
+            if not readable:
+                return False
+            available = self._vrt_end - self._vrt_start
+            self._reserve_vrt_buffer(self._buffered_packet_size()
+                if available >= 4 else 4)
+            try:
+                received = self._recv_vrt()
+            except socket.error:
+                # let the read report the error or reconnect
+                return True
+            if not received:
+                return True
+        return True
+
+    def _receive_vrt_packet(self):
+        """
+        :meth:`_read_vrt_packet`, reconnecting if enabled when the
+        connection drops and returning a gap packet in its place
+        """
+        while True:
+            if self._pending_gap:
+                data, self._pending_gap = self._pending_gap, None
+                return data
+            generation = self._generation
+            try:
+                data = self._read_vrt_packet()
+            except socket.error as e:
+                if not self.reconnect or self._disconnecting:
+                    raise
+                logger.warning('VRT connection lost: %s', e)
+                data = False
+            if data is not False or not self.reconnect or self._disconnecting:
+                return data
+            self._reconnect(generation)
+
+    def _read_vrt_packet(self):
+        """
+        Return the next complete VRT packet received as a memoryview,
+        or False if the connection was closed.
+        """
+        if self._vrt_end - self._vrt_start < 4:
+            if not self._fill_vrt_buffer(4):
+                return False
+        (word,) = struct.unpack('>I',
+            bytes(self._vrt_buf[self._vrt_start:self._vrt_start + 4]))
+        num = (word & 0xffff) * 4
+        if num < 4:
+            raise InvalidDataReceived('invalid VRT packet size: %d' % num)
+        if self._vrt_end - self._vrt_start < num:
+            if not self._fill_vrt_buffer(num):
+                return False
+        start = self._vrt_start
+        self._vrt_start += num
+        if self.stats is not None:
+            (stream_id,) = struct.unpack('>I',
+                bytes(self._vrt_buf[start + 4:start + 8]))
+            self.stats.packet_received(stream_id, num,
+                word >> 28 == VRTDATA)
+        return memoryview(self._vrt_buf)[start:start + num]
+
+    def _fill_vrt_buffer(self, num):
+        """
+        Receive until at least *num* bytes are available in the buffer
+        """
+        self._reserve_vrt_buffer(num)
+        while self._vrt_end - self._vrt_start < num:
+            if not self._recv_vrt():
+                return False
+        return True
+
+    def _reserve_vrt_buffer(self, num):
+        """
+        Make room for at least *num* bytes from the current position
+        """
+        if self._vrt_start + num <= len(self._vrt_buf):
+            return
+        available = self._vrt_end - self._vrt_start
+        size = max(num, self.read_chunk_size)
+        buf = self._vrt_buf
+        if len(buf) < size or _exported(buf):
+            # data already returned is still referenced, switch to the
+            # spare buffer unless it is referenced too
+            buf, self._vrt_spare = self._vrt_spare, buf
+            if len(buf) < size or _exported(buf):
+                buf = bytearray(size)
+        buf[:available] = self._vrt_buf[self._vrt_start:self._vrt_end]
+        self._vrt_buf = buf
+        self._vrt_start = 0
+        self._vrt_end = available
+
+    def _recv_vrt(self):
+        """
+        Receive once into the free space at the end of the buffer,
+        returning the number of bytes received, 0 when the connection
+        was closed
+        """
+        received = self._sock_vrt.recv_into(
+            memoryview(self._vrt_buf)[self._vrt_end:])
+        if not received:
+            self._vrt_eof = True
+            return 0
+        if self.stats is not None:
+            self.stats.recv_call(received)
+        self._vrt_end += received
+        return received
 
     def sync_async(self, gen):
         """
@@ -60,21 +491,14 @@ class PlainSocketConnector(object):
             return val
 
 
-def socketread(socket, count, flags = None):
+def _exported(buf):
     """
-    Retry socket read until count data received,
-    like reading from a file.
+    Return True if memoryviews of bytearray *buf* are still referenced
     """
-    if not flags:
-        flags = 0
-    data = socket.recv(count, flags)
-    datalen = len(data)
-
-    if datalen == 0:
-        return False
-
-    while datalen < count:
-        data = data + socket.recv(count - datalen)
-        datalen = len(data)
-
-    return data
+    try:
+        # a bytearray with views cannot change size
+        buf.append(0)
+    except BufferError:
+        return True
+    del buf[-1]
+    return False
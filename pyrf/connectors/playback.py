@@ -0,0 +1,373 @@
+import time
+import struct
+
+from pyrf.vrt import parse_vrt_packet
+from pyrf.simulator.device import SimulatedWSA
+
+import logging
+logger = logging.getLogger(__name__)
+
+# identifier used for recordings made before it was saved
+UNKNOWN_DEVICE_ID = 'ThinkRF,WSA5000 v3,0,0'
+
+# pacing restarts instead of waiting when timestamps jump further
+# than this many seconds, e.g. where a recording was paused
+MAX_PACING_GAP = 1.0
+
+# speca device_settings keys that differ from the device settings
+SPECA_SETTINGS = {
+    'preselect_filter': 'preselect',
+    }
+
+
+class PlaybackConnectorError(Exception):
+    pass
+
+
+def _context_fields_offset(raw):
+    """
+    Return the offset of the first field of a raw context packet,
+    following the header, stream id, the class id and timestamps
+    present according to the header, and the indicator word
+    """
+    (word,) = struct.unpack_from('>I', raw, 0)
+    offset = 8
+    if word & (1 << 27):
+        offset += 8
+    if (word >> 22) & 0x03:
+        offset += 4
+    if (word >> 20) & 0x03:
+        offset += 8
+    return offset + 4
+
+
+class _RecordedWSA(SimulatedWSA):
+    """
+    A :class:`pyrf.simulator.device.SimulatedWSA` that answers SCPI
+    but leaves the data to the recording
+    """
+    def _capture(self, settings, freq, spp, ppb, custom=None):
+        return []
+
+
+class PlaybackConnector(object):
+    """
+    A connector that replays VRT packets from a recording made with
+    :meth:`pyrf.devices.thinkrf.WSA.set_recording_output`, so that
+    :class:`pyrf.sweep_device.SweepDevice`,
+    :class:`pyrf.capture_device.CaptureDevice` and whole analysis
+    pipelines may be run against real captures without hardware.
+
+    .. code-block:: python
+
+       dut = WSA(connector=PlaybackConnector('capture.vrt'))
+       dut.connect('playback')
+
+    SCPI commands and queries are answered from the speca state saved
+    in the recording, updated as state packets are replayed.  Data is
+    served in recorded order whatever was requested, except that
+    sweep and stream ids are rewritten to the ids of the last
+    :meth:`pyrf.devices.thinkrf.WSA.sweep_start` or
+    :meth:`pyrf.devices.thinkrf.WSA.stream_start`.  When a sweep is
+    started after data was replayed, data is skipped up to the start
+    of the next recorded sweep.
+
+    :param recording: recording filename or a file object open for
+                      reading in binary mode
+    :param paced: True to deliver data packets at the rate they were
+                  recorded, according to their timestamps, False to
+                  deliver them as fast as possible
+    :param loop: True to rewind the recording when it ends instead of
+                 reporting end of file
+    :param device_identifier: ``*IDN?`` response to use instead of the
+                              one saved in the recording
+    """
+    def __init__(self, recording, paced=False, loop=False,
+            device_identifier=None):
+        self.recording = recording
+        self.paced = paced
+        self.loop = loop
+        self.device_identifier = device_identifier
+        self.device = None
+        self.speca_state = {}
+        self.packets_read = 0
+        self.bytes_read = 0
+        self.packets_skipped = 0
+        self.rewinds = 0
+        self._file = None
+        self._eof = False
+        self._current = None
+        self._offset = 0
+
+    def connect(self, host):
+        """
+        Open the recording and load its initial state.  *host* is
+        ignored.
+        """
+        if hasattr(self.recording, 'read'):
+            self._file = self.recording
+        else:
+            self._file = open(self.recording, 'rb')
+        self._rewind()
+        state = self._first_state()
+        device_id = (self.device_identifier
+            or state.get('device_identifier', 'unknown'))
+        if device_id == 'unknown':
+            # support old playback files
+            device_id = UNKNOWN_DEVICE_ID
+        self.device = _RecordedWSA(device_id)
+        self._apply_speca_state(state)
+        self._sweep_id = None
+        self._stream_id = None
+
+    def _first_state(self):
+        """
+        Return the speca state at the start of the recording, which
+        is replayed again as the first packet
+        """
+        raw = self._read_raw()
+        self._rewind()
+        if raw is False:
+            raise PlaybackConnectorError('recording is empty')
+        packet = parse_vrt_packet(raw)
+        if packet.is_context_packet() and 'speca' in packet.fields:
+            return packet.fields['speca']
+        return {}
+
+    def _rewind(self):
+        self._file.seek(0)
+        self._eof = False
+        self._current = None
+        self._aligning = False
+        self._replayed = False
+        self._last_rffreq = None
+        self._recorded_sweep_id = None
+        self._pace_origin = None
+        self._pace_last = None
+
+    def disconnect(self):
+        if self._file is not self.recording:
+            self._file.close()
+        self._eof = True
+
+    def scpiset(self, cmd):
+        logger.debug('scpiset %r', cmd)
+        self._command(cmd)
+
+    def scpiset_many(self, cmds):
+        for cmd in cmds:
+            self.scpiset(cmd)
+
+    def scpiget(self, cmd):
+        logger.debug('scpiset %r', cmd)
+        buf = self._command(cmd) + '\n'
+        logger.debug('scpigot %r', buf)
+        return buf
+
+    def scpiget_many(self, cmds):
+        return [self.scpiget(cmd) for cmd in cmds]
+
+    def _command(self, cmd):
+        reply = None
+        for line in cmd.split('\n'):
+            if not line.strip():
+                continue
+            reply = self.device.scpi(line)
+            header, _space, arg = line.strip().partition(' ')
+            header = header.lstrip(':').upper()
+            if header == 'SWEEP:LIST:START':
+                self._sweep_id = int(arg) if arg.strip() else 0
+                self._stream_id = None
+                self._aligning = self._replayed
+            elif header == 'TRACE:STREAM:START':
+                self._stream_id = int(arg) if arg.strip() else 0
+                self._sweep_id = None
+        return reply or ''
+
+    def _apply_speca_state(self, state):
+        """
+        Update the device settings from a recorded speca state
+        """
+        self.speca_state = state
+        settings = self.device.settings
+        mode = state.get('mode')
+        if mode:
+            settings['rfe_mode'] = (
+                mode[6:] if mode.startswith('Sweep ') else mode)
+        if 'center' in state:
+            settings['freq'] = int(state['center'])
+        for key in ('decimation', 'fshift'):
+            if key in state:
+                settings[key] = int(state[key])
+        for key, value in state.get('device_settings', {}).items():
+            if key == 'trigger':
+                settings['trigger_type'] = value['type'].upper()
+                settings['trigger_level'] = (int(value['fstart']),
+                    int(value['fstop']), int(value['amplitude']))
+                continue
+            key = SPECA_SETTINGS.get(key, key)
+            if key not in settings:
+                continue
+            if isinstance(value, bool):
+                value = int(value)
+            elif hasattr(value, 'upper'):
+                value = value.upper()
+            settings[key] = value
+
+    def sync_async(self, gen):
+        """
+        Handler for the @sync_async decorator.  We convert the
+        generator to a single return value for simple synchronous use.
+        """
+        val = None
+        try:
+            while True:
+                val = gen.send(val)
+        except StopIteration:
+            return val
+
+    def eof(self):
+        return self._eof
+
+    def has_data(self):
+        return not self._eof
+
+    def raw_read(self, num):
+        """
+        Return the next *num* bytes of the recording, or False at the
+        end of the recording.  Reads must not cross packet boundaries,
+        as is the case for :func:`pyrf.vrt.vrt_packet_reader`.
+        """
+        if self._current is None:
+            self._current, packet = self._next_packet()
+            self._offset = 0
+            if self._current is False:
+                self._current = None
+                return False
+        start = self._offset
+        self._offset += num
+        data = self._current[start:start + num]
+        if self._offset >= len(self._current):
+            self._current = None
+        if len(data) < num:
+            raise PlaybackConnectorError('read crosses VRT packet boundary')
+        return bytes(data)
+
+    def read_packet(self, timeout=None):
+        """
+        Return the next packet of the recording parsed, or False at the
+        end of the recording.  Must not be mixed with partial reads
+        using :meth:`raw_read`.
+
+        :param timeout: accepted for compatibility with other
+                        connectors, the recording always has data
+        """
+        raw, packet = self._next_packet()
+        return packet
+
+    def read_many(self, max_packets, timeout=None):
+        """
+        Return up to *max_packets* packets from the recording, fewer
+        only at the end of the recording
+        """
+        packets = []
+        while len(packets) < max_packets:
+            packet = self.read_packet()
+            if packet is False:
+                break
+            packets.append(packet)
+        return packets
+
+    def _next_packet(self):
+        """
+        Return (raw bytes, parsed packet) for the next packet to
+        deliver, or (False, False) at the end of the recording
+        """
+        while True:
+            raw = self._read_raw()
+            if raw is False:
+                if not self.loop or not self.packets_read:
+                    self._eof = True
+                    return False, False
+                self._rewind()
+                self.rewinds += 1
+                continue
+            self.packets_read += 1
+            self.bytes_read += len(raw)
+            packet = parse_vrt_packet(raw)
+
+            if packet.is_context_packet():
+                packet = self._replay_context(raw, packet)
+                if 'speca' not in packet.fields:
+                    self._replayed = True
+                return raw, packet
+
+            if self._aligning:
+                self.packets_skipped += 1
+                continue
+            self._replayed = True
+            if self.paced:
+                self._pace(packet.tsi + packet.tsf * 1e-12)
+            return raw, packet
+
+    def _replay_context(self, raw, packet):
+        """
+        Track recorded sweeps and state, rewriting sweep and stream ids
+        in raw and returning the packet parsed again when they change
+        """
+        fields = packet.fields
+        if 'speca' in fields:
+            self._apply_speca_state(fields['speca'])
+        if 'rffreq' in fields:
+            if (self._last_rffreq is not None
+                    and fields['rffreq'] <= self._last_rffreq):
+                # frequency wrapped around, a new sweep started
+                self._aligning = False
+            self._last_rffreq = fields['rffreq']
+        if 'sweepid' in fields:
+            if fields['sweepid'] != self._recorded_sweep_id:
+                self._aligning = False
+                self._recorded_sweep_id = fields['sweepid']
+            if self._sweep_id is not None:
+                return self._rewrite_id(raw, self._sweep_id)
+        if 'streamid' in fields and self._stream_id is not None:
+            return self._rewrite_id(raw, self._stream_id)
+        return packet
+
+    def _rewrite_id(self, raw, value):
+        struct.pack_into('>I', raw, _context_fields_offset(raw), value)
+        return parse_vrt_packet(raw)
+
+    def _pace(self, timestamp):
+        """
+        Wait until the time a data packet stamped *timestamp* should be
+        delivered relative to the first packet paced
+        """
+        now = time.time()
+        if (self._pace_origin is None
+                or not 0 <= timestamp - self._pace_last <= MAX_PACING_GAP):
+            self._pace_origin = (timestamp, now)
+        else:
+            origin, start = self._pace_origin
+            delay = start + (timestamp - origin) - now
+            if delay > 0:
+                time.sleep(delay)
+        self._pace_last = timestamp
+
+    def _read_raw(self):
+        """
+        Return the next packet in the recording as a bytearray, or
+        False at the end of the recording
+        """
+        header = self._file.read(4)
+        if len(header) < 4:
+            return False
+        (word,) = struct.unpack('>I', header)
+        num = (word & 0xffff) * 4
+        if num < 4:
+            raise PlaybackConnectorError('invalid VRT packet size: %d' % num)
+        rest = self._file.read(num - 4)
+        if len(rest) < num - 4:
+            logger.warning('recording ends with a partial packet')
+            return False
+        return bytearray(header + rest)
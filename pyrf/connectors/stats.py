@@ -0,0 +1,194 @@
+import time
+from bisect import bisect_left
+
+import logging
+logger = logging.getLogger(__name__)
+
+# upper edges in seconds of the SCPI round trip histogram buckets,
+# slower round trips are counted in a final overflow bucket
+SCPI_LATENCY_BUCKETS = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005,
+    0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+# commands after which data packets are expected
+START_COMMANDS = ('TRACE:BLOCK:DATA?', 'SWEEP:LIST:START',
+    'TRACE:STREAM:START')
+
+
+class ConnectorStats(object):
+    """
+    Throughput and latency counters for a connector, enabled by
+    passing an instance as the *stats* argument of a connector.
+
+    The connector reports each VRT packet and each receive system call,
+    the SCPI commands it sends and the time taken by SCPI queries.
+    :meth:`snapshot` returns the totals and rates since the last
+    :meth:`reset`, and a line summarizing the last interval is logged
+    every *log_interval* seconds while packets are being received.
+
+    .. code-block:: python
+
+       stats = ConnectorStats(log_interval=10)
+       dut = WSA(connector=PlainSocketConnector(stats=stats))
+
+    :param log_interval: seconds between log lines, or None to disable
+                         logging
+    """
+    def __init__(self, log_interval=None):
+        self.log_interval = log_interval
+        self.reset()
+
+    def reset(self):
+        """
+        Reset all counters to zero
+        """
+        self.start_time = time.time()
+        self.packets = 0
+        self.bytes = 0
+        self.streams = {}
+        self.recv_calls = 0
+        self.recv_bytes = 0
+        self.scpi_commands = 0
+        self.scpi_queries = 0
+        self.scpi_latency_total = 0.0
+        self.scpi_latency_max = 0.0
+        self.scpi_latency_histogram = [0] * (len(SCPI_LATENCY_BUCKETS) + 1)
+        self.starts = 0
+        self.start_latency_last = None
+        self.start_latency_total = 0.0
+        self.start_latency_max = 0.0
+        self.queue_depth = 0
+        self.queue_depth_max = 0
+        self._start_pending = None
+        self._last_log = (self.start_time, 0, 0, 0)
+
+    def packet_received(self, stream_id, size, data):
+        """
+        Count a VRT packet received
+
+        :param stream_id: the packet's stream id
+        :param size: packet size in bytes
+        :param data: True for data packets, False for context packets
+        """
+        self.packets += 1
+        self.bytes += size
+        counts = self.streams.get(stream_id)
+        if counts is None:
+            counts = self.streams[stream_id] = [0, 0]
+        counts[0] += 1
+        counts[1] += size
+        if data and self._start_pending is not None:
+            latency = time.time() - self._start_pending
+            self._start_pending = None
+            self.starts += 1
+            self.start_latency_last = latency
+            self.start_latency_total += latency
+            self.start_latency_max = max(self.start_latency_max, latency)
+        if self.log_interval:
+            self._maybe_log()
+
+    def recv_call(self, size):
+        """
+        Count a receive system call on the VRT connection
+
+        :param size: bytes received
+        """
+        self.recv_calls += 1
+        self.recv_bytes += size
+
+    def command_sent(self, cmd):
+        """
+        Count a SCPI command or query sent.  Capture, sweep and stream
+        start commands begin timing until the next data packet; while
+        one is being timed later starts are not.
+        """
+        self.scpi_commands += 1
+        if self._start_pending is None:
+            header = cmd.strip().lstrip(':').upper()
+            if header.startswith(START_COMMANDS):
+                self._start_pending = time.time()
+
+    def scpi_round_trip(self, seconds):
+        """
+        Record the time from sending a SCPI query to receiving its
+        response
+        """
+        self.scpi_queries += 1
+        self.scpi_latency_total += seconds
+        self.scpi_latency_max = max(self.scpi_latency_max, seconds)
+        self.scpi_latency_histogram[
+            bisect_left(SCPI_LATENCY_BUCKETS, seconds)] += 1
+
+    def queue_depth_changed(self, depth):
+        """
+        Record the number of packets waiting in a connector's queue
+        """
+        self.queue_depth = depth
+        if depth > self.queue_depth_max:
+            self.queue_depth_max = depth
+
+    def snapshot(self):
+        """
+        Return a dict of the counters and the rates since the last
+        reset.  'streams' maps each stream id to a dict of packets,
+        bytes and their rates, and 'scpi_latency_histogram' is a
+        list of (upper bucket edge in seconds, count) with None as
+        the edge of the overflow bucket.
+        """
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        streams = {}
+        for stream_id, (packets, size) in self.streams.items():
+            streams[stream_id] = {
+                'packets': packets,
+                'bytes': size,
+                'packets_per_second': packets / elapsed,
+                'bytes_per_second': size / elapsed,
+                }
+        return {
+            'elapsed': elapsed,
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'packets_per_second': self.packets / elapsed,
+            'bytes_per_second': self.bytes / elapsed,
+            'streams': streams,
+            'recv_calls': self.recv_calls,
+            'recv_calls_per_packet': (float(self.recv_calls) / self.packets
+                if self.packets else None),
+            'scpi_commands': self.scpi_commands,
+            'scpi_queries': self.scpi_queries,
+            'scpi_latency_mean': (self.scpi_latency_total / self.scpi_queries
+                if self.scpi_queries else None),
+            'scpi_latency_max': self.scpi_latency_max,
+            'scpi_latency_histogram': list(zip(
+                SCPI_LATENCY_BUCKETS + (None,), self.scpi_latency_histogram)),
+            'starts': self.starts,
+            'start_latency_last': self.start_latency_last,
+            'start_latency_mean': (self.start_latency_total / self.starts
+                if self.starts else None),
+            'start_latency_max': self.start_latency_max,
+            'queue_depth': self.queue_depth,
+            'queue_depth_max': self.queue_depth_max,
+            }
+
+    def _maybe_log(self):
+        now = time.time()
+        last_time, last_packets, last_bytes, last_recv = self._last_log
+        elapsed = now - last_time
+        if elapsed < self.log_interval:
+            return
+        self._last_log = (now, self.packets, self.bytes, self.recv_calls)
+        packets = self.packets - last_packets
+        line = 'VRT %.1f MB/s, %.0f packets/s, %.2f recv/packet' % (
+            (self.bytes - last_bytes) / elapsed / 1e6,
+            packets / elapsed,
+            float(self.recv_calls - last_recv) / packets)
+        if self.start_latency_last is not None:
+            line += ', start to data %.1f ms' % (
+                self.start_latency_last * 1e3)
+        if self.scpi_queries:
+            line += ', SCPI round trip %.1f ms mean %.1f ms max' % (
+                self.scpi_latency_total / self.scpi_queries * 1e3,
+                self.scpi_latency_max * 1e3)
+        if self.queue_depth_max:
+            line += ', queue %d max %d' % (self.queue_depth,
+                self.queue_depth_max)
+        logger.info(line)
@@ -0,0 +1,250 @@
+import time
+import threading
+from collections import deque
+
+from pyrf.connectors.blocking import PlainSocketConnector
+from pyrf.vrt import VRTDATA, read_view
+
+import logging
+logger = logging.getLogger(__name__)
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+QUEUE_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+DEFAULT_QUEUE_PACKETS = 1024
+
+
+class ThreadedConnectorError(Exception):
+    pass
+
+
+def _is_data_packet(packet):
+    return bytearray(packet[0:1])[0] >> 4 == VRTDATA
+
+
+class ThreadedSocketConnector(PlainSocketConnector):
+    """
+    A :class:`pyrf.connectors.blocking.PlainSocketConnector` that reads
+    the VRT socket continuously on a background thread into a bounded
+    packet queue, so a consumer that stalls does not stall the device.
+
+    When the queue is full data packets are handled according to
+    *policy*.  Context packets are small and are always queued, so
+    sweep and reference level information is never lost.
+
+    :param max_packets: number of data packets the queue may hold
+    :param policy: 'block' to stop reading until there is room in the
+                   queue, 'drop_oldest' to discard the oldest queued
+                   data packet or 'drop_newest' to discard the packet
+                   just received
+    :param recv_buffer_size: socket receive buffer size (SO_RCVBUF) for
+                             the VRT socket in bytes
+
+    Other keyword arguments, e.g. reconnect, are passed on to
+    :class:`pyrf.connectors.blocking.PlainSocketConnector`.  Reconnecting
+    is done from the reader thread, and the 'reconnect_gap' context
+    packet is queued in order with the data packets.  When *stats* is
+    given the queue depth is reported to it as well.
+    """
+
+    def __init__(self, max_packets=DEFAULT_QUEUE_PACKETS, policy=DROP_OLDEST,
+            recv_buffer_size=None, **kwargs):
+        if policy not in QUEUE_POLICIES:
+            raise ThreadedConnectorError('unknown policy: %r' % (policy,))
+        super(ThreadedSocketConnector, self).__init__(
+            recv_buffer_size=recv_buffer_size, **kwargs)
+        self.max_packets = max_packets
+        self.policy = policy
+        self._queue = deque()
+        self._queued_data_packets = 0
+        self._cond = threading.Condition()
+        self._reader = None
+        self._closed = False
+        self._current = None
+        self._offset = 0
+        self.reset_counters()
+
+    def reset_counters(self):
+        """
+        Reset the packet and byte counters to zero
+        """
+        self.packets_received = 0
+        self.bytes_received = 0
+        self.dropped_packets = 0
+        self.dropped_bytes = 0
+
+    def connect(self, host):
+        super(ThreadedSocketConnector, self).connect(host)
+        self._queue.clear()
+        self._queued_data_packets = 0
+        self._closed = False
+        self._current = None
+        self._reader = threading.Thread(target=self._read_loop,
+            name='pyrf VRT reader')
+        self._reader.daemon = True
+        self._reader.start()
+
+    def disconnect(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        super(ThreadedSocketConnector, self).disconnect()
+        self._reader.join()
+
+    def queued_packets(self):
+        """
+        Return the number of packets waiting in the queue
+        """
+        return len(self._queue)
+
+    def discard_queued(self):
+        """
+        Discard all packets waiting in the queue, e.g. after a flush
+        """
+        with self._cond:
+            self._queue.clear()
+            self._queued_data_packets = 0
+            self._cond.notify_all()
+        self._current = None
+
+    def raw_read(self, num):
+        """
+        Return the next *num* bytes received from the VRT socket, or
+        False if the connection was closed.  Reads are served from
+        the queued packets and must not cross packet boundaries, as
+        is the case for :func:`pyrf.vrt.vrt_packet_reader`.
+        """
+        if self._current is None:
+            self._current = self._next_packet()
+            self._offset = 0
+            if self._current is False:
+                self._current = None
+                return False
+        start = self._offset
+        self._offset += num
+        if self._offset > len(self._current):
+            raise ThreadedConnectorError('read crosses VRT packet boundary')
+        data = read_view(memoryview(self._current), start, num)
+        if self._offset >= len(self._current):
+            self._current = None
+        return data
+
+    def read_raw_packet(self, timeout=None):
+        """
+        Return the bytes of the next queued VRT packet without parsing
+        it, False if the connection was closed or None if no packet
+        arrived within *timeout* seconds.  Must not be mixed with
+        partial reads using :meth:`raw_read`.
+        """
+        return self._next_packet(timeout)
+
+    def read_many(self, max_packets, timeout=None):
+        """
+        Wait for a VRT packet, then return it along with the packets
+        already queued after it
+
+        :param max_packets: maximum number of packets to return
+        :param timeout: seconds to wait for the first packet, or None
+                        to wait forever
+        :returns: a list of parsed packets, empty if none arrived
+                  within *timeout* or the connection was closed
+        """
+        packets = []
+        while len(packets) < max_packets:
+            packet = self.read_packet(timeout)
+            if packet is None or packet is False:
+                break
+            packets.append(packet)
+            timeout = 0
+        return packets
+
+    def has_data(self):
+        return self._current is not None or bool(self._queue)
+
+    def eof(self):
+        return self._closed and self._current is None and not any(
+            packet is not False for packet in self._queue)
+
+    def _next_packet(self, timeout=None):
+        """
+        Return the next queued packet, False if the connection was
+        closed or None after waiting *timeout* seconds
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._cond:
+            while not self._queue:
+                if self._closed:
+                    return False
+                if timeout is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            packet = self._queue.popleft()
+            if packet is not False and _is_data_packet(packet):
+                self._queued_data_packets -= 1
+            if self.stats is not None:
+                self.stats.queue_depth_changed(len(self._queue))
+            self._cond.notify_all()
+            return packet
+
+    def _read_loop(self):
+        while True:
+            try:
+                packet = self._receive_vrt_packet()
+            except Exception as e:
+                if not self._closed:
+                    logger.error('VRT reader stopped: %s', e)
+                packet = False
+            with self._cond:
+                if packet is False:
+                    self._closed = True
+                    self._queue.append(False)
+                    self._cond.notify_all()
+                    return
+                self.packets_received += 1
+                self.bytes_received += len(packet)
+                if _is_data_packet(packet):
+                    if not self._make_room(packet):
+                        continue
+                    self._queued_data_packets += 1
+                self._queue.append(packet)
+                if self.stats is not None:
+                    self.stats.queue_depth_changed(len(self._queue))
+                self._cond.notify_all()
+
+    def _make_room(self, packet):
+        """
+        Apply the queue policy for a new data packet, called with
+        self._cond held.  Returns False if the packet was dropped.
+        """
+        if self._queued_data_packets < self.max_packets:
+            return True
+        if self.policy == BLOCK:
+            while (self._queued_data_packets >= self.max_packets
+                    and not self._closed):
+                self._cond.wait()
+            return not self._closed
+        if self.policy == DROP_NEWEST:
+            self._drop(packet)
+            return False
+        for i, old in enumerate(self._queue):
+            if _is_data_packet(old):
+                del self._queue[i]
+                self._queued_data_packets -= 1
+                self._drop(old)
+                break
+        return True
+
+    def _drop(self, packet):
+        self.dropped_packets += 1
+        self.dropped_bytes += len(packet)
+        if self.dropped_packets == 1 or not self.dropped_packets % 100:
+            logger.warning('VRT queue full, %d packets dropped',
+                self.dropped_packets)
@@ -1,3 +1,6 @@
+import time
+from collections import deque
+
 try:
     from twisted.internet.protocol import Factory, Protocol
     from twisted.internet import defer
@@ -12,13 +15,9 @@ except ImportError:
     # imports fail
     Factory = Protocol = StatefulProtocol = object
 
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
-
-from pyrf.connectors.base import sync_async, SCPI_PORT, VRT_PORT
-from pyrf.vrt import vrt_packet_reader, generate_speca_packet
+from pyrf.connectors.base import (sync_async, SCPI_PORT, VRT_PORT,
+    VRTReceiveBuffer)
+from pyrf.vrt import parse_vrt_packet, generate_speca_packet
 
 import logging
 logger = logging.getLogger(__name__)
@@ -34,20 +33,30 @@ class TwistedConnector(object):
     A callback may be assigned to vrt_callback that will be called
     with VRT packets as they arrive.  When .vrt_callback is None
     (the default) arriving packets will be ignored.
+
+    :param scpi_port: TCP port of the SCPI connection
+    :param vrt_port: TCP port of the VRT connection
+    :param stats: a :class:`pyrf.connectors.stats.ConnectorStats` to
+                  update, or None
     """
-    def __init__(self, reactor, vrt_callback=None):
+    def __init__(self, reactor, vrt_callback=None, scpi_port=SCPI_PORT,
+            vrt_port=VRT_PORT, stats=None):
         self._reactor = reactor
         self.vrt_callback = vrt_callback
+        self.scpi_port = scpi_port
+        self.vrt_port = vrt_port
+        self.stats = stats
 
     def connect(self, host, output_file=None):
-        point = HostnameEndpoint(self._reactor, host, SCPI_PORT)
+        point = HostnameEndpoint(self._reactor, host, self.scpi_port)
         d = point.connect(SCPIClientFactory())
 
         @d.addCallback
         def connect_vrt(scpi):
             self._scpi = scpi
-            point = HostnameEndpoint(self._reactor, host, VRT_PORT)
-            return point.connect(VRTClientFactory(self._vrt_callback))
+            point = HostnameEndpoint(self._reactor, host, self.vrt_port)
+            return point.connect(VRTClientFactory(self._vrt_callback,
+                self.stats))
 
         @d.addCallback
         def save_vrt(vrt):
@@ -66,10 +75,28 @@ class TwistedConnector(object):
         self._scpi.transport.loseConnection()
 
     def scpiset(self, cmd):
+        if self.stats is not None:
+            self.stats.command_sent(cmd)
         self._scpi.scpiset("%s\n" % cmd)
 
+    def scpiset_many(self, cmds):
+        if self.stats is not None:
+            for cmd in cmds:
+                self.stats.command_sent(cmd)
+        self._scpi.scpiset(''.join("%s\n" % cmd for cmd in cmds))
+
     def scpiget(self, cmd):
-        return self._scpi.scpiget("%s\n" % cmd)
+        if self.stats is None:
+            return self._scpi.scpiget("%s\n" % cmd)
+        self.stats.command_sent(cmd)
+        start = time.time()
+        d = self._scpi.scpiget("%s\n" % cmd)
+
+        @d.addCallback
+        def round_trip(response):
+            self.stats.scpi_round_trip(time.time() - start)
+            return response
+        return d
 
     def sync_async(self, gen):
         def advance(result):
@@ -94,6 +121,18 @@ class TwistedConnector(object):
             self.vrt_callback(packet)
 
 
+def _to_bytes(data):
+    if isinstance(data, bytes):
+        return data
+    return data.encode('latin-1')
+
+
+def _to_str(data):
+    if isinstance(data, str):
+        return data
+    return data.decode('latin-1')
+
+
 class VRTClient(Protocol):
     """
     A Twisted protocol for the VRT connection
@@ -106,45 +145,34 @@ class VRTClient(Protocol):
     _new_output_file = None
     _output_file = None
     _inject_recording_state = None
-    _at_vrt_boundary = True
 
-    def __init__(self, receive_callback):
+    def __init__(self, receive_callback, stats=None):
         self._receive_callback = receive_callback
-        self._output_data = []
+        self._stats = stats
 
     def makeConnection(self, transport):
         Protocol.makeConnection(self, transport)
-        self._buf = StringIO()
-        self._buf_offset = 0
-        self._resetReader()
-        self._processData()
+        self._buf = VRTReceiveBuffer()
 
     def set_recording_output(self, output_file=None):
         if not output_file:
             self._output_file = None
             self._new_output_file = None
-            self._output_data = []
         else:
             self._new_output_file = output_file
-        if self._at_vrt_boundary:
-            self._reached_vrt_boundary()
+        self._reached_vrt_boundary()
 
     def inject_recording_state(self, state):
         self._inject_recording_state = state
-        if self._at_vrt_boundary:
-            self._reached_vrt_boundary()
+        self._reached_vrt_boundary()
 
     def _reached_vrt_boundary(self):
         """
-        In between VRT packets we can record complete vrt packets
-        to start new recordings and inject speca state packets
-        into recordings.
+        In between VRT packets we can start new recordings and
+        inject speca state packets into recordings.  Packets are
+        only processed once complete, so this is always the case
+        outside of dataReceived.
         """
-        if self._output_file and self._output_data:
-            for d in self._output_data:
-                self._output_file.write(d)
-            self._output_data = []
-
         if self._new_output_file:
             self._output_file = self._new_output_file
             self._new_output_file = None
@@ -156,71 +184,32 @@ class VRTClient(Protocol):
             self._inject_recording_state = None
             self._output_file.write(data)
 
-    def _resetReader(self):
-        self._packet_reader = vrt_packet_reader(self._setBytesRequired)
-        next(self._packet_reader)
-
-    def _setBytesRequired(self, x):
-        self._bytes_required = x
-
-    def _processData(self):
-        """
-        If we have received enough bytes process it as VRT data and
-        call receive_callback if a complete packet was received.
-        """
-        while True:
-            data = self._bufConsume(self._bytes_required)
-            if not data:
-                break
-            self._at_vrt_boundary = False
-            if self._output_file:
-                self._output_data.append(data)
-            response = self._packet_reader.send(data)
-            if response:
-                self._at_vrt_boundary = True
-                self._reached_vrt_boundary()
-                self._receive_callback(response)
-                self._resetReader()
-
-    def _bufAppend(self, data):
-        if self._buf_offset:
-            self._buf.seek(self._buf_offset)
-            prefix = self._buf.read()
-            self._buf.seek(0)
-            self._buf.truncate()
-            self._buf.write(prefix)
-            self._buf_offset = 0
-        self._buf.seek(0, 2)
-        self._buf.write(data)
-
-    def _bufConsume(self, num_bytes):
-        "returns None if not enough bytes available"
-        if self._bufLength() < num_bytes:
-            return None
-        self._buf.seek(self._buf_offset)
-        self._buf_offset += num_bytes
-        return self._buf.read(num_bytes)
-
-    def _bufLength(self):
-        self._buf.seek(0, 2)
-        return self._buf.tell() - self._buf_offset
-
     def dataReceived(self, data):
-        self._bufAppend(data)
-        self._processData()
+        if self._stats is not None:
+            self._stats.recv_call(len(data))
+        self._buf.append(data)
+        for raw in self._buf.packets():
+            if self._output_file:
+                self._output_file.write(raw)
+            packet = parse_vrt_packet(raw)
+            if self._stats is not None:
+                self._stats.packet_received(packet.stream_id, len(raw),
+                    packet.is_data_packet())
+            self._receive_callback(packet)
 
     def connectionLost(self, reason):
         self.eof = True
 
 class VRTClientFactory(Factory):
-    def __init__(self, receive_callback):
+    def __init__(self, receive_callback, stats=None):
         self._receive_callback = receive_callback
+        self._stats = stats
 
     def startedConnecting(self, connector):
         pass
 
     def buildProtocol(self, addr):
-        return VRTClient(self._receive_callback)
+        return VRTClient(self._receive_callback, self._stats)
 
     def clientConnectionLost(self, connector, reason):
         pass
@@ -229,43 +218,43 @@ class VRTClientFactory(Factory):
         pass
 
 class SCPIClient(Protocol):
+    """
+    A Twisted protocol for the SCPI connection.  Commands and queries
+    are written immediately and replies, framed on newlines, are
+    matched to queries in the order they were sent.  Lines received
+    while no query is waiting are logged and dropped.
+    """
     _pending = None
+    _buf = ''
 
     def connectionMade(self):
         self.transport.setTcpNoDelay(True)
+        self._pending = deque()
 
     def scpiset(self, cmd):
-        if self._pending:
-            # prevent reordering
-            self._pending.append((cmd, None))
-        else:
-            logger.debug('scpiset %r', cmd)
-            self.transport.write(cmd)
+        logger.debug('scpiset %r', cmd)
+        self.transport.write(_to_bytes(cmd))
 
     def scpiget(self, cmd):
         d = defer.Deferred()
-        if self._pending:
-            # command pipelining not supported
-            self._pending.append((cmd, d))
-        else:
-            self._pending = [('', d)]
-            self.transport.write(cmd)
-            logger.debug('scpiget %r', cmd)
+        self._pending.append(d)
+        self.transport.write(_to_bytes(cmd))
+        logger.debug('scpiget %r', cmd)
         return d
 
     def dataReceived(self, data):
-        cmd, d = self._pending.pop(0)
-        logger.debug('scpigot %r', data)
-        if d:
-            d.callback(data)
+        self._buf += _to_str(data)
+        while '\n' in self._buf:
+            reply, self._buf = self._buf.split('\n', 1)
+            if not self._pending:
+                logger.warning('dropping unsolicited SCPI reply %r', reply)
+                continue
+            logger.debug('scpigot %r', reply)
+            self._pending.popleft().callback(reply + '\n')
 
+    def connectionLost(self, reason):
         while self._pending:
-            cmd, d = self._pending[0]
-            logger.debug('scpi(%s) %r', 'get' if d else 'set', cmd)
-            self.transport.write(cmd)
-            if d:
-                break
-            self._pending.pop(0)
+            self._pending.popleft().errback(reason)
 
 
 class SCPIClientFactory(Factory):
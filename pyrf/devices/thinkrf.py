@@ -5,12 +5,140 @@ from pyrf.vrt import vrt_packet_reader
 from pyrf import windows_util
 from pyrf import linux_util
 from pyrf.devices.thinkrf_properties import wsa_properties
+from pyrf.sweep_timing import load_timing_model, device_serial
 
 import struct
 import socket
 import select
 import platform
 
+class SCPIBatch(object):
+    """
+    Context manager returned by :meth:`WSA.batch`
+
+    .. attribute:: opc
+
+       result of the ``*OPC?`` query sent after the batch when opc
+       was requested, or None
+    """
+    def __init__(self, dut, opc):
+        self._dut = dut
+        self._opc = opc
+        self.opc = None
+
+    def __enter__(self):
+        dut = self._dut
+        if dut._batch is None:
+            dut._batch = []
+            dut._batch_changes = []
+            dut._batch_after = []
+            dut._batch_opc = False
+        dut._batch_levels.append(self)
+        dut._batch_opc = dut._batch_opc or self._opc
+        self._mark()
+        return self
+
+    def _mark(self):
+        dut = self._dut
+        self._start = (len(dut._batch), len(dut._batch_changes),
+            len(dut._batch_after))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        dut = self._dut
+        dut._batch_levels.pop()
+        if exc_type is not None:
+            self._discard()
+        if dut._batch_levels:
+            return
+        dut._flush_batch()
+        after = dut._batch_after
+        dut._batch = dut._batch_changes = dut._batch_after = None
+        if exc_type is not None:
+            return
+        for f in after:
+            f()
+        if dut._batch_opc:
+            self.opc = dut.scpiget('*OPC?')
+
+    def _discard(self):
+        """
+        Drop the commands queued since this batch was entered and
+        restore the cached settings they would have changed
+        """
+        dut = self._dut
+        cmds, changes, after = self._start
+        del dut._batch[cmds:]
+        del dut._batch_after[after:]
+        for key, value in reversed(dut._batch_changes[changes:]):
+            if value is None:
+                dut.device_state.pop(key, None)
+            else:
+                dut.device_state[key] = value
+        del dut._batch_changes[changes:]
+
+
+# number of :SYSTEM:ERROR? queries sent at once by WSA.errors()
+ERROR_QUERY_CHUNK = 8
+
+# device_state keys that may be changed by the sweep engine
+SWEEP_STATE_KEYS = ('freq', 'fshift', 'decimation', 'rfe_mode', 'gain',
+    'ifgain', 'hdr_gain', 'attenuator', 'antenna', 'spp', 'ppb', 'trigger')
+
+
+def _parse_str(buf):
+    return buf.strip()
+
+
+def _parse_int(buf):
+    return int(buf)
+
+
+def _parse_decimation(buf):
+    # firmware < 2.5.3 returned 0 instead of 1
+    return int(buf) or 1
+
+
+def _parse_lower(buf):
+    return buf.strip().lower()
+
+
+def _parse_gain_db(buf):
+    return int(buf.partition(" ")[0])
+
+
+def _parse_bool(buf):
+    return bool(int(buf))
+
+
+def _parse_trigger(typestr, levelstr=None):
+    typestr = typestr.strip()
+    if typestr != "LEVEL" or levelstr is None:
+        return {"type": typestr}
+    fstart, fstop, amplitude = levelstr.split(",")
+    return {"type": typestr,
+            "fstart": int(fstart),
+            "fstop": int(fstop),
+            "amplitude": int(amplitude)}
+
+# queries and parser for each device_state key read by WSA.snapshot_state
+STATE_QUERIES = {
+    'rfe_mode': ((":INPUT:MODE?",), _parse_str),
+    'iq_output_path': ((":OUTPUT:IQ:MODE?",), _parse_str),
+    'pll_reference': ((":SOURCE:REFERENCE:PLL?",), _parse_str),
+    'freq': ((":FREQ:CENTER?",), _parse_int),
+    'fshift': (("FREQ:SHIFT?",), float),
+    'decimation': (("SENSE:DECIMATION?",), _parse_decimation),
+    'gain': (("INPUT:GAIN:RF?",), _parse_lower),
+    'ifgain': ((":INPUT:GAIN:IF?",), _parse_gain_db),
+    'hdr_gain': ((":INPut:GAIN:HDR?",), _parse_gain_db),
+    'preselect_filter': ((":INPUT:FILTER:PRESELECT?",), _parse_bool),
+    'antenna': ((":INPUT:ANTENNA?",), _parse_int),
+    'attenuator': ((":INPUT:ATTENUATOR?",), _parse_bool),
+    'spp': ((":TRACE:SPP?",), _parse_int),
+    'ppb': ((":TRACE:BLOCK:PACKETS?",), _parse_int),
+    'trigger': ((":TRIGGER:TYPE?", ":TRIGGER:LEVEL?"), _parse_trigger),
+    }
+
 DISCOVERY_UDP_PORT = 18331
 _DISCOVERY_QUERY_CODE = 0x93315555
 _DISCOVERY_QUERY_VERSION = 2
@@ -36,17 +164,42 @@ class WSA(object):
        or if you passed a
        :class:`TwistedConnector <pyrf.connectors.twisted_async.TwistedConnector>`
        instance to the constructor they will immediately return a
-       Twisted Deferred object.
+       Twisted Deferred object.  With an
+       :class:`AsyncioConnector <pyrf.connectors.asyncio_async.AsyncioConnector>`
+       they return an asyncio future.
+
+    Settings sent and read with the setting methods (:meth:`freq`,
+    :meth:`gain`, ...) are kept in the *device_state* dict.  While
+    *state_cache* is True setting a value the device already has sends
+    nothing, and queries are answered from device_state without a
+    round trip.  The counters *elided_sets* and *cached_queries* record
+    the commands saved.  Commands sent directly with :meth:`scpiset`
+    bypass the cache; call :meth:`invalidate_state_cache` after using
+    them to change settings.
 
     """
 
     properties = None
+    state_cache = True
+    _batch = None
 
     def __init__(self, connector=None):
         if not connector:
             connector = PlainSocketConnector()
         self.connector = connector
+        self._batch_levels = []
         self._output_file = None
+        if hasattr(connector, 'reconnect_callback'):
+            connector.reconnect_callback = self._reconnected
+        self._sweep_entries = []
+        self._sweep_iterations = None
+        self._running = None
+        self._read_perm = False
+        self.device_state = {}
+        self.elided_sets = 0
+        self.cached_queries = 0
+        self._timing_model = None
+        self._timing_model_loaded = False
 
     def async_connector(self):
         """
@@ -85,6 +238,31 @@ class WSA(object):
 
         self.fw_version = self.device_id.split(',')[-1]
         self.device_state = {}
+        self._sweep_entries = []
+        self._sweep_iterations = None
+        self._running = None
+        self._read_perm = False
+        self._timing_model = None
+        self._timing_model_loaded = False
+
+    @property
+    def timing_model(self):
+        """
+        The :class:`pyrf.sweep_timing.SweepTimingModel` saved for this
+        device by :func:`pyrf.sweep_timing.calibrate_timing`, or None.
+        It is loaded when first used after :meth:`connect`.
+        """
+        if not self._timing_model_loaded:
+            self._timing_model_loaded = True
+            serial = device_serial(getattr(self, 'device_id', ''))
+            if serial:
+                self._timing_model = load_timing_model(serial)
+        return self._timing_model
+
+    @timing_model.setter
+    def timing_model(self, model):
+        self._timing_model = model
+        self._timing_model_loaded = True
 
     def disconnect(self):
         """
@@ -105,6 +283,9 @@ class WSA(object):
         :param cmd: the command to send
         :type cmd: str
         """
+        if self._batch is not None:
+            self._batch.append(cmd)
+            return
         self.connector.scpiset(cmd)
 
     def scpiget(self, cmd):
@@ -119,8 +300,137 @@ class WSA(object):
         :type cmd: str
         :returns: the response back from the box if any
         """
+        self._flush_batch()
         return self.connector.scpiget(cmd)
 
+    @sync_async
+    def scpiget_many(self, cmds):
+        """
+        Send a list of SCPI queries back-to-back and return the list
+        of responses, so that the round trip time is paid once
+        instead of once for each query.
+
+        :param cmds: the queries to send
+        :returns: list of responses in the same order
+        """
+        self._flush_batch()
+        if hasattr(self.connector, 'scpiget_many'):
+            responses = self.connector.scpiget_many(cmds)
+        else:
+            # async connectors send queries as soon as they are made
+            pending = [self.connector.scpiget(cmd) for cmd in cmds]
+            responses = []
+            for p in pending:
+                responses.append((yield p))
+        yield responses
+
+    def batch(self, opc=False):
+        """
+        Return a context manager that collects SCPI commands sent with
+        :meth:`scpiset` and sends them together in a single write when
+        it exits.  Batches may be nested; commands are sent when the
+        outermost batch exits.  Queries send the commands collected so
+        far first, so ordering is preserved.  If the with block raises,
+        the commands it collected that were not yet sent are dropped.
+
+        .. code-block:: python
+
+           with dut.batch():
+               dut.freq(2400e6)
+               dut.decimation(4)
+
+        :param opc: send ``*OPC?`` after the batch and store its result
+                    (a Deferred or future for async connectors) as
+                    the batch's opc attribute
+        """
+        return SCPIBatch(self, opc)
+
+    def invalidate_state_cache(self, keys=None):
+        """
+        Forget cached device settings so the next query of each is
+        sent to the device
+
+        :param keys: list of device_state keys to forget, or None for all
+        """
+        if keys is None:
+            self.device_state.clear()
+            return
+        for k in keys:
+            self.device_state.pop(k, None)
+
+    def _cached(self, key):
+        """
+        Return the cached value of a setting or None if it is unknown
+        """
+        if not self.state_cache:
+            return None
+        value = self.device_state.get(key)
+        if value is not None:
+            self.cached_queries += 1
+        return value
+
+    def _cache(self, key, value):
+        self.device_state[key] = value
+        return value
+
+    def _state_changed(self, key, value):
+        """
+        Record a setting about to be sent to the device.  Returns False
+        if the device already has this value and the command may be
+        skipped.
+        """
+        if self.state_cache and self.device_state.get(key) == value:
+            self.elided_sets += 1
+            return False
+        if self._batch is not None:
+            self._batch_changes.append((key, self.device_state.get(key)))
+        self.device_state[key] = value
+        return True
+
+    def _reconnected(self):
+        """
+        Called by the connector after re-establishing a dropped
+        connection.  The device may have been reset, so the settings,
+        sweep list and sweep or stream that were active are replayed.
+        """
+        settings = dict(self.device_state)
+        entries = list(self._sweep_entries)
+        running = self._running
+        self.invalidate_state_cache()
+        if self._read_perm:
+            self.request_read_perm()
+        with self.batch():
+            # not abort() and flush(), which would forget the running
+            # sweep and discard packets received before the drop
+            self.scpiset(":SYSTEM:ABORT")
+            self.scpiset(":SYSTEM:FLUSH")
+            self.restore_state(settings)
+            if entries:
+                self.sweep_clear()
+                for entry in entries:
+                    self.sweep_add(entry)
+            if self._sweep_iterations is not None:
+                self.sweep_iterations(self._sweep_iterations)
+            if running and running[0] == 'sweep':
+                self.sweep_start(running[1])
+            elif running:
+                self.stream_start(running[1])
+
+    def _flush_batch(self):
+        if not self._batch:
+            return
+        cmds = self._batch
+        self._batch = []
+        # sent commands can no longer be discarded by a failing batch
+        del self._batch_changes[:]
+        for level in self._batch_levels:
+            level._mark()
+        if hasattr(self.connector, 'scpiset_many'):
+            self.connector.scpiset_many(cmds)
+        else:
+            for cmd in cmds:
+                self.connector.scpiset(cmd)
+
     @sync_async
     def id(self):
         """
@@ -140,10 +450,11 @@ class WSA(object):
         :returns: the current RFE mode
         """
         if mode is None:
-            buf = yield self.scpiget(":INPUT:MODE?")
-            mode = buf.strip()
-        else:
-
+            mode = self._cached('rfe_mode')
+            if mode is None:
+                buf = yield self.scpiget(":INPUT:MODE?")
+                mode = self._cache('rfe_mode', buf.strip())
+        elif self._state_changed('rfe_mode', mode):
             self.scpiset(":INPUT:MODE %s" % str(mode))
 
         yield mode
@@ -158,9 +469,11 @@ class WSA(object):
         """
 
         if path is None:
-            buf = yield self.scpiget(":OUTPUT:IQ:MODE?")
-            path = buf.strip()
-        else:
+            path = self._cached('iq_output_path')
+            if path is None:
+                buf = yield self.scpiget(":OUTPUT:IQ:MODE?")
+                path = self._cache('iq_output_path', buf.strip())
+        elif self._state_changed('iq_output_path', path):
             self.scpiset(":OUTPUT:IQ:MODE %s" % path)
         yield path
 
@@ -174,11 +487,14 @@ class WSA(object):
         """
 
         if src is None:
-            buf = yield self.scpiget(":SOURCE:REFERENCE:PLL?")
-            src = buf.strip()
+            src = self._cached('pll_reference')
+            if src is None:
+                buf = yield self.scpiget(":SOURCE:REFERENCE:PLL?")
+                src = self._cache('pll_reference', buf.strip())
         else:
             assert src in ('INT', 'EXT')
-            self.scpiset(":SOURCE:REFERENCE:PLL %s" % src)
+            if self._state_changed('pll_reference', src):
+                self.scpiset(":SOURCE:REFERENCE:PLL %s" % src)
         yield src
 
     @sync_async
@@ -192,9 +508,11 @@ class WSA(object):
         :returns: the frequency in Hz
         """
         if freq is None:
-            buf = yield self.scpiget(":FREQ:CENTER?")
-            freq = int(buf)
-        else:
+            freq = self._cached('freq')
+            if freq is None:
+                buf = yield self.scpiget(":FREQ:CENTER?")
+                freq = self._cache('freq', int(buf))
+        elif self._state_changed('freq', freq):
             self.scpiset(":FREQ:CENTER %d\n" % freq)
 
         yield freq
@@ -209,9 +527,11 @@ class WSA(object):
         :returns: the amount of frequency shift
         """
         if shift is None:
-            buf = yield self.scpiget("FREQ:SHIFT?")
-            shift = float(buf)
-        else:
+            shift = self._cached('fshift')
+            if shift is None:
+                buf = yield self.scpiget("FREQ:SHIFT?")
+                shift = self._cache('fshift', float(buf))
+        elif self._state_changed('fshift', shift):
             self.scpiset(":FREQ:SHIFT %d\n" % shift)
 
         yield shift
@@ -231,23 +551,35 @@ class WSA(object):
         :returns: the decimation value
         """
         if value is None:
-            buf = yield self.scpiget("SENSE:DECIMATION?")
-            value = int(buf)
-        else:
+            value = self._cached('decimation')
+            if value is None:
+                buf = yield self.scpiget("SENSE:DECIMATION?")
+                value = int(buf)
+        elif self._state_changed('decimation', value or 1):
             self.scpiset(":SENSE:DECIMATION %d\n" % value)
-            if value == 1:
-                # verify decimation was disabled correctly
-                actual = yield self.scpiget("SENSE:DECIMATION?")
-                if int(actual) != 1:
-                    # firmware < 2.5.3
-                    self.scpiset(":SENSE:DECIMATION %d\n" % 0)
+            if value == 1 and self._batch is not None:
+                # a query now would split the batch into several writes
+                self._batch_after.append(self._verify_decimation_off)
+            elif value == 1:
+                yield self._verify_decimation_off()
 
         # firmware < 2.5.3 returned 0 instead of 1
         if value == 0:
             value = 1
+        self._cache('decimation', value)
 
         yield value
 
+    @sync_async
+    def _verify_decimation_off(self):
+        """
+        Check that setting decimation to 1 disabled decimation
+        """
+        actual = yield self.scpiget("SENSE:DECIMATION?")
+        if int(actual) != 1:
+            # firmware < 2.5.3
+            self.scpiset(":SENSE:DECIMATION %d\n" % 0)
+
     @sync_async
     def gain(self, gain=None):
         """
@@ -261,8 +593,11 @@ class WSA(object):
         :returns: the RF gain value
         """
         if gain is None:
-            gain = yield self.scpiget("INPUT:GAIN:RF?")
-        else:
+            gain = self._cached('gain')
+            if gain is None:
+                gain = yield self.scpiget("INPUT:GAIN:RF?")
+                gain = self._cache('gain', gain.strip().lower())
+        elif self._state_changed('gain', gain.lower()):
             self.scpiset(":INPUT:GAIN:RF %s\n" % gain)
 
         yield gain.lower()
@@ -279,10 +614,12 @@ class WSA(object):
         :returns: the ifgain in dB
         """
         if gain is None:
-            gain = yield self.scpiget(":INPUT:GAIN:IF?")
-            gain = gain.partition(" ")
-            gain = int(gain[0])
-        else:
+            gain = self._cached('ifgain')
+            if gain is None:
+                gain = yield self.scpiget(":INPUT:GAIN:IF?")
+                gain = gain.partition(" ")
+                gain = self._cache('ifgain', int(gain[0]))
+        elif self._state_changed('ifgain', gain):
             self.scpiset(":INPUT:GAIN:IF %d\n" % gain)
 
         yield gain
@@ -297,10 +634,12 @@ class WSA(object):
         :returns: the hdr gain in dB
         """
         if gain is None:
-            gain = yield self.scpiget(":INPut:GAIN:HDR?")
-            gain = gain.partition(" ")
-            gain = int(gain[0])
-        else:
+            gain = self._cached('hdr_gain')
+            if gain is None:
+                gain = yield self.scpiget(":INPut:GAIN:HDR?")
+                gain = gain.partition(" ")
+                gain = self._cache('hdr_gain', int(gain[0]))
+        elif self._state_changed('hdr_gain', gain):
             self.scpiset(":INPut:GAIN:HDR %d\n" % gain)
 
         yield gain
@@ -314,9 +653,11 @@ class WSA(object):
         :returns: the RFE preselect filter selection state
         """
         if enable is None:
-            enable = yield self.scpiget(":INPUT:FILTER:PRESELECT?")
-            enable = bool(int(enable))
-        else:
+            enable = self._cached('preselect_filter')
+            if enable is None:
+                enable = yield self.scpiget(":INPUT:FILTER:PRESELECT?")
+                enable = self._cache('preselect_filter', bool(int(enable)))
+        elif self._state_changed('preselect_filter', bool(enable)):
             self.scpiset(":INPUT:FILTER:PRESELECT %d" % int(enable))
         yield enable
 
@@ -329,9 +670,11 @@ class WSA(object):
         :returns: active antenna port
         """
         if number is None:
-            number = yield self.scpiget(":INPUT:ANTENNA?")
-            number = int(number)
-        else:
+            number = self._cached('antenna')
+            if number is None:
+                number = yield self.scpiget(":INPUT:ANTENNA?")
+                number = self._cache('antenna', int(number))
+        elif self._state_changed('antenna', number):
             self.scpiset(":INPUT:ANTENNA %d" % number)
         yield number
 
@@ -341,6 +684,7 @@ class WSA(object):
         Resets the WSA to its default settings. It does not affect
         the registers or queues associated with the IEEE mandated commands.
         """
+        self.invalidate_state_cache()
         self.scpiset(":*rst")
 
     def abort(self):
@@ -352,6 +696,7 @@ class WSA(object):
         stopped.  The capturing process does not wait until the end of a
         packet to stop, it will stop immediately upon receiving the command.
         """
+        self._running = None
         self.scpiset(":SYSTEM:ABORT")
 
 
@@ -363,6 +708,8 @@ class WSA(object):
         capture modes to clear up the remnants of packet.
         """
         self.scpiset(":SYSTEM:FLUSH")
+        if hasattr(self.connector, 'discard_queued'):
+            self.connector.discard_queued()
 
     @sync_async
     def trigger(self, settings=None):
@@ -377,18 +724,19 @@ class WSA(object):
         :returns: the trigger settings
         """
         if settings is None:
+            settings = self._cached('trigger')
+            if settings is not None:
+                yield dict(settings)
+                return
             # find out what kind of trigger is set
             trigstr = yield self.scpiget(":TRIGGER:TYPE?")
-            if trigstr == "LEVEL":
+            levelstr = None
+            if trigstr.strip() == "LEVEL":
                 # read the settings from the box
-                trigstr = yield self.scpiget(":TRIGGER:LEVEL?")
-                settings = {"type": trigstr,
-                            "fstart": int(trigstr.split(",")[0]),
-                            "fstop": int(trigstr.split(",")[1]),
-                            "amplitude": int(trigstr.split(",")[2])}
-            else:
-                settings = {"type": trigstr}
-        else:
+                levelstr = yield self.scpiget(":TRIGGER:LEVEL?")
+            settings = _parse_trigger(trigstr, levelstr)
+            self._cache('trigger', dict(settings))
+        elif self._state_changed('trigger', dict(settings)):
             self.scpiset(":TRIGGER:TYPE %s" % settings["type"])
 
             if settings["type"] == "LEVEL":
@@ -408,9 +756,10 @@ class WSA(object):
         :param spp: the number of samples in a packet
         :param ppb: the number of packets in a capture
         """
-        self.scpiset(":TRACE:SPP %s\n" % (spp))
-        self.scpiset(":TRACE:BLOCK:PACKETS %s\n" % (ppb))
-        self.scpiset(":TRACE:BLOCK:DATA?\n")
+        with self.batch():
+            self.spp(spp)
+            self.ppb(ppb)
+            self.scpiset(":TRACE:BLOCK:DATA?\n")
 
 
     @sync_async
@@ -429,9 +778,12 @@ class WSA(object):
         :returns: the current spp value if the samples parameter is None
         """
         if samples is None:
-            number = yield self.scpiget(":TRACE:SPP?")
-            yield int(number)
-        else:
+            number = self._cached('spp')
+            if number is None:
+                number = yield self.scpiget(":TRACE:SPP?")
+                number = self._cache('spp', int(number))
+            yield number
+        elif self._state_changed('spp', samples):
             self.scpiset(":TRACE:SPP %s\n" % (samples,))
 
     @sync_async
@@ -444,10 +796,14 @@ class WSA(object):
         :returns: the current ppb value if the packets parameter is None
         """
         if packets is None:
-            number = yield self.scpiget(":TRACE:BLOCK:PACKETS?")
-            number = int(number)
+            number = self._cached('ppb')
+            if number is None:
+                number = yield self.scpiget(":TRACE:BLOCK:PACKETS?")
+                number = self._cache('ppb', int(number))
         else:
-            self.scpiset(":TRACE:BLOCK:PACKETS %s\n" % (packets,))
+            number = packets
+            if self._state_changed('ppb', packets):
+                self.scpiset(":TRACE:BLOCK:PACKETS %s\n" % (packets,))
         yield number
 
 
@@ -459,6 +815,7 @@ class WSA(object):
         :returns: True if allowed to read, False if not
         """
         lockstr = yield self.scpiget(":SYSTEM:LOCK:REQUEST? ACQ\n")
+        self._read_perm = lockstr.strip() == "1"
         yield lockstr == "1"
 
     @sync_async
@@ -510,19 +867,46 @@ class WSA(object):
             yield -1
 
 
-    @sync_async
-    def read(self):
+    def read(self, timeout=None):
         """
         Read a single VRT packet from the WSA.
+
+        :param timeout: seconds to wait for a packet, or None to wait
+                        forever.  Requires a connector with read_packet
+                        such as :class:`pyrf.connectors.blocking.PlainSocketConnector`
+        :returns: the packet, None if no packet arrived within
+                  *timeout*, or False if the connection was closed
+        """
+        if hasattr(self.connector, 'read_packet'):
+            if timeout is None:
+                return self.connector.read_packet()
+            return self.connector.read_packet(timeout)
+        if timeout is not None:
+            raise TypeError('timeout not supported by this connector')
+        return self.connector.sync_async(
+            vrt_packet_reader(self.connector.raw_read))
+
+    def read_many(self, max_packets, timeout=None):
         """
-        return vrt_packet_reader(self.connector.raw_read)
+        Wait for a VRT packet, then return it along with any packets
+        already received after it, so several packets are handled
+        for each wait.
+
+        :param max_packets: maximum number of packets to return
+        :param timeout: seconds to wait for the first packet, or None
+                        to wait forever
+        :returns: a list of packets, empty if none arrived within
+                  *timeout* or the connection was closed
+        """
+        return self.connector.read_many(max_packets, timeout)
 
     def raw_read(self, num):
         """
         Raw read of VRT socket data from the WSA.
 
         :param num: the number of bytes to read
-        :returns: bytes
+        :returns: bytes, or a memoryview for large reads with
+                  :class:`pyrf.connectors.blocking.PlainSocketConnector`
         """
         return self.connector.raw_read(num)
 
@@ -534,29 +918,31 @@ class WSA(object):
         :param entry: the sweep entry to add
         :type entry: pyrf.config.SweepEntry
         """
-        self.scpiset(":sweep:entry:new")
-        if 'rfe_mode' in self.properties.SWEEP_SETTINGS:
-            self.scpiset(":sweep:entry:mode %s" % (entry.rfe_mode))
-        self.scpiset(":sweep:entry:freq:center %d, %d" % (entry.fstart, entry.fstop))
-        self.scpiset(":sweep:entry:freq:step %d" % (entry.fstep))
-        self.scpiset(":sweep:entry:freq:shift %d" % (entry.fshift))
-        self.scpiset(":sweep:entry:decimation %d" % (entry.decimation))
-        if 'antenna' in self.properties.SWEEP_SETTINGS:
-            self.scpiset(":sweep:entry:antenna %d" % (entry.antenna))
-        if 'gain' in self.properties.SWEEP_SETTINGS:
-            self.scpiset(":sweep:entry:gain:rf %s" % (entry.gain))
-        if 'attenuator' in self.properties.SWEEP_SETTINGS:
-            self.scpiset(":sweep:entry:attenuator %s" % (
-                1 if entry.attenuator else 0))
-        self.scpiset(":sweep:entry:gain:if %d" % (entry.ifgain))
-        self.scpiset(":sweep:entry:spp %d" % (entry.spp))
-        self.scpiset(":sweep:entry:ppb %d" % (entry.ppb))
-        self.scpiset(":sweep:entry:dwell %d,%d" %
-            (entry.dwell_s, entry.dwell_us))
-        self.scpiset(":sweep:entry:trigger:type %s" % (entry.trigtype))
-        if entry.trigtype.lower() == 'level':
-            self.scpiset(":sweep:entry:trigger:level %d, %d, %d" % (entry.level_fstart, entry.level_fstop, entry.level_amplitude))
-        self.scpiset(":sweep:entry:save")
+        self._sweep_entries.append(entry)
+        with self.batch():
+            self.scpiset(":sweep:entry:new")
+            if 'rfe_mode' in self.properties.SWEEP_SETTINGS:
+                self.scpiset(":sweep:entry:mode %s" % (entry.rfe_mode))
+            self.scpiset(":sweep:entry:freq:center %d, %d" % (entry.fstart, entry.fstop))
+            self.scpiset(":sweep:entry:freq:step %d" % (entry.fstep))
+            self.scpiset(":sweep:entry:freq:shift %d" % (entry.fshift))
+            self.scpiset(":sweep:entry:decimation %d" % (entry.decimation))
+            if 'antenna' in self.properties.SWEEP_SETTINGS:
+                self.scpiset(":sweep:entry:antenna %d" % (entry.antenna))
+            if 'gain' in self.properties.SWEEP_SETTINGS:
+                self.scpiset(":sweep:entry:gain:rf %s" % (entry.gain))
+            if 'attenuator' in self.properties.SWEEP_SETTINGS:
+                self.scpiset(":sweep:entry:attenuator %s" % (
+                    1 if entry.attenuator else 0))
+            self.scpiset(":sweep:entry:gain:if %d" % (entry.ifgain))
+            self.scpiset(":sweep:entry:spp %d" % (entry.spp))
+            self.scpiset(":sweep:entry:ppb %d" % (entry.ppb))
+            self.scpiset(":sweep:entry:dwell %d,%d" %
+                (entry.dwell_s, entry.dwell_us))
+            self.scpiset(":sweep:entry:trigger:type %s" % (entry.trigtype))
+            if entry.trigtype.lower() == 'level':
+                self.scpiset(":sweep:entry:trigger:level %d, %d, %d" % (entry.level_fstart, entry.level_fstop, entry.level_amplitude))
+            self.scpiset(":sweep:entry:save")
 
     @sync_async
     def sweep_read(self, index):
@@ -567,17 +953,30 @@ class WSA(object):
         :returns: sweep entry
         :rtype: pyrf.config.SweepEntry
         """
-        ent = SweepEntry()
-
         entrystr = yield self.scpiget(":sweep:entry:read? %d" % index)
+        yield self._parse_sweep_entry(entrystr)
+
+    @sync_async
+    def sweep_read_many(self, indexes):
+        """
+        Read a number of entries from the sweep list with pipelined
+        queries.
+
+        :param indexes: the indexes of the entries to read
+        :returns: list of sweep entries
+        """
+        entrystrs = yield self.scpiget_many([
+            ":sweep:entry:read? %d" % index for index in indexes])
+        yield [self._parse_sweep_entry(e) for e in entrystrs]
 
+    def _parse_sweep_entry(self, entrystr):
+        ent = SweepEntry()
         values = entrystr.split(',')
         for setting, value in zip(self.properties.SWEEP_SETTINGS, values):
             if setting not in ('gain', 'trigtype'):
                 value = int(value)
             setattr(ent, setting, value)
-
-        yield ent
+        return ent
 
     @sync_async
     def sweep_iterations(self, count=None):
@@ -591,12 +990,14 @@ class WSA(object):
             number = yield self.scpiget(":sweep:list:iterations?")
             yield int(number)
         else:
+            self._sweep_iterations = count
             self.scpiset(":sweep:list:iterations %d" % (count,))
 
     def sweep_clear(self):
         """
         Remove all entries from the sweep list.
         """
+        self._sweep_entries = []
         self.scpiset(":sweep:entry:delete all")
 
 
@@ -604,6 +1005,9 @@ class WSA(object):
         """
         Start the sweep engine.
         """
+        # sweep entries leave the device with their own settings
+        self.invalidate_state_cache(SWEEP_STATE_KEYS)
+        self._running = ('sweep', start_id)
         if start_id:
             self.scpiset(":sweep:list:start %d" % start_id);
         else:
@@ -614,6 +1018,7 @@ class WSA(object):
         """
         Stop the sweep engine.
         """
+        self._running = None
         self.scpiset(":sweep:list:stop")
 
 
@@ -632,6 +1037,7 @@ class WSA(object):
 
         :param stream_id: optional unsigned 32-bit stream identifier
         """
+        self._running = ('stream', stream_id)
         self.scpiset(':TRACE:STREAM:START' +
             (' %d' % stream_id if stream_id else ''))
 
@@ -641,6 +1047,7 @@ class WSA(object):
         the command, the WSA system will stop when the current
         capturing VRT packet is completed.
         """
+        self._running = None
         self.scpiset(':TRACE:STREAM:STOP')
 
     @sync_async
@@ -663,9 +1070,11 @@ class WSA(object):
         :returns: the current attenuator state
         """
         if enable is None:
-            enable = yield self.scpiget(":INPUT:ATTENUATOR?")
-            enable = bool(int(enable))
-        else:
+            enable = self._cached('attenuator')
+            if enable is None:
+                enable = yield self.scpiget(":INPUT:ATTENUATOR?")
+                enable = self._cache('attenuator', bool(int(enable)))
+        elif self._state_changed('attenuator', bool(enable)):
             self.scpiset(":INPUT:ATTENUATOR %s" % (1 if enable else 0))
         yield enable
 
@@ -677,14 +1086,22 @@ class WSA(object):
         are present.
         """
         errors = []
-        while True:
-            error = yield self.scpiget(":SYSTEM:ERROR?")
-            num, message = error.strip().split(',', 1)
-            num = int(num)
-            message = message.strip('"')
-            if not num:
-                break
-            errors.append((num, message))
+        done = False
+        while not done:
+            # extra queries after the last error return "no error"
+            responses = yield self.scpiget_many(
+                [":SYSTEM:ERROR?"] * ERROR_QUERY_CHUNK)
+            for error in responses:
+                num, message = error.strip().split(',', 1)
+                num = int(num)
+                message = message.strip('"')
+                if not num:
+                    done = True
+                    break
+                errors.append((num, message))
+        if errors:
+            # a rejected command may have left device_state wrong
+            self.invalidate_state_cache()
         yield errors
 
     def apply_device_settings(self, settings):
@@ -709,18 +1126,60 @@ class WSA(object):
             'rfe_mode': self.rfe_mode,
             'iq_output_path': self.iq_output_path,
             'pll_reference': self.pll_reference,
-            'trigger': self.trigger,
+            'preselect_filter': self.preselect_filter,
             }
-        for k, v in settings.iteritems():
-            #FIXME: Find more elegant way to do this
-            if not k in self.device_state:
-                self.device_state[k] = v
-                device_setting[k](v)
-            if not self.device_state[k] == v:
-                self.device_state[k] = v
+        # settings the device already has are skipped using device_state
+        with self.batch():
+            for k, v in settings.items():
                 device_setting[k](v)
 
 
+    @sync_async
+    def snapshot_state(self, keys=None):
+        """
+        Read the device settings with a single pipelined batch of
+        queries, instead of a round trip for each setting.  The result
+        also refreshes device_state.
+
+        :param keys: list of settings to read, defaults to all settings
+                     supported by this device (properties.STATE_SETTINGS)
+        :returns: dict of settings that may be passed to
+                  :meth:`restore_state` or :meth:`apply_device_settings`
+        """
+        if keys is None:
+            keys = self.properties.STATE_SETTINGS
+        cmds = []
+        for k in keys:
+            cmds.extend(STATE_QUERIES[k][0])
+        responses = yield self.scpiget_many(cmds)
+
+        snapshot = {}
+        i = 0
+        for k in keys:
+            queries, parse = STATE_QUERIES[k]
+            snapshot[k] = parse(*responses[i:i + len(queries)])
+            i += len(queries)
+            self._cache(k, snapshot[k])
+        if 'trigger' in snapshot:
+            self._cache('trigger', dict(snapshot['trigger']))
+        yield snapshot
+
+    def restore_state(self, snapshot):
+        """
+        Apply settings returned by :meth:`snapshot_state` with a single
+        batched write.  Only settings that differ from device_state
+        are sent; call :meth:`invalidate_state_cache` first to send
+        all of them.
+
+        :param snapshot: dict of settings
+        """
+        with self.batch():
+            # other settings may depend on the mode, so set it first
+            if 'rfe_mode' in snapshot:
+                self.rfe_mode(snapshot['rfe_mode'])
+            self.apply_device_settings(snapshot)
+
+
 def parse_discovery_response(response):
     """
     This function parses the WSA's raw discovery response
@@ -783,4 +1242,3 @@ def discover_wsa(wait_time=0.125):
 
 # for backwards compatibility
 WSA4000 = WSA
-
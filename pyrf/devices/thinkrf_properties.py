@@ -63,6 +63,8 @@ class WSA4000Properties(object):
     SWEEP_SETTINGS = ['fstart', 'fstop', 'fstep', 'fshift', 'decimation',
         'antenna', 'gain', 'ifgain', 'spp', 'ppb', 'dwell_s', 'dwell_us',
         'trigtype', 'level_fstart', 'level_fstop', 'level_amplitude']
+    STATE_SETTINGS = ['freq', 'fshift', 'decimation', 'antenna', 'gain',
+        'ifgain', 'preselect_filter', 'spp', 'ppb', 'trigger']
 
     SPECA_DEFAULTS = {
         'mode': 'ZIF',
@@ -176,6 +178,9 @@ class WSA5000_220Properties(object):
         'decimation', 'attenuator', 'hdr_gain', 'spp', 'ppb',
         'dwell_s', 'dwell_us',
         'trigtype', 'level_fstart', 'level_fstop', 'level_amplitude']
+    STATE_SETTINGS = ['rfe_mode', 'freq', 'fshift', 'decimation',
+        'attenuator', 'hdr_gain', 'iq_output_path', 'pll_reference',
+        'spp', 'ppb', 'trigger']
 
     LEVEL_TRIGGER_RFE_MODES = ['SH', 'SHN', 'ZIF']
 
@@ -2,6 +2,7 @@ from PySide import QtGui, QtCore
 from pyrf.gui.util import hide_layout
 from pyrf.gui.fonts import GROUP_BOX_FONT
 from pyrf.gui.widgets import QCheckBoxPlayback
+from pyrf.util import frequency_axis
 
 import numpy as np
 PLOT_YMAX = 40
@@ -118,7 +119,7 @@ class AmplitudeControls(QtGui.QGroupBox):
     def capture_received(self, state, fstart, fstop, raw, power, usable, segments):
         # save x,y data for marker adjustments
         self.pow_data = power
-        self.xdata = np.linspace(fstart, fstop, len(power))
+        self.xdata = frequency_axis(fstart, fstop, len(power))
 
     def _update_plot_y_axis(self):
         min_level = self._min_level.value()
@@ -10,12 +10,14 @@ from pyrf.gui.state import SpecAState
 from pyrf.numpy_util import compute_fft
 from pyrf.vrt import vrt_packet_reader
 from pyrf.devices.playback import Playback
-from pyrf.util import (compute_usable_bins, adjust_usable_fstart_fstop,
+from pyrf.connectors.playback import UNKNOWN_DEVICE_ID
+from pyrf.util import (capture_geometry, frequency_axis,
     trim_to_usable_fstart_fstop)
 
 logger = logging.getLogger(__name__)
 
 PLAYBACK_STEP_MSEC = 100
+CAPTURE_PIPELINE_DEPTH = 2
 
 class SpecAController(QtCore.QObject):
     """
@@ -71,7 +73,7 @@ class SpecAController(QtCore.QObject):
             state_json = vrt_packet.fields['speca']
             # support old playback files
             if state_json['device_identifier'] == 'unknown':
-                state_json['device_identifier'] = 'ThinkRF,WSA5000 v3,0,0'
+                state_json['device_identifier'] = UNKNOWN_DEVICE_ID
             dut = Playback(state_json['device_class'],
                 state_json['device_identifier'])
             self._sweep_device = SweepDevice(dut)
@@ -79,7 +81,8 @@ class SpecAController(QtCore.QObject):
         elif dut:
             dut.reset()
             self._sweep_device = SweepDevice(dut, self.process_sweep)
-            self._capture_device = CaptureDevice(dut, self.process_capture)
+            self._capture_device = CaptureDevice(dut, self.process_capture,
+                pipeline_depth=CAPTURE_PIPELINE_DEPTH)
             state_json = dict(
                 dut.properties.SPECA_DEFAULTS,
                 device_identifier=dut.device_id)
@@ -193,21 +196,15 @@ class SpecAController(QtCore.QObject):
                 return
             break
 
-        usable_bins = compute_usable_bins(
-            self._dut.properties,
-            self._state.rfe_mode(),
-            len(pkt.data),
-            self._state.decimation,
-            self._state.fshift)
-
-        usable_bins, fstart, fstop = adjust_usable_fstart_fstop(
+        usable_bins, fstart, fstop = capture_geometry(
             self._dut.properties,
             self._state.rfe_mode(),
             len(pkt.data),
             self._state.decimation,
+            self._state.fshift,
             self._state.center,
-            pkt.spec_inv,
-            usable_bins)
+            pkt.spec_inv)
+        usable_bins = list(usable_bins)
 
         pow_data = compute_fft(
             self._dut,
@@ -267,21 +264,15 @@ class SpecAController(QtCore.QObject):
             self._playback_sweep_start()
         self._playback_sweep_last_center = step_center
 
-        usable_bins = compute_usable_bins(
-            self._dut.properties,
-            self._state.rfe_mode(),
-            len(pkt.data),
-            self._state.decimation,
-            self._state.fshift)
-
-        usable_bins, fstart, fstop = adjust_usable_fstart_fstop(
+        usable_bins, fstart, fstop = capture_geometry(
             self._dut.properties,
             self._state.rfe_mode(),
             len(pkt.data),
             self._state.decimation,
+            self._state.fshift,
             step_center,
-            pkt.spec_inv,
-            usable_bins)
+            pkt.spec_inv)
+        usable_bins = list(usable_bins)
 
         pow_data = compute_fft(
             self._dut,
@@ -307,7 +298,7 @@ class SpecAController(QtCore.QObject):
                 ((fstart, fstop), (sweep_start, sweep_stop)))
         else:
             self._playback_sweep_data[point_left:point_right] = np.interp(
-                xvalues, np.linspace(fstart, fstop, len(pow_data)), pow_data)
+                xvalues, frequency_axis(fstart, fstop, len(pow_data)), pow_data)
 
         return updated_plot
 
@@ -25,6 +25,7 @@ from pyrf.version import __version__
 from pyrf.connectors.twisted_async import TwistedConnector
 from pyrf.config import TriggerSettings, TRIGGER_TYPE_LEVEL
 from pyrf.units import M
+from pyrf.util import frequency_axis
 from pyrf.devices.thinkrf import WSA
 from pyrf.vrt import (I_ONLY, VRT_IFDATA_I14Q14, VRT_IFDATA_I14,
     VRT_IFDATA_I24, VRT_IFDATA_PSD8)
@@ -491,7 +492,7 @@ class MainPanel(QtGui.QWidget):
         self.usable_bins = usable
         self.sweep_segments = segments
 
-        self.xdata = np.linspace(fstart, fstop, len(power))
+        self.xdata = frequency_axis(fstart, fstop, len(power))
 
         self.update_trace()
         self.update_marker()
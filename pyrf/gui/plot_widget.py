@@ -14,6 +14,8 @@ from pyrf.gui.persistence_plot_widget import (PersistencePlotWidget,
                                               decay_fn_EXPONENTIAL)
 from pyrf.gui.widgets import infiniteLine
 from pyrf.gui.freq_axis_widget import RTSAFrequencyAxisItem
+from pyrf.accumulator import (SpectrumAccumulator, MAX_HOLD, MIN_HOLD,
+    COUNT_AVERAGE)
 from pyrf.units import M
 
 PLOT_YMIN = -160
@@ -56,18 +58,25 @@ class Trace(object):
             min(255, trace_color[2] + 60),)
         self.curves = []
         self.plot_area = plot_area
-        self.average_list = []
         self.average_factor = 5
+        self.accumulator = None
     def clear(self):
         for c in self.curves:
             self.plot_area.window.removeItem(c)
         self.curves = []
     def clear_data(self):
-        self.average_list = []
+        if self.accumulator:
+            self.accumulator.reset()
         self.data = None
     def update_average_factor(self, factor):
         self.average_factor = factor
-        self.average_list = []
+        self.accumulator = None
+
+    def _accumulate(self, mode, xdata, ydata):
+        if self.accumulator is None or self.accumulator.mode != mode:
+            self.accumulator = SpectrumAccumulator(mode,
+                count=self.average_factor)
+        self.data = self.accumulator.update(xdata[0], xdata[-1], ydata)
 
     def update_curve(self, xdata, ydata, usable_bins, sweep_segments):
 
@@ -77,26 +86,16 @@ class Trace(object):
         self.freq_range = xdata
 
         if self.max_hold:
-            if (self.data == None or len(self.data) != len(ydata)):
-                self.data = ydata
-            self.data = np.maximum(self.data,ydata)
+            self._accumulate(MAX_HOLD, xdata, ydata)
 
         elif self.min_hold:
-            if (self.data == None or len(self.data) != len(ydata)):
-                self.data = ydata
-            self.data = np.minimum(self.data,ydata)
+            self._accumulate(MIN_HOLD, xdata, ydata)
 
         elif self.write:
             self.data = ydata
 
         elif self.average:
-            if len(self.average_list) >= self.average_factor:
-                self.average_list.pop(0)
-            if self.average_list:
-                if len(ydata) != len(self.data):
-                    self.average_list = []
-            self.average_list.append(ydata)
-            self.data = np.average(self.average_list, axis = 0)
+            self._accumulate(COUNT_AVERAGE, xdata, ydata)
 
         self.clear()
         if usable_bins:
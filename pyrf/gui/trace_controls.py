@@ -6,6 +6,7 @@ from pyrf.gui import colors
 from pyrf.gui.util import hide_layout
 from pyrf.gui.fonts import GROUP_BOX_FONT
 from pyrf.gui.widgets import (QCheckBoxPlayback, QDoubleSpinBoxPlayback)
+from pyrf.util import frequency_axis
 import numpy as np
 
 
@@ -323,7 +324,7 @@ class TraceControls(QtGui.QGroupBox):
     def capture_received(self, state, fstart, fstop, raw, power, usable, segments):
         # save x,y data for marker adjustments
         self.pow_data = power
-        self.xdata = np.linspace(fstart, fstop, len(power))
+        self.xdata = frequency_axis(fstart, fstop, len(power))
 
     def blank_trace(self, num):
         """
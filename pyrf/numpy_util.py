@@ -122,3 +122,55 @@ def _calibrate_i_q(i_data, q_data):
     return (math.sin(phi_est) * i_data + ratio * q_data) / math.cos(phi_est)
 
 
+
+def packet_samples(data_pkt):
+    """
+    Return the samples in a data packet as a numpy array scaled to
+    full scale = 1.0.  IQ data is returned as a complex array and
+    I-only data as a real array.
+
+    :param data_pkt: packet containing samples
+    :type data_pkt: pyrf.vrt.DataPacket
+    """
+    import numpy as np
+
+    data = data_pkt.data.numpy_array()
+    if data_pkt.stream_id == VRT_IFDATA_I14Q14:
+        samples = np.empty(len(data), dtype=np.complex64)
+        samples.real = data[:,0]
+        samples.imag = data[:,1]
+        samples /= 2 ** 13
+        return samples
+    if data_pkt.stream_id == VRT_IFDATA_I24:
+        return np.asarray(data, dtype=np.float32) / 2 ** 23
+    return np.asarray(data, dtype=np.float32) / 2 ** 13
+
+def compute_fft_samples(dut, samples, reference_level, spec_inv=False,
+        correct_phase=True, hide_differential_dc_offset=True,
+        convert_to_dbm=True, apply_window=True):
+    """
+    Return an array of dBm values by computing the FFT of samples
+    returned from :func:`packet_samples`, possibly collected from more
+    than one data packet.
+
+    :param dut: WSA device
+    :type dut: pyrf.devices.thinkrf.WSA
+    :param samples: complex (IQ) or real (I-only) numpy array
+    :param reference_level: reference level from the context packets
+    :param spec_inv: True to flip the inverted spectrum
+    :returns: numpy array of dBm values as floats
+    """
+    import numpy as np
+
+    if np.iscomplexobj(samples):
+        power_spectrum = _compute_fft(
+            np.asarray(samples.real, dtype=float),
+            np.asarray(samples.imag, dtype=float),
+            correct_phase, hide_differential_dc_offset, convert_to_dbm,
+            apply_window)
+    else:
+        power_spectrum = _compute_fft_i_only(
+            np.asarray(samples, dtype=float), convert_to_dbm, apply_window)
+    if spec_inv:
+        power_spectrum = np.flipud(power_spectrum)
+    return power_spectrum + reference_level + dut.properties.REFLEVEL_ERROR
@@ -0,0 +1,434 @@
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray, RawValue
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+import numpy as np
+
+from pyrf.vrt import VRTDATA, parse_vrt_packet
+from pyrf.util import capture_geometry, capture_center_freq
+from pyrf.numpy_util import compute_fft
+from pyrf.devices.playback import Playback
+from pyrf.devices.thinkrf_properties import wsa_properties
+
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOTS = 256
+DEFAULT_SPP = 16384
+# VRT data packet header and trailer bytes
+SLOT_OVERHEAD = 32
+# seconds the receiver waits for a packet before checking for
+# requests from the parent process
+RECEIVE_POLL = 0.1
+
+# header index fields kept for each slot
+HEADER_STREAM = 0
+HEADER_SEQUENCE = 1
+HEADER_LENGTH = 2
+HEADER_RFFREQ = 3
+HEADER_REFLEVEL = 4
+HEADER_FIELDS = 5
+
+
+class ParallelDeviceError(Exception):
+    pass
+
+
+class PacketRing(object):
+    """
+    Slots of VRT data packets and their FFT results in shared memory,
+    with an index of packet headers, so that packets can be passed
+    between processes by slot number instead of being pickled.
+
+    Each slot is filled by the receiver, read by one worker and
+    released by the parent process, which hands out slot numbers
+    through queues.
+
+    :param slots: number of packet slots
+    :param max_spp: largest number of samples per packet that fits in
+                    a slot
+    """
+    def __init__(self, slots=DEFAULT_SLOTS, max_spp=DEFAULT_SPP):
+        self.slots = slots
+        self.max_spp = max_spp
+        self.slot_bytes = SLOT_OVERHEAD + 4 * max_spp
+        self.data = RawArray('B', slots * self.slot_bytes)
+        self.headers = RawArray('d', slots * HEADER_FIELDS)
+        self.results = RawArray('d', slots * max_spp)
+        self.dropped = RawValue('L', 0)
+        self._views()
+
+    def _views(self):
+        self._data = np.frombuffer(self.data, dtype=np.uint8).reshape(
+            self.slots, self.slot_bytes)
+        self._headers = np.frombuffer(self.headers, dtype=np.float64
+            ).reshape(self.slots, HEADER_FIELDS)
+        self._results = np.frombuffer(self.results, dtype=np.float64
+            ).reshape(self.slots, self.max_spp)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for name in ('_data', '_headers', '_results'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views()
+
+    def write(self, slot, stream_id, sequence, raw, context):
+        """
+        Copy a raw data packet into *slot* and index it
+
+        :param stream_id: stream the packet was received for
+        :param sequence: sequence number used to order the results
+        :param raw: the bytes of the packet
+        :param context: dict of context fields received before it
+        """
+        length = len(raw)
+        if length > self.slot_bytes:
+            raise ParallelDeviceError('packet of %d bytes does not fit in '
+                'a %d byte slot' % (length, self.slot_bytes))
+        self._data[slot, :length] = np.frombuffer(raw, dtype=np.uint8)
+        header = self._headers[slot]
+        header[HEADER_STREAM] = stream_id
+        header[HEADER_SEQUENCE] = sequence
+        header[HEADER_LENGTH] = length
+        header[HEADER_RFFREQ] = context.get('rffreq', np.nan)
+        header[HEADER_REFLEVEL] = context.get('reflevel', np.nan)
+
+    def header(self, slot):
+        """
+        Return (stream id, sequence number) of the packet in *slot*
+        """
+        header = self._headers[slot]
+        return int(header[HEADER_STREAM]), int(header[HEADER_SEQUENCE])
+
+    def packet(self, slot):
+        """
+        Return the packet in *slot* parsed, without copying its data
+        """
+        length = int(self._headers[slot, HEADER_LENGTH])
+        return parse_vrt_packet(memoryview(self._data[slot, :length]))
+
+    def context(self, slot):
+        """
+        Return the context fields indexed for the packet in *slot*
+        """
+        header = self._headers[slot]
+        context = {}
+        if not np.isnan(header[HEADER_RFFREQ]):
+            context['rffreq'] = header[HEADER_RFFREQ]
+        if not np.isnan(header[HEADER_REFLEVEL]):
+            context['reflevel'] = header[HEADER_REFLEVEL]
+        return context
+
+    def result(self, slot, count):
+        """
+        Return a view of the first *count* result values of *slot*
+        """
+        return self._results[slot, :count]
+
+
+class ParallelStreamDevice(object):
+    """
+    Virtual device that streams from a WSA and computes power spectra
+    of each data packet in several processes, so that receiving and
+    DSP are not limited to a single core by the GIL.
+
+    A receiver process owns the connection to the device and copies
+    data packets into a :class:`PacketRing` in shared memory.  Worker
+    processes run :func:`pyrf.numpy_util.compute_fft` on the packets
+    in place and write the spectra back to the ring.  Only slot
+    numbers pass through the queues between the processes, and
+    :meth:`read` returns the spectra in the order the packets arrived.
+
+    When no slot is free the receiver drops the packet just received
+    and counts it in :attr:`packets_dropped`, so it keeps up with the
+    device even when the workers or the reader fall behind.
+
+    If the connection to the device is closed or the receiver fails,
+    :meth:`read` returns the results of the packets received before
+    that, then raises :class:`ParallelDeviceError`.
+
+    .. code-block:: python
+
+       device = ParallelStreamDevice('10.126.110.111', workers=4)
+       device.start('ZIF', 2450 * M, spp=16384)
+       fstart, fstop, pow_data = device.read()
+       device.close()
+
+    :param host: hostname or IP of the device
+    :param workers: number of FFT worker processes, defaults to one
+                    less than the number of CPUs
+    :param slots: number of packets the ring holds
+    :param max_spp: largest samples per packet that will be streamed
+    :param connector_kwargs: keyword arguments for the receiver's
+                             :class:`pyrf.connectors.blocking.PlainSocketConnector`
+    :param dsp_options: keyword arguments passed on to
+                        :func:`pyrf.numpy_util.compute_fft`
+    """
+    def __init__(self, host, workers=None, slots=DEFAULT_SLOTS,
+            max_spp=DEFAULT_SPP, connector_kwargs=None, dsp_options=None):
+        if workers is None:
+            workers = max(1, multiprocessing.cpu_count() - 1)
+        self.ring = PacketRing(slots, max_spp)
+        self.results_read = 0
+        self.streaming = False
+        self._stream_id = 0
+        self._next_sequence = 0
+        self._done = {}
+        self._receiver_error = None
+        self._receiver_end = None
+        self._free = multiprocessing.Queue()
+        self._work = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+
+        self._control, child = multiprocessing.Pipe()
+        self._receiver = multiprocessing.Process(target=_receiver_main,
+            name='pyrf receiver', args=(host, connector_kwargs or {},
+                child, self.ring, self._free, self._work, self._results))
+        self._receiver.daemon = True
+        self._receiver.start()
+        reply = self._control.recv()
+        if reply[0] == 'error':
+            self._receiver.join()
+            raise ParallelDeviceError('receiver failed to connect: %s'
+                % reply[1])
+        self.device_id = reply[1]
+        self.properties = wsa_properties(self.device_id)
+
+        self._workers = []
+        for i in range(workers):
+            p = multiprocessing.Process(target=_worker_main,
+                name='pyrf FFT worker', args=(self.device_id, self.ring,
+                    self._work, self._results, dsp_options or {}))
+            p.daemon = True
+            p.start()
+            self._workers.append(p)
+
+    @property
+    def packets_dropped(self):
+        """
+        Number of packets the receiver dropped because no slot was free
+        """
+        return self.ring.dropped.value
+
+    def start(self, rfe_mode, freq, spp=DEFAULT_SPP, device_settings=None):
+        """
+        Configure the device and start streaming
+
+        :param rfe_mode: radio front end mode, e.g. 'ZIF', 'SH', ...
+        :param freq: center frequency
+        :param spp: samples per packet requested from the device, no
+                    more than max_spp
+        :param device_settings: attenuator, decimation frequency shift
+                                and other device settings
+        :type dict:
+        """
+        if spp > self.ring.max_spp:
+            raise ParallelDeviceError('spp larger than max_spp')
+        if self._receiver_error is not None:
+            raise ParallelDeviceError('receiver stopped: %s'
+                % self._receiver_error)
+        settings = dict(device_settings or {}, freq=freq, rfe_mode=rfe_mode)
+        self._freq = capture_center_freq(self.properties, rfe_mode, freq)
+        self._rfe_mode = rfe_mode
+        self._decimation = settings.get('decimation', 1)
+        self._fshift = settings.get('fshift', 0)
+
+        for done in self._done.values():
+            self._free.put(done[0])
+        self._done = {}
+        self._next_sequence = 0
+        self._stream_id += 1
+        self._control.send(('start', self._stream_id, settings, spp))
+        self.streaming = True
+
+    def stop(self):
+        """
+        Stop streaming.  Results still in flight are discarded.
+        """
+        self._control.send(('stop',))
+        self.streaming = False
+
+    def read(self, timeout=None):
+        """
+        Return the power spectrum of the next packet received
+
+        :param timeout: seconds to wait for a result, or None to wait
+                        forever
+        :returns: (fstart, fstop, pow_data), or None if no result
+                  arrived within *timeout*
+        :raises: :class:`ParallelDeviceError` once the results of the
+                 packets received before the receiver stopped have
+                 been read
+        """
+        while True:
+            if self._next_sequence in self._done:
+                done = self._done.pop(self._next_sequence)
+                self._next_sequence += 1
+            elif (self._receiver_error is not None
+                    and self._next_sequence >= self._receiver_end):
+                raise ParallelDeviceError('receiver stopped: %s'
+                    % self._receiver_error)
+            else:
+                try:
+                    done = self._results.get(timeout=timeout)
+                except Empty:
+                    return None
+                if done[0] is None:
+                    self._receiver_stopped(*done[1:])
+                    continue
+                stream_id, sequence = self.ring.header(done[0])
+                if stream_id != self._stream_id:
+                    self._free.put(done[0])
+                    continue
+                if sequence != self._next_sequence:
+                    self._done[sequence] = done
+                    continue
+                self._next_sequence += 1
+
+            slot, points, count, spec_inv = done
+            if count is None:
+                self._free.put(slot)
+                continue
+            pow_data = np.array(self.ring.result(slot, count))
+            self._free.put(slot)
+            self.results_read += 1
+            geometry = capture_geometry(self.properties, self._rfe_mode,
+                points, self._decimation, self._fshift, self._freq,
+                spec_inv)
+            return geometry.fstart, geometry.fstop, pow_data
+
+    def _receiver_stopped(self, stream_id, sequence, message):
+        """
+        Record that the receiver ended after sending *sequence* packets
+        of stream *stream_id*
+        """
+        self.streaming = False
+        self._receiver_error = message
+        self._receiver_end = sequence if stream_id == self._stream_id else 0
+
+    def close(self):
+        """
+        Stop streaming, disconnect and end the processes
+        """
+        if self._receiver.is_alive():
+            try:
+                self._control.send(('close',))
+            except (IOError, OSError):
+                pass # the receiver just ended
+        self._receiver.join()
+        for p in self._workers:
+            self._work.put(None)
+        for p in self._workers:
+            p.join()
+
+
+def _receiver_main(host, connector_kwargs, control, ring, free, work,
+        results):
+    """
+    Receiver process: configure the device as the parent requests and
+    copy the data packets of the current stream into free slots.  If
+    the connection is closed or the receiver fails, (None, stream id,
+    packets written, message) is put on the results queue to tell the
+    parent.
+    """
+    from pyrf.devices.thinkrf import WSA
+    from pyrf.connectors.blocking import PlainSocketConnector
+
+    connector = PlainSocketConnector(**connector_kwargs)
+    dut = WSA(connector=connector)
+    try:
+        dut.connect(host)
+    except Exception as e:
+        control.send(('error', str(e)))
+        return
+    control.send(('connected', dut.device_id))
+
+    stream_id = None
+    current = False
+    sequence = 0
+    context = {}
+    try:
+        while True:
+            if stream_id is None or control.poll():
+                msg = control.recv()
+                if msg[0] == 'start':
+                    stream_id, settings, spp = msg[1:]
+                    current = False
+                    sequence = 0
+                    context = {}
+                    dut.abort()
+                    dut.flush()
+                    dut.apply_device_settings(settings)
+                    dut.spp(spp)
+                    dut.request_read_perm()
+                    dut.stream_start(stream_id)
+                elif msg[0] == 'stop':
+                    dut.stream_stop()
+                    dut.flush()
+                    stream_id = None
+                elif msg[0] == 'close':
+                    if stream_id is not None:
+                        dut.stream_stop()
+                    dut.disconnect()
+                    return
+                continue
+
+            raw = connector.read_raw_packet(RECEIVE_POLL)
+            if raw is None:
+                continue
+            if raw is False:
+                message = 'VRT connection closed'
+                logger.error(message)
+                break
+            if bytearray(raw[0:1])[0] >> 4 != VRTDATA:
+                packet = parse_vrt_packet(raw)
+                if 'streamid' in packet.fields:
+                    # data from before this stream started is discarded
+                    current = packet.fields['streamid'] == stream_id
+                context.update(packet.fields)
+                continue
+            if not current:
+                continue
+            try:
+                slot = free.get_nowait()
+            except Empty:
+                ring.dropped.value += 1
+                continue
+            ring.write(slot, stream_id, sequence, raw, context)
+            sequence += 1
+            work.put(slot)
+    except Exception as e:
+        logger.exception('receiver failed')
+        message = str(e) or e.__class__.__name__
+    results.put((None, stream_id, sequence, message))
+
+
+def _worker_main(device_id, ring, work, results, dsp_options):
+    """
+    FFT worker process: compute the power spectrum of each slot
+    received and report (slot, points, result count, spec_inv)
+    """
+    dut = Playback('thinkrf.WSA', device_id)
+    while True:
+        slot = work.get()
+        if slot is None:
+            return
+        try:
+            packet = ring.packet(slot)
+            pow_data = compute_fft(dut, packet, ring.context(slot),
+                **dsp_options)
+            count = len(pow_data)
+            ring.result(slot, count)[:] = pow_data
+            results.put((slot, len(packet.data), count, packet.spec_inv))
+        except Exception as e:
+            logger.error('FFT of slot %d failed: %s', slot, e)
+            results.put((slot, None, None, None))
@@ -0,0 +1,6 @@
+"""
+Simulated ThinkRF devices for testing and benchmarking without hardware.
+
+Run ``python -m pyrf.simulator`` to serve a simulated WSA5000 on the
+standard SCPI and VRT ports.
+"""
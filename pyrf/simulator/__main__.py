@@ -0,0 +1,47 @@
+import logging
+from optparse import OptionParser
+
+from pyrf.connectors.base import SCPI_PORT, VRT_PORT
+from pyrf.simulator.device import (SimulatedWSA, DEFAULT_DEVICE_ID,
+    DEFAULT_SIGNALS, DEFAULT_NOISE_LEVEL)
+from pyrf.simulator.server import SimulatorServer
+
+
+def _signal(value):
+    freq, _comma, level = value.partition(',')
+    return (float(freq), float(level))
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]',
+        description='Serve a simulated WSA on the SCPI and VRT ports.')
+    parser.add_option('--host', default='',
+        help='address to listen on (default: all interfaces)')
+    parser.add_option('--scpi-port', type='int', default=SCPI_PORT)
+    parser.add_option('--vrt-port', type='int', default=VRT_PORT)
+    parser.add_option('--rate', type='float', default=None,
+        help='maximum VRT data rate in MB/s (default: no limit)')
+    parser.add_option('--signal', action='append', default=[],
+        metavar='FREQ,LEVEL',
+        help='simulated signal frequency in Hz and level in dBm, '
+            'may be repeated')
+    parser.add_option('--noise', type='float', default=DEFAULT_NOISE_LEVEL,
+        help='noise level in dBm (default: %default)')
+    parser.add_option('--device-id', default=DEFAULT_DEVICE_ID,
+        help='*IDN? response (default: %default)')
+    parser.add_option('-v', '--verbose', action='store_true',
+        help='log SCPI commands')
+    options, args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.DEBUG if options.verbose else logging.INFO)
+    signals = [_signal(s) for s in options.signal] or DEFAULT_SIGNALS
+    device = SimulatedWSA(options.device_id, signals, options.noise)
+    server = SimulatorServer(device, options.host, options.scpi_port,
+        options.vrt_port,
+        options.rate * 1e6 if options.rate else None)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,528 @@
+import time
+import struct
+import threading
+from collections import deque
+
+from pyrf.units import M
+from pyrf.vrt import (VRTCONTEXT, VRTCUSTOMCONTEXT, VRTDATA, VRTRECEIVER,
+    VRTDIGITIZER, VRTCUSTOM, VRT_IFDATA_I14Q14, VRT_IFDATA_I14,
+    CTX_RFFREQ, CTX_REFERENCELEVEL, CTX_SWEEPID, CTX_STREAMID, I_ONLY)
+from pyrf.devices.thinkrf_properties import wsa_properties
+
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEVICE_ID = 'ThinkRF,WSA5000-220 v3,SIM000001,4.2.0'
+
+# (frequency in Hz, level in dBm) of the default simulated signals
+DEFAULT_SIGNALS = ((2450 * M, -40.0), (2470 * M, -60.0))
+# noise power in dBm over the full capture bandwidth
+DEFAULT_NOISE_LEVEL = -60.0
+# reference level reported in digitizer context packets
+REFLEVEL = -10.0
+FULL_SCALE = 8191
+
+# payloads of synthetic samples generated for each configuration and
+# sent in rotation, so packets are not computed one at a time
+PAYLOAD_BLOCKS = 8
+PAYLOAD_CACHE_SIZE = 64
+
+# TSI is UTC and TSF is picoseconds
+_TIMESTAMP_BITS = (1 << 22) | (2 << 20)
+# trailer indicators for valid data and reference lock
+_TRAILER = (1 << 30) | (1 << 18) | (1 << 29) | (1 << 17)
+
+DEFAULT_SETTINGS = {
+    'freq': 2450 * M,
+    'fshift': 0,
+    'decimation': 1,
+    'rfe_mode': 'SH',
+    'attenuator': 1,
+    'hdr_gain': -10,
+    'gain': 'HIGH',
+    'ifgain': 0,
+    'antenna': 1,
+    'preselect': 0,
+    'iq_output_path': 'DIGITIZER',
+    'pll_reference': 'INT',
+    'spp': 1024,
+    'ppb': 1,
+    'trigger_type': 'NONE',
+    'trigger_level': (2440 * M, 2460 * M, -110),
+    }
+
+
+class SimulatorError(Exception):
+    """
+    A SCPI error, reported with :SYSTEM:ERROR? instead of raised
+    """
+    def __init__(self, code, message):
+        super(SimulatorError, self).__init__(code, message)
+        self.code = code
+        self.message = message
+
+
+def _int(arg):
+    return int(float(arg))
+
+
+def _upper(arg):
+    return arg.strip().upper()
+
+
+def _args(arg, count, parse=_int):
+    values = [v.strip() for v in arg.split(',')]
+    if len(values) != count:
+        raise SimulatorError(-109, 'Missing parameter')
+    return tuple(parse(v) for v in values)
+
+# queries answered on the VRT connection instead of with a reply
+NO_REPLY_QUERIES = ('TRACE:BLOCK:DATA?',)
+
+# SCPI header: (settings key, argument parser) for settings that may be
+# set and queried
+SETTING_COMMANDS = {
+    'FREQ:CENTER': ('freq', _int),
+    'FREQ:SHIFT': ('fshift', _int),
+    'SENSE:DECIMATION': ('decimation', _int),
+    'INPUT:MODE': ('rfe_mode', _upper),
+    'INPUT:ATTENUATOR': ('attenuator', _int),
+    'INPUT:GAIN:HDR': ('hdr_gain', _int),
+    'INPUT:GAIN:RF': ('gain', _upper),
+    'INPUT:GAIN:IF': ('ifgain', _int),
+    'INPUT:ANTENNA': ('antenna', _int),
+    'INPUT:FILTER:PRESELECT': ('preselect', _int),
+    'OUTPUT:IQ:MODE': ('iq_output_path', _upper),
+    'SOURCE:REFERENCE:PLL': ('pll_reference', _upper),
+    'TRACE:SPP': ('spp', _int),
+    'TRACE:BLOCK:PACKETS': ('ppb', _int),
+    'TRIGGER:TYPE': ('trigger_type', _upper),
+    }
+
+# SCPI header: (sweep entry field, argument parser)
+SWEEP_ENTRY_COMMANDS = {
+    'SWEEP:ENTRY:MODE': ('rfe_mode', _upper),
+    'SWEEP:ENTRY:FREQ:STEP': ('fstep', _int),
+    'SWEEP:ENTRY:FREQ:SHIFT': ('fshift', _int),
+    'SWEEP:ENTRY:DECIMATION': ('decimation', _int),
+    'SWEEP:ENTRY:ANTENNA': ('antenna', _int),
+    'SWEEP:ENTRY:GAIN:RF': ('gain', _upper),
+    'SWEEP:ENTRY:GAIN:IF': ('ifgain', _int),
+    'SWEEP:ENTRY:GAIN:HDR': ('hdr_gain', _int),
+    'SWEEP:ENTRY:ATTENUATOR': ('attenuator', _int),
+    'SWEEP:ENTRY:SPP': ('spp', _int),
+    'SWEEP:ENTRY:PPB': ('ppb', _int),
+    'SWEEP:ENTRY:TRIGGER:TYPE': ('trigtype', _upper),
+    }
+
+
+def _context_packet(stream_id, indicators, payload, count, timestamp):
+    ptype = VRTCUSTOMCONTEXT if stream_id == VRTCUSTOM else VRTCONTEXT
+    tsi, tsf = timestamp
+    size = 6 + len(payload) // 4
+    return struct.pack('>IIIQI',
+        (ptype << 28) | _TIMESTAMP_BITS | ((count & 0x0f) << 16) | size,
+        stream_id, tsi, tsf, indicators) + payload
+
+
+class SimulatedWSA(object):
+    """
+    Simulated WSA5000 for testing and benchmarking without hardware.
+    It implements the subset of SCPI commands used by
+    :class:`pyrf.devices.thinkrf.WSA` (settings, block captures, the
+    sweep list, streaming, errors and ``*IDN?``) and produces VRT
+    context and data packets of synthetic signals plus noise.
+
+    Signal levels are approximate: the reference level is fixed at
+    REFLEVEL and the attenuator lowers signals by the device's
+    RFE_ATTENUATION.  Dwell times and triggers are accepted but not
+    simulated.
+
+    Commands are passed to :meth:`scpi` and packets are taken from
+    :meth:`next_packet`, usually by a
+    :class:`pyrf.simulator.server.SimulatorServer`.
+
+    :param device_id: identification string returned for ``*IDN?``,
+                      which also selects the device properties
+    :param signals: list of (frequency in Hz, level in dBm) tuples
+    :param noise_level: noise power in dBm over the capture bandwidth
+    :param seed: seed for the noise generator
+    """
+    def __init__(self, device_id=DEFAULT_DEVICE_ID, signals=DEFAULT_SIGNALS,
+            noise_level=DEFAULT_NOISE_LEVEL, seed=None):
+        import numpy as np # import here so docstrings are visible even without numpy
+
+        self.device_id = device_id
+        self.properties = wsa_properties(device_id)
+        self.signals = list(signals)
+        self.noise_level = noise_level
+        self._random = np.random.RandomState(seed)
+        self._cond = threading.Condition()
+        self._payload_cache = {}
+        self._counts = {}
+        self._clock = 0.0
+        self.sweep_entries = []
+        self.sweep_iterations = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Restore the default settings and stop any capture, as ``*RST``
+        """
+        with self._cond:
+            self.settings = dict(DEFAULT_SETTINGS)
+            self.errors = deque()
+            self._new_entry = None
+            self._abort()
+
+    def _abort(self):
+        self._queue = deque()
+        self._activity = None
+        self.sweeping = False
+        self.streaming = False
+
+    def scpi(self, line):
+        """
+        Execute a single SCPI command or query
+
+        :param line: the command, without its newline
+        :returns: the response to a query, or None
+        """
+        logger.debug('scpi %r', line)
+        header, _space, arg = line.strip().partition(' ')
+        header = header.lstrip(':').upper()
+        if not header:
+            return None
+        query = header.endswith('?')
+        with self._cond:
+            try:
+                response = self._command(header.rstrip('?'), query, arg)
+            except SimulatorError as e:
+                logger.debug('SCPI error %d in %r', e.code, line)
+                self.errors.append((e.code, e.message))
+                response = None
+            except ValueError:
+                self.errors.append((-104, 'Data type error'))
+                response = None
+            self._cond.notify_all()
+        if query and response is None and header not in NO_REPLY_QUERIES:
+            # keep replies matched to queries
+            response = ''
+        return response
+
+    def _command(self, header, query, arg):
+        if header in SETTING_COMMANDS:
+            key, parse = SETTING_COMMANDS[header]
+            if query:
+                return str(self.settings[key])
+            value = parse(arg)
+            self._check_setting(key, value)
+            self.settings[key] = value
+            return
+
+        if header.startswith('SWEEP:ENTRY:') and not query:
+            return self._sweep_entry_command(header, arg)
+
+        if header == '*IDN':
+            return self.device_id
+        if header == '*RST':
+            self.settings = dict(DEFAULT_SETTINGS)
+            self._abort()
+            return
+        if header == '*OPC':
+            return '1'
+        if header == 'SYSTEM:ABORT':
+            self._abort()
+            return
+        if header == 'SYSTEM:FLUSH':
+            self._queue.clear()
+            return
+        if header == 'SYSTEM:ERROR':
+            if not self.errors:
+                return '0,"No error"'
+            return '%d,"%s"' % self.errors.popleft()
+        if header in ('SYSTEM:LOCK:REQUEST', 'SYSTEM:LOCK:HAVE',
+                'SENSE:LOCK:REFERENCE', 'SENSE:LOCK:RF'):
+            return '1'
+        if header == 'TRACE:BLOCK:DATA':
+            # sent without waiting for a reply; the data is the answer
+            self._queue.extend(self._capture(self.settings,
+                self.settings['freq'], self.settings['spp'],
+                self.settings['ppb']))
+            return
+        if header == 'TRACE:STREAM:START':
+            self._abort()
+            self.streaming = True
+            self._activity = self._stream(dict(self.settings),
+                _int(arg) if arg.strip() else 0)
+            return
+        if header == 'TRACE:STREAM:STOP':
+            self._abort()
+            return
+        if header == 'TRACE:STREAM:STATUS':
+            return 'RUNNING' if self.streaming else 'STOPPED'
+        if header == 'TRIGGER:LEVEL':
+            if query:
+                return '%d,%d,%d' % self.settings['trigger_level']
+            self.settings['trigger_level'] = _args(arg, 3)
+            return
+        if header == 'SWEEP:ENTRY:COUNT':
+            return str(len(self.sweep_entries))
+        if header == 'SWEEP:ENTRY:READ':
+            return self._read_sweep_entry(_int(arg))
+        if header == 'SWEEP:LIST:ITERATIONS':
+            if query:
+                return str(self.sweep_iterations)
+            self.sweep_iterations = _int(arg)
+            return
+        if header == 'SWEEP:LIST:START':
+            if not self.sweep_entries:
+                raise SimulatorError(-221, 'Settings conflict; sweep list empty')
+            self._abort()
+            self.sweeping = True
+            self._activity = self._sweep(list(self.sweep_entries),
+                self.sweep_iterations, _int(arg) if arg.strip() else 0)
+            return
+        if header == 'SWEEP:LIST:STOP':
+            self._abort()
+            return
+        if header == 'SWEEP:LIST:STATUS':
+            return 'RUNNING' if self.sweeping else 'STOPPED'
+        raise SimulatorError(-113, 'Undefined header')
+
+    def _check_setting(self, key, value):
+        prop = self.properties
+        if key == 'rfe_mode' and value not in prop.RFE_MODES:
+            raise SimulatorError(-224, 'Illegal parameter value')
+        if key == 'decimation' and value not in (0, 1) and not (
+                prop.MIN_DECIMATION[self.settings['rfe_mode']] <= value
+                <= prop.MAX_DECIMATION[self.settings['rfe_mode']]):
+            raise SimulatorError(-222, 'Data out of range')
+        if key == 'spp' and (value % 16 or not 16 <= value <= 2**16 - 16):
+            raise SimulatorError(-222, 'Data out of range')
+
+    def _sweep_entry_command(self, header, arg):
+        if header == 'SWEEP:ENTRY:NEW':
+            s = self.settings
+            self._new_entry = {
+                'rfe_mode': s['rfe_mode'],
+                'fstart': s['freq'],
+                'fstop': s['freq'],
+                'fstep': 100 * M,
+                'fshift': s['fshift'],
+                'decimation': s['decimation'],
+                'antenna': s['antenna'],
+                'gain': s['gain'],
+                'ifgain': s['ifgain'],
+                'hdr_gain': s['hdr_gain'],
+                'attenuator': s['attenuator'],
+                'spp': s['spp'],
+                'ppb': s['ppb'],
+                'dwell_s': 0,
+                'dwell_us': 0,
+                'trigtype': 'NONE',
+                'level_fstart': s['trigger_level'][0],
+                'level_fstop': s['trigger_level'][1],
+                'level_amplitude': s['trigger_level'][2],
+                }
+            return
+        if header == 'SWEEP:ENTRY:DELETE':
+            if arg.strip().upper() == 'ALL':
+                self.sweep_entries = []
+            else:
+                del self.sweep_entries[_int(arg)]
+            return
+        entry = self._new_entry
+        if entry is None:
+            raise SimulatorError(-221, 'Settings conflict; no new entry')
+        if header == 'SWEEP:ENTRY:SAVE':
+            self.sweep_entries.append(entry)
+            self._new_entry = None
+        elif header == 'SWEEP:ENTRY:FREQ:CENTER':
+            entry['fstart'], entry['fstop'] = _args(arg, 2)
+        elif header == 'SWEEP:ENTRY:DWELL':
+            entry['dwell_s'], entry['dwell_us'] = _args(arg, 2)
+        elif header == 'SWEEP:ENTRY:TRIGGER:LEVEL':
+            (entry['level_fstart'], entry['level_fstop'],
+                entry['level_amplitude']) = _args(arg, 3)
+        elif header in SWEEP_ENTRY_COMMANDS:
+            key, parse = SWEEP_ENTRY_COMMANDS[header]
+            entry[key] = parse(arg)
+        else:
+            raise SimulatorError(-113, 'Undefined header')
+
+    def _read_sweep_entry(self, index):
+        try:
+            entry = self.sweep_entries[index]
+        except IndexError:
+            raise SimulatorError(-222, 'Data out of range')
+        return ','.join(str(entry.get(k, 0))
+            for k in self.properties.SWEEP_SETTINGS)
+
+    def next_packet(self, timeout=None):
+        """
+        Return the next VRT packet to send as bytes, waiting up to
+        *timeout* seconds for a capture, sweep or stream to produce
+        one, or None if there is nothing to send.
+        """
+        with self._cond:
+            if not self._queue and self._activity is None:
+                self._cond.wait(timeout)
+            if self._queue:
+                return self._queue.popleft()
+            if self._activity is None:
+                return None
+            try:
+                return next(self._activity)
+            except StopIteration:
+                self._abort()
+                return None
+
+    def _sweep(self, entries, iterations, sweep_id):
+        iteration = 0
+        while not iterations or iteration < iterations:
+            for entry in entries:
+                settings = dict(self.settings, **entry)
+                freq = entry['fstart']
+                while freq <= entry['fstop']:
+                    for packet in self._capture(settings, freq,
+                            entry['spp'], entry['ppb'],
+                            (CTX_SWEEPID, sweep_id)):
+                        yield packet
+                    if entry['fstep'] <= 0:
+                        break
+                    freq += entry['fstep']
+            iteration += 1
+        self.sweeping = False
+
+    def _stream(self, settings, stream_id):
+        for packet in self._context(settings, settings['freq'],
+                (CTX_STREAMID, stream_id)):
+            yield packet
+        payloads, stream, rate = self._payloads(settings,
+            settings['freq'], settings['spp'])
+        i = 0
+        while True:
+            yield self._data_packet(stream, payloads[i], settings['spp'],
+                rate)
+            i = (i + 1) % len(payloads)
+
+    def _capture(self, settings, freq, spp, ppb, custom=None):
+        """
+        Return the packets for a block capture of ppb packets
+        """
+        packets = self._context(settings, freq, custom)
+        payloads, stream, rate = self._payloads(settings, freq, spp)
+        for i in range(ppb):
+            packets.append(self._data_packet(stream,
+                payloads[i % len(payloads)], spp, rate))
+        return packets
+
+    def _context(self, settings, freq, custom=None):
+        timestamp = self._timestamp(0, 1)
+        packets = [
+            _context_packet(VRTRECEIVER, CTX_RFFREQ,
+                struct.pack('>Q', int(freq * 2 ** 20)),
+                self._count(VRTRECEIVER), timestamp),
+            _context_packet(VRTDIGITIZER, CTX_REFERENCELEVEL,
+                struct.pack('>hh', 0, int(REFLEVEL * 2 ** 7)),
+                self._count(VRTDIGITIZER), timestamp),
+            ]
+        if custom:
+            indicator, value = custom
+            packets.append(_context_packet(VRTCUSTOM, indicator,
+                struct.pack('>I', value), self._count(VRTCUSTOM),
+                timestamp))
+        return packets
+
+    def _data_packet(self, stream, payload, spp, rate):
+        tsi, tsf = self._timestamp(spp, rate)
+        size = 6 + len(payload) // 4
+        return b''.join([
+            struct.pack('>IIIQ',
+                (VRTDATA << 28) | (1 << 26) | _TIMESTAMP_BITS
+                    | ((self._count(stream) & 0x0f) << 16) | size,
+                stream, tsi, tsf),
+            payload,
+            struct.pack('>I', _TRAILER),
+            ])
+
+    def _count(self, stream_id):
+        count = self._counts.get(stream_id, 0)
+        self._counts[stream_id] = (count + 1) & 0x0f
+        return count
+
+    def _timestamp(self, samples, rate):
+        """
+        Return (tsi, tsf) for a packet of *samples* at *rate* samples
+        per second.  Packets are stamped as if sampled back to back,
+        but never ahead of the wall clock falling behind.
+        """
+        now = max(time.time(), self._clock)
+        self._clock = now + float(samples) / rate
+        tsi = int(now)
+        return tsi, int((now - tsi) * 1e12)
+
+    def _payloads(self, settings, freq, spp):
+        """
+        Return (payloads, stream id, sample rate) of synthetic data for
+        captures of spp samples with these settings
+        """
+        import numpy as np # import here so docstrings are visible even without numpy
+
+        prop = self.properties
+        rfe_mode = settings['rfe_mode']
+        decimation = max(1, settings['decimation'])
+        attenuator = settings['attenuator']
+        key = (rfe_mode, freq, decimation, attenuator, spp)
+        cached = self._payload_cache.get(key)
+        if cached is not None:
+            return cached
+
+        if rfe_mode in ('SH', 'SHN') and decimation > 1:
+            pass_band_center = prop.PASS_BAND_CENTER['DEC_' + rfe_mode]
+            full_bw = float(prop.FULL_BW['DEC_' + rfe_mode]) / decimation
+        else:
+            pass_band_center = prop.PASS_BAND_CENTER[rfe_mode]
+            full_bw = float(prop.FULL_BW[rfe_mode]) / decimation
+        center = freq + full_bw * (0.5 - pass_band_center)
+        i_only = prop.DEFAULT_SAMPLE_TYPE.get(rfe_mode) == I_ONLY
+        attenuation = getattr(prop, 'RFE_ATTENUATION', 0) if attenuator else 0
+
+        count = spp * PAYLOAD_BLOCKS
+        n = np.arange(count)
+        noise = FULL_SCALE * 10 ** ((self.noise_level - REFLEVEL) / 20.0)
+        if i_only:
+            rate = 2 * full_bw
+            samples = self._random.normal(0, noise, count)
+        else:
+            rate = full_bw
+            samples = (self._random.normal(0, noise / np.sqrt(2), count)
+                + 1j * self._random.normal(0, noise / np.sqrt(2), count))
+        for sfreq, level in self.signals:
+            offset = sfreq - center
+            if abs(offset) >= full_bw / 2:
+                continue
+            amplitude = FULL_SCALE * 10 ** (
+                (level - attenuation - REFLEVEL) / 20.0)
+            if i_only:
+                samples += amplitude * np.cos(
+                    2 * np.pi * (offset + full_bw / 2) / rate * n)
+            else:
+                samples += amplitude * np.exp(2j * np.pi * offset / rate * n)
+
+        if i_only:
+            stream = VRT_IFDATA_I14
+            data = np.clip(samples, -FULL_SCALE, FULL_SCALE).astype('>i2')
+        else:
+            stream = VRT_IFDATA_I14Q14
+            data = np.empty((count, 2), dtype='>i2')
+            data[:, 0] = np.clip(samples.real, -FULL_SCALE, FULL_SCALE)
+            data[:, 1] = np.clip(samples.imag, -FULL_SCALE, FULL_SCALE)
+        payloads = [data[i * spp:(i + 1) * spp].tobytes()
+            for i in range(PAYLOAD_BLOCKS)]
+
+        if len(self._payload_cache) >= PAYLOAD_CACHE_SIZE:
+            self._payload_cache.clear()
+        self._payload_cache[key] = (payloads, stream, rate)
+        return payloads, stream, rate
@@ -0,0 +1,254 @@
+import time
+import socket
+import threading
+
+from pyrf.connectors.base import SCPI_PORT, VRT_PORT
+from pyrf.simulator.device import SimulatedWSA
+
+import logging
+logger = logging.getLogger(__name__)
+
+# seconds a VRT sender waits for data before checking for shutdown
+IDLE_WAIT = 0.1
+
+
+def _to_str(data):
+    if isinstance(data, str):
+        return data
+    return data.decode('latin-1')
+
+
+def _to_bytes(data):
+    if isinstance(data, bytes):
+        return data
+    return data.encode('latin-1')
+
+
+def _shutdown(sock):
+    """
+    Shut down a socket if there is one, waking threads blocked on it
+    """
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+        pass
+
+
+class SimulatorServer(object):
+    """
+    TCP server that makes a :class:`pyrf.simulator.device.SimulatedWSA`
+    available on the SCPI and VRT ports, so that connectors,
+    :class:`pyrf.sweep_device.SweepDevice` and the GUI may be used
+    without hardware.
+
+    Each SCPI connection is served by its own thread.  VRT packets are
+    sent to the most recent VRT connection as fast as it accepts them,
+    or paced to *data_rate*.
+
+    .. code-block:: python
+
+       server = SimulatorServer(scpi_port=0, vrt_port=0)
+       server.start()
+       dut = WSA(PlainSocketConnector(scpi_port=server.scpi_port,
+           vrt_port=server.vrt_port))
+       dut.connect('127.0.0.1')
+
+    :param device: the simulated device, defaults to a new
+                   :class:`pyrf.simulator.device.SimulatedWSA`
+    :param host: address to listen on, '' for all interfaces
+    :param scpi_port: SCPI port, 0 to pick a free port
+    :param vrt_port: VRT port, 0 to pick a free port
+    :param data_rate: maximum VRT bytes per second, or None for no limit
+    """
+    def __init__(self, device=None, host='', scpi_port=SCPI_PORT,
+            vrt_port=VRT_PORT, data_rate=None):
+        self.device = device if device is not None else SimulatedWSA()
+        self.host = host
+        self.scpi_port = scpi_port
+        self.vrt_port = vrt_port
+        self.data_rate = data_rate
+        self.bytes_sent = 0
+        self.packets_sent = 0
+        self._running = False
+        self._scpi_listener = None
+        self._vrt_listener = None
+        self._scpi_clients = []
+        self._vrt_client = None
+        self._threads = []
+        self._client_threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start listening and serving connections on background threads.
+        The ports actually used are stored in scpi_port and vrt_port.
+        """
+        self._scpi_listener = self._listen(self.scpi_port)
+        self._vrt_listener = self._listen(self.vrt_port)
+        self.scpi_port = self._scpi_listener.getsockname()[1]
+        self.vrt_port = self._vrt_listener.getsockname()[1]
+        self._running = True
+        self._spawn(self._accept_scpi, 'pyrf simulator SCPI')
+        self._spawn(self._accept_vrt, 'pyrf simulator VRT')
+        logger.info('simulating %s on ports %d (SCPI) and %d (VRT)',
+            self.device.device_id, self.scpi_port, self.vrt_port)
+
+    def serve_forever(self):
+        """
+        Start the server and block until interrupted
+        """
+        self.start()
+        try:
+            while self._running:
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        Close all connections and stop the server threads
+        """
+        with self._lock:
+            self._running = False
+            clients = [self._vrt_client] + self._scpi_clients
+            threads = self._threads + self._client_threads
+        for sock in [self._scpi_listener, self._vrt_listener]:
+            if sock is not None:
+                _shutdown(sock)
+                sock.close()
+        # each client thread closes its own connection when it ends
+        for sock in clients:
+            _shutdown(sock)
+        for t in threads:
+            t.join()
+
+    def drop_clients(self):
+        """
+        Close the client connections while still accepting new ones,
+        as when the network to a device fails
+        """
+        with self._lock:
+            clients = [self._vrt_client] + self._scpi_clients
+        for sock in clients:
+            _shutdown(sock)
+
+    def _listen(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, port))
+        sock.listen(5)
+        return sock
+
+    def _spawn(self, target, name, *args):
+        t = threading.Thread(target=target, name=name, args=args)
+        t.daemon = True
+        t.start()
+        self._threads.append(t)
+
+    def _spawn_client(self, target, name, conn):
+        """
+        Start a thread serving conn, or close conn if the server is
+        stopping.  Must be called with the lock held.
+        """
+        if not self._running:
+            conn.close()
+            return
+        t = threading.Thread(target=target, name=name, args=(conn,))
+        t.daemon = True
+        self._client_threads.append(t)
+        t.start()
+
+    def _client_closed(self, conn):
+        """
+        Forget and close a client connection, called by the thread
+        serving it as it ends
+        """
+        with self._lock:
+            if conn in self._scpi_clients:
+                self._scpi_clients.remove(conn)
+            if conn is self._vrt_client:
+                self._vrt_client = None
+            self._client_threads.remove(threading.current_thread())
+        conn.close()
+
+    def _accept(self, listener):
+        try:
+            return listener.accept()[0]
+        except socket.error:
+            if self._running:
+                raise
+            return None
+
+    def _accept_scpi(self):
+        while self._running:
+            conn = self._accept(self._scpi_listener)
+            if conn is None:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
+            with self._lock:
+                if self._running:
+                    self._scpi_clients.append(conn)
+                self._spawn_client(self._serve_scpi,
+                    'pyrf simulator SCPI client', conn)
+
+    def _serve_scpi(self, conn):
+        buf = ''
+        try:
+            while self._running:
+                data = conn.recv(4096)
+                if not data:
+                    return
+                buf += _to_str(data)
+                lines = buf.split('\n')
+                buf = lines.pop()
+                replies = []
+                for line in lines:
+                    reply = self.device.scpi(line)
+                    if reply is not None:
+                        replies.append(reply + '\n')
+                if replies:
+                    conn.sendall(_to_bytes(''.join(replies)))
+        except socket.error as e:
+            logger.debug('SCPI client closed: %s', e)
+        finally:
+            self._client_closed(conn)
+
+    def _accept_vrt(self):
+        while self._running:
+            conn = self._accept(self._vrt_listener)
+            if conn is None:
+                return
+            with self._lock:
+                if self._running:
+                    # the device only sends to one VRT client
+                    _shutdown(self._vrt_client)
+                    self._vrt_client = conn
+                self._spawn_client(self._serve_vrt,
+                    'pyrf simulator VRT client', conn)
+
+    def _serve_vrt(self, conn):
+        start = time.time()
+        sent = 0
+        try:
+            while self._running and conn is self._vrt_client:
+                packet = self.device.next_packet(IDLE_WAIT)
+                if packet is None:
+                    start = time.time()
+                    sent = 0
+                    continue
+                conn.sendall(packet)
+                self.bytes_sent += len(packet)
+                self.packets_sent += 1
+                if self.data_rate:
+                    sent += len(packet)
+                    ahead = start + float(sent) / self.data_rate - time.time()
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except socket.error as e:
+            logger.debug('VRT client closed: %s', e)
+        finally:
+            self._client_closed(conn)
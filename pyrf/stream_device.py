@@ -0,0 +1,372 @@
+import numpy as np
+
+from pyrf.vrt import I_ONLY
+from pyrf.numpy_util import packet_samples, compute_fft_samples
+from pyrf.util import capture_geometry, capture_center_freq
+
+DEFAULT_BUFFER_SAMPLES = 2 ** 20
+DEFAULT_SPP = 16384
+
+
+class StreamDeviceError(Exception):
+    pass
+
+
+class IQRingBuffer(object):
+    """
+    Fixed-size ring buffer of samples.  Samples are addressed by their
+    absolute index in the stream, counting from 0 for the first sample
+    written, so a consumer can tell when it has fallen behind.
+
+    :param size: number of samples kept
+    :param dtype: numpy dtype of the samples, e.g. complex64 for IQ data
+    """
+    def __init__(self, size, dtype=np.complex64):
+        self.size = size
+        self.dtype = np.dtype(dtype)
+        self._data = np.zeros(size, dtype=self.dtype)
+        self.written = 0
+
+    @property
+    def oldest(self):
+        """
+        Absolute index of the oldest sample still available
+        """
+        return max(0, self.written - self.size)
+
+    def write(self, samples):
+        """
+        Append samples, overwriting the oldest ones when full
+        """
+        count = len(samples)
+        if count >= self.size:
+            self.written += count - self.size
+            samples = samples[count - self.size:]
+            count = self.size
+        start = self.written % self.size
+        first = min(count, self.size - start)
+        self._data[start:start + first] = samples[:first]
+        self._data[:count - first] = samples[first:]
+        self.written += count
+
+    def read(self, start, count, out=None):
+        """
+        Return a contiguous copy of *count* samples beginning at
+        absolute index *start*
+
+        :param out: optional array to copy the samples into
+        """
+        if start < self.oldest or start + count > self.written:
+            raise StreamDeviceError('samples %d-%d not in buffer (%d-%d)' % (
+                start, start + count, self.oldest, self.written))
+        if out is None:
+            out = np.empty(count, dtype=self.dtype)
+        offset = start % self.size
+        first = min(count, self.size - offset)
+        out[:first] = self._data[offset:offset + first]
+        out[first:count] = self._data[:count - first]
+        return out
+
+    def latest(self, count, out=None):
+        """
+        Return a contiguous copy of the most recent *count* samples
+        """
+        return self.read(self.written - count, count, out)
+
+
+class StreamCaptureDevice(object):
+    """
+    Virtual device that streams samples continuously from the real
+    device into a :class:`IQRingBuffer` and returns power spectra and
+    raw sample windows from it, so the frame rate is limited by the
+    link instead of a capture request for every frame.
+
+    Frames are *points* samples long and start every
+    points * (1 - overlap) samples.  Frames that have already been
+    overwritten when they are read are skipped and counted in
+    frames_dropped.
+
+    Samples from before a trigger may be captured with :meth:`arm`.
+    The trigger may come from a software level detector running on
+    the stream or from calling :meth:`trigger`, e.g. when the device
+    reports a trigger of its own.
+
+    :param real_device: device that will will be used for capturing data,
+                        typically a :class:`pyrf.thinkrf.WSA` instance.
+    :param async_callback: callback to use for async operation (not used if
+                           real_device is using a :class:`PlainSocketConnector`)
+    :param buffer_samples: number of samples kept in the ring buffer
+    """
+    def __init__(self, real_device, async_callback=None,
+            buffer_samples=DEFAULT_BUFFER_SAMPLES):
+
+        self.real_device = real_device
+        if real_device.async_connector():
+            if not async_callback:
+                raise StreamDeviceError(
+                    "async_callback required for async operation")
+            self.real_device.set_async_callback(None)
+        else:
+            if async_callback:
+                raise StreamDeviceError(
+                    "async_callback not applicable for sync operation")
+        self.async_callback = async_callback
+        self.buffer_samples = buffer_samples
+        self.ring = None
+        self.streaming = False
+        self.frames_dropped = 0
+        self.discontinuities = 0
+        self._armed = None
+        self._trigger_index = None
+        self._triggered = None
+
+    def start(self, rfe_mode, freq, points, device_settings=None,
+            overlap=0.0, spp=DEFAULT_SPP, compute_spectrum=True):
+        """
+        Configure the device and start streaming
+
+        :param rfe_mode: radio front end mode, e.g. 'ZIF', 'SH', ...
+        :param freq: center frequency
+        :param points: samples in each frame
+        :param device_settings: attenuator, decimation frequency shift
+                                and other device settings
+        :type dict:
+        :param overlap: fraction of each frame shared with the next,
+                        from 0 up to but not including 1
+        :param spp: samples per packet requested from the device
+        :param compute_spectrum: False to return only raw samples
+        """
+        if not 0 <= overlap < 1:
+            raise StreamDeviceError('overlap must be in [0, 1)')
+        if points > self.buffer_samples:
+            raise StreamDeviceError('points larger than buffer_samples')
+        if self.streaming:
+            self.stop()
+
+        settings = dict(device_settings or {}, freq=freq, rfe_mode=rfe_mode)
+        self._device_set = settings
+        self.points = points
+        self.hop = max(1, int(points * (1 - overlap)))
+        self.compute_spectrum = compute_spectrum
+
+        prop = self.real_device.properties
+        self._freq = capture_center_freq(prop, rfe_mode, freq)
+        self._decimation = settings.get('decimation', 1)
+        self.sample_rate = float(prop.FULL_BW[rfe_mode]) / self._decimation
+        if prop.DEFAULT_SAMPLE_TYPE.get(rfe_mode) == I_ONLY:
+            self.sample_rate *= 2
+        self._fshift = settings.get('fshift', 0)
+
+        self.real_device.abort()
+        self.real_device.flush()
+        self.real_device.apply_device_settings(settings)
+        self.real_device.spp(spp)
+        self.real_device.request_read_perm()
+
+        self._vrt_context = {}
+        self._spec_inv = False
+        self._next_frame = 0
+        if self.ring is not None:
+            self._next_frame = self.ring.written
+
+        if self.async_callback:
+            self.real_device.set_async_callback(self.receive_packet)
+        self.real_device.stream_start()
+        self.streaming = True
+
+    def stop(self):
+        """
+        Stop streaming and discard any data still in flight
+        """
+        if self.async_callback:
+            self.real_device.set_async_callback(None)
+        self.real_device.stream_stop()
+        self.real_device.flush()
+        self.streaming = False
+
+    def read_frame(self):
+        """
+        Read packets until the next frame is available and return it.
+        Only for sync operation.
+
+        :returns: (fstart, fstop, data) where data is a dict containing
+                  'samples', 'context', 'usable_bins' and 'pow_data'
+                  (if compute_spectrum is enabled)
+        """
+        if self.async_callback:
+            raise StreamDeviceError('read_frame not available in async mode')
+        while True:
+            result = self._next_available_frame()
+            if result is not None:
+                return result
+            self.receive_packet(self.real_device.read())
+
+    def arm(self, pre_trigger, post_trigger, level=None,
+            trigger_callback=None):
+        """
+        Arm a single capture of the samples around the next trigger.
+        Must be called after :meth:`start`.
+
+        :param pre_trigger: seconds of samples before the trigger
+        :param post_trigger: seconds of samples after the trigger
+        :param level: software trigger level in dBFS, or None to wait
+                      for a call to :meth:`trigger`
+        :param trigger_callback: function called with the result of
+                                 :meth:`read_triggered` in async mode
+        """
+        pre = int(round(pre_trigger * self.sample_rate))
+        post = int(round(post_trigger * self.sample_rate))
+        if pre + post > self.buffer_samples:
+            raise StreamDeviceError('pre and post trigger samples (%d) '
+                'larger than buffer_samples' % (pre + post))
+        if self.async_callback and not trigger_callback:
+            raise StreamDeviceError(
+                "trigger_callback required for async operation")
+        threshold = None
+        if level is not None:
+            # compare power of samples to full scale, avoiding a log
+            threshold = 10 ** (level / 10.0)
+        self._armed = (pre, post, threshold, trigger_callback)
+        self._trigger_index = None
+        self._triggered = None
+
+    def trigger(self, index=None):
+        """
+        Trigger an armed capture
+
+        :param index: absolute sample index of the trigger, defaults
+                      to the next sample to be received
+        """
+        if not self._armed or self._trigger_index is not None:
+            return
+        if index is None:
+            index = self.ring.written if self.ring is not None else 0
+        self._trigger_index = index
+        self._check_triggered()
+
+    def read_triggered(self):
+        """
+        Read packets until the armed capture is complete and return it.
+        Only for sync operation.
+
+        :returns: (trigger_index, pre_samples, samples) where samples
+                  is a contiguous array with pre_samples samples from
+                  before the trigger and the trigger sample at
+                  samples[pre_samples]
+        """
+        if self.async_callback:
+            raise StreamDeviceError(
+                'read_triggered not available in async mode')
+        if not self._armed and self._triggered is None:
+            raise StreamDeviceError('not armed')
+        while self._triggered is None:
+            self.receive_packet(self.real_device.read())
+        result, self._triggered = self._triggered, None
+        return result
+
+    def latest_iq(self, count):
+        """
+        Return a copy of the most recent *count* samples received
+        """
+        if self.ring is None or self.ring.written < count:
+            raise StreamDeviceError('%d samples not yet received' % count)
+        return self.ring.latest(count)
+
+    def receive_packet(self, packet):
+        """
+        Add a packet to the ring buffer, calling async_callback for
+        each frame it completes in async mode
+        """
+        if packet.is_context_packet():
+            if 'reconnect_gap' in packet.fields:
+                # frames must not span the samples lost
+                self.discontinuities += 1
+                if self.ring is not None:
+                    self._next_frame = max(self._next_frame,
+                        self.ring.written)
+                return
+            self._vrt_context.update(packet.fields)
+            return
+        samples = packet_samples(packet)
+        self._spec_inv = packet.spec_inv
+        if self.ring is None or self.ring.dtype != samples.dtype:
+            self.ring = IQRingBuffer(self.buffer_samples, samples.dtype)
+            self._next_frame = 0
+        elif packet.sample_loss:
+            self.discontinuities += 1
+            self._next_frame = max(self._next_frame, self.ring.written)
+        self.ring.write(samples)
+        if self._armed:
+            self._detect_trigger(samples)
+
+        if not self.async_callback:
+            return
+        while True:
+            result = self._next_available_frame()
+            if result is None:
+                return
+            self.async_callback(*result)
+
+    def _detect_trigger(self, samples):
+        threshold = self._armed[2]
+        if threshold is not None and self._trigger_index is None:
+            if np.iscomplexobj(samples):
+                power = samples.real ** 2 + samples.imag ** 2
+            else:
+                power = samples ** 2
+            above = np.flatnonzero(power >= threshold)
+            if len(above):
+                self._trigger_index = (self.ring.written - len(samples)
+                    + int(above[0]))
+        self._check_triggered()
+
+    def _check_triggered(self):
+        if self._trigger_index is None or self.ring is None:
+            return
+        pre, post, threshold, trigger_callback = self._armed
+        if self.ring.written < self._trigger_index + post:
+            return
+        start = max(self.ring.oldest, self._trigger_index - pre)
+        samples = self.ring.read(start, self._trigger_index + post - start)
+        self._armed = None
+        self._triggered = (self._trigger_index,
+            self._trigger_index - start, samples)
+        self._trigger_index = None
+        if trigger_callback:
+            result, self._triggered = self._triggered, None
+            trigger_callback(*result)
+
+    def _next_available_frame(self):
+        ring = self.ring
+        if ring is None or ring.written < self._next_frame + self.points:
+            return
+        if self._next_frame < ring.oldest:
+            skip = -(-(ring.oldest - self._next_frame) // self.hop)
+            self.frames_dropped += skip
+            self._next_frame += skip * self.hop
+            if ring.written < self._next_frame + self.points:
+                return
+        samples = ring.read(self._next_frame, self.points)
+        self._next_frame += self.hop
+        return self._frame(samples)
+
+    def _frame(self, samples):
+        prop = self.real_device.properties
+        usable_bins, fstart, fstop = capture_geometry(
+            prop,
+            self._device_set['rfe_mode'],
+            len(samples),
+            self._decimation,
+            self._fshift,
+            self._freq,
+            self._spec_inv)
+        data = {
+            'samples': samples,
+            'context': self._vrt_context,
+            'usable_bins': list(usable_bins),
+            }
+        if self.compute_spectrum:
+            data['pow_data'] = compute_fft_samples(self.real_device,
+                samples, self._vrt_context.get('reflevel', 0),
+                self._spec_inv)
+        return (fstart, fstop, data)
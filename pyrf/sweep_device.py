@@ -1,12 +1,18 @@
 import math
 import random
-from collections import namedtuple
+from collections import namedtuple, deque
+from multiprocessing.pool import ThreadPool
+import threading
 import time
 
 import numpy as np
 
 from pyrf.numpy_util import compute_fft
 from pyrf.config import SweepEntry
+from pyrf.sweep_timing import SweepTimingModel
+
+# largest capture supported in a sweep entry
+MAX_SWEEP_POINTS = 32 * 1024
 
 class SweepStep(namedtuple('SweepStep', '''
         fcenter
@@ -42,7 +48,7 @@ class SweepStep(namedtuple('SweepStep', '''
         parameters
         """
         # FIXME: this maximum depends on rfe_mode
-        if self.points > 32*1024:
+        if self.points > MAX_SWEEP_POINTS:
             raise SweepDeviceError('large captures not yet supported')
 
         s = SweepEntry(
@@ -66,6 +72,45 @@ class SweepStep(namedtuple('SweepStep', '''
 
 
 
+class SpectrumRegion(namedtuple('SpectrumRegion', '''
+        fstart
+        fstop
+        rbw
+        offset
+        length
+        ''')):
+    """
+    Part of a spectrum returned by
+    :meth:`SweepDevice.capture_adaptive_spectrum`
+
+    :param fstart: starting frequency of this region in Hz
+    :param fstop: ending frequency of this region in Hz
+    :param rbw: actual bin spacing in this region in Hz
+    :param offset: index of the first bin of this region
+    :param length: number of bins in this region
+    """
+    __slots__ = []
+
+
+class TimedSweepPlan(namedtuple('TimedSweepPlan', '''
+        fstart
+        fstop
+        plan
+        mode
+        duration
+        ''')):
+    """
+    Sweep plan returned by :func:`plan_sweep_timed`
+
+    :param fstart: actual starting frequency in Hz
+    :param fstop: actual ending frequency in Hz
+    :param plan: list of :class:`SweepStep` instances
+    :param mode: sweep mode chosen, 'ZIF left band', 'ZIF' or 'SH'
+    :param duration: predicted sweep time in seconds
+    """
+    __slots__ = []
+
+
 class SweepDeviceError(Exception):
     pass
 
@@ -79,8 +124,29 @@ class SweepDevice(object):
                         typically a :class:`pyrf.devices.thinkrf.WSA` instance.
     :param callback: callback to use for async operation (not used if
                      real_device is using a :class:`PlainSocketConnector`)
+    :param partial_callback: optional callback passed
+                             (fstart, fstop, bins, offset) for each part
+                             of a sweep as it is collected, where bins
+                             is a view into the sweep being filled and
+                             offset is the index of its first bin.
+                             A part never spans the gap between two
+                             regions of an adaptive sweep.
+    :param partial_steps: number of sweep steps to collect before each
+                          call to partial_callback
+    :param pipeline_workers: number of threads used to compute FFTs
+                             while packets are being received, 0 to
+                             compute each FFT before reading the next
+                             packet (only for sync operation), call
+                             :meth:`close` to stop the threads
+    :param pipeline_depth: maximum number of packets waiting for an FFT,
+                           defaults to twice pipeline_workers
+    :param timing_model: :class:`pyrf.sweep_timing.SweepTimingModel`
+                         used for planning sweeps in 'auto' mode,
+                         defaults to the timing_model of real_device
     """
-    def __init__(self, real_device, async_callback=None):
+    def __init__(self, real_device, async_callback=None,
+            partial_callback=None, partial_steps=1,
+            pipeline_workers=0, pipeline_depth=None, timing_model=None):
         self.real_device = real_device
         self._sweep_id = random.randrange(0, 2**32-1) # don't want 2**32-1
         if real_device.async_connector():
@@ -93,16 +159,31 @@ class SweepDevice(object):
             if async_callback:
                 raise SweepDeviceError(
                     "async_callback not applicable for sync operation")
+        if pipeline_workers and async_callback:
+            raise SweepDeviceError(
+                "pipeline_workers only applies to sync operation")
         self._prev_sweep_id = None
         self.async_callback = async_callback
+        self.partial_callback = partial_callback
+        self.partial_steps = partial_steps
+        self.pipeline_workers = pipeline_workers
+        self.pipeline_depth = pipeline_depth
+        self._pool = None
+        self.timing_model = timing_model
+        self.predicted_sweep_seconds = None
         self.continuous = False
         self.context_bytes_received = 0
         self.data_bytes_received = 0
         self.data_bytes_processed = 0
         self.martian_bytes_discarded = 0
         self.past_end_bytes_discarded = 0
+        self.sweeps_restarted = 0
         self.fft_calculation_seconds = 0.0
         self.bin_collection_seconds = 0.0
+        self._coarse_map = None
+        self._coarse_params = None
+        self._coarse_age = 0
+        self._fine_plans = []
 
     def capture_power_spectrum(self,
             fstart, fstop, rbw,
@@ -123,7 +204,9 @@ class SweepDevice(object):
         :type rbw: float
         :param device_settings: antenna, gain and other device settings
         :type dict:
-        :param mode: sweep mode, 'ZIF left band', 'ZIF' or 'SH'
+        :param mode: sweep mode, 'ZIF left band', 'ZIF', 'SH' or 'auto'
+                     to choose the mode and decimation with the shortest
+                     predicted sweep time
         :type mode: string
         :param continuous: async continue after first sweep
         :type continuous: bool
@@ -133,15 +216,204 @@ class SweepDevice(object):
         if continuous and not self.async_callback:
             raise SweepDeviceError(
                 "continuous mode only applies to async operation")
+
+        if mode == 'auto':
+            fstart, fstop, plan, mode, self.predicted_sweep_seconds = (
+                plan_sweep_timed(self.real_device, fstart, fstop, rbw,
+                    self.timing_model or self.real_device.timing_model,
+                    min_points=min_points))
+        else:
+            fstart, fstop, plan = plan_sweep(self.real_device,
+                fstart, fstop, rbw, mode, min_points)
+        return self._capture_plan(fstart, fstop, plan, device_settings,
+            mode, continuous)
+
+    def capture_adaptive_spectrum(self,
+            fstart, fstop, rbw, coarse_rbw, threshold,
+            device_settings=None,
+            mode='ZIF',
+            guard=None,
+            coarse_interval=10,
+            min_points=32):
+        """
+        Capture power spectral density with a fast coarse sweep of the
+        whole range followed by a fine sweep of only the occupied
+        regions found in the coarse sweep.
+
+        The coarse map is reused for up to *coarse_interval* calls with
+        the same parameters, or until a fine region no longer contains
+        any bins above *threshold*.
+
+        :param fstart: starting frequency in Hz
+        :type fstart: float
+        :param fstop: ending frequency in Hz
+        :type fstop: float
+        :param rbw: requested RBW for occupied regions in Hz
+        :type rbw: float
+        :param coarse_rbw: requested RBW for the coarse sweep in Hz
+        :type coarse_rbw: float
+        :param threshold: level in dBm above which a coarse bin is
+                          considered occupied
+        :type threshold: float
+        :param device_settings: antenna, gain and other device settings
+        :type dict:
+        :param mode: sweep mode, 'ZIF left band', 'ZIF' or 'SH'
+        :type mode: string
+        :param guard: frequency in Hz added to each side of an occupied
+                      region, defaults to *coarse_rbw*
+        :type guard: float
+        :param coarse_interval: maximum number of calls that reuse the
+                                same coarse map
+        :type coarse_interval: int
+        :param min_points: smallest number of points per capture from real_device
+        :type min_points: int
+
+        :returns: (fstart, fstop, bins, regions) where regions is a list
+                  of :class:`SpectrumRegion` instances describing the
+                  resolution of each part of bins
+
+        Only available for sync operation.
+        """
+        if self.async_callback:
+            raise SweepDeviceError(
+                "adaptive mode only applies to sync operation")
+        if device_settings is None:
+            device_settings = {}
+        if guard is None:
+            guard = coarse_rbw
+
+        # copied so that changes to the caller's dict are noticed
+        params = (fstart, fstop, rbw, coarse_rbw, threshold,
+            dict(device_settings), mode, guard, min_points)
+        if (self._coarse_map is None or self._coarse_params != params
+                or self._coarse_age >= coarse_interval):
+            cfstart, cfstop, cbins = self.capture_power_spectrum(
+                fstart, fstop, coarse_rbw, device_settings, mode,
+                min_points=min_points)
+            occupied = find_occupied_regions(cfstart, cfstop, cbins,
+                threshold, guard)
+            if (self._coarse_map is None or self._coarse_params != params
+                    or occupied != self._coarse_map[3]):
+                self._fine_plans = self._plan_fine_regions(occupied, rbw,
+                    mode, min_points)
+            self._coarse_map = (cfstart, cfstop, cbins, occupied)
+            self._coarse_params = params
+            self._coarse_age = 0
+        self._coarse_age += 1
+
+        cfstart, cfstop, cbins, occupied = self._coarse_map
+        fine = [p for p in self._fine_plans if p[4] > p[3]]
+        if not fine:
+            return (cfstart, cfstop, cbins,
+                [SpectrumRegion(cfstart, cfstop,
+                    float(cfstop - cfstart) / max(1, len(cbins)),
+                    0, len(cbins))])
+
+        plan = []
+        bin_regions = []
+        offset = 0
+        for rstart, rstop, rplan, first, end in fine:
+            plan.extend(rplan)
+            bin_size = float(rstop - rstart) / (end - first)
+            bin_regions.append((rstart, bin_size, offset + first,
+                offset + end))
+            offset += sum(ss.bins_keep for ss in rplan)
+        _, _, fbins = self._capture_plan(fine[0][0], fine[-1][1], plan,
+            device_settings, mode, False, bin_regions)
+
+        cbin_size = float(cfstop - cfstart) / len(cbins)
+        def coarse_region(start, stop):
+            # only whole coarse bins, so that no bin overlaps a fine region
+            i0 = max(0, int(math.ceil((start - cfstart) / cbin_size - 1e-9)))
+            i1 = min(len(cbins),
+                int(math.floor((stop - cfstart) / cbin_size + 1e-9)))
+            if i1 <= i0:
+                return None
+            return (cfstart + i0 * cbin_size, cfstart + i1 * cbin_size,
+                cbin_size, cbins[i0:i1])
+
+        pieces = []
+        left = cfstart
+        for (rstart, rstop, rplan, first, end), (_, bin_size, ffirst, fend
+                ) in zip(fine, bin_regions):
+            rbins = fbins[ffirst:fend]
+            if not len(rbins) or rbins.max() < threshold:
+                # signal is gone, look for it again next time
+                self._coarse_age = coarse_interval
+            gap = coarse_region(left, rstart)
+            if gap:
+                pieces.append(gap)
+            pieces.append((rstart, rstop, bin_size, rbins))
+            left = rstop
+        gap = coarse_region(left, cfstop)
+        if gap:
+            pieces.append(gap)
+
+        regions = []
+        offset = 0
+        for start, stop, bin_size, pbins in pieces:
+            regions.append(SpectrumRegion(start, stop, bin_size, offset,
+                len(pbins)))
+            offset += len(pbins)
+        bins = np.concatenate([p[3] for p in pieces])
+        return (pieces[0][0], pieces[-1][1], bins, regions)
+
+    def _plan_fine_regions(self, occupied, rbw, mode, min_points):
+        """
+        Plan a sweep of each occupied region, returning a list of
+        (fstart, fstop, plan, first, end) where bins first to end of
+        the plan's bins cover fstart to fstop.  Planned sweeps extend
+        past their region, so the bins outside it are left out, and
+        regions whose planned sweeps would overlap are swept as one.
+        """
+        planned = []
+        for rstart, rstop in occupied:
+            while True:
+                pstart, pstop, rplan = plan_sweep(self.real_device,
+                    rstart, rstop, rbw, mode, min_points)
+                if not planned or pstart >= planned[-1][1]:
+                    break
+                rstart = planned.pop()[3]
+            planned.append((pstart, pstop, rplan, rstart, rstop))
+
+        fine_plans = []
+        for pstart, pstop, rplan, rstart, rstop in planned:
+            count = sum(ss.bins_keep for ss in rplan)
+            if not count:
+                fine_plans.append((rstart, rstop, rplan, 0, 0))
+                continue
+            bin_size = float(pstop - pstart) / count
+            first = max(0, int(round((rstart - pstart) / bin_size)))
+            end = min(count, int(round((rstop - pstart) / bin_size)))
+            fine_plans.append((pstart + first * bin_size,
+                pstart + end * bin_size, rplan, first, end))
+        return fine_plans
+
+    def _capture_plan(self, fstart, fstop, plan, device_settings, mode,
+            continuous, bin_regions=None):
+        """
+        Sweep *plan*, where *bin_regions* is a list of (fstart, bin
+        size, first bin, end bin) for each part of the plan's bins with
+        evenly spaced frequencies, when the plan covers separate
+        frequency ranges
+        """
         self.device_settings = device_settings
         self.continuous = continuous
 
+        if bin_regions is None:
+            count = sum(ss.bins_keep for ss in plan)
+            bin_regions = []
+            if count:
+                bin_regions.append((fstart, float(fstop - fstart) / count,
+                    0, count))
+        # used to report the frequencies of partial results
+        self._bin_regions = bin_regions
+
         self.real_device.abort()
         self.real_device.flush()
         self.real_device.request_read_perm()
 
-        self.fstart, self.fstop, self.plan = plan_sweep(self.real_device,
-            fstart, fstop, rbw, mode, min_points)
+        self.fstart, self.fstop, self.plan = fstart, fstop, plan
         self.rfe_mode = 'SH' if mode == 'SH' else 'ZIF'
 
         self.sweep_segments = []
@@ -175,31 +447,50 @@ class SweepDevice(object):
         if not self.plan:
             return (self.fstart, self.fstop, [])
         self._start_sweep(entries)
+        if self.pipeline_workers:
+            return self._pipelined_sweep()
         result = None
         while result is None:
             result = self._vrt_receive(self.real_device.read())
         return result
 
     def _start_sweep(self, entries):
-        self.real_device.abort()
-        self.real_device.flush()
-        self.real_device.sweep_clear()
         assert entries, "starting sweep with no sweep entries"
-        for e in entries:
-            self.real_device.sweep_add(e)
         self._prev_sweep_id = self._sweep_id
         self._sweep_id = (self._sweep_id + 1) & (2**32 - 1)
         self._vrt_context = {}
         self._ss_index = 0
         self._ss_received = 0
-        self.bin_arrays = []
-        self.real_device.sweep_iterations(0 if self.continuous else 1)
-        self.real_device.sweep_start(self._sweep_id)
+        self._new_sweep_buffer()
+        with self.real_device.batch():
+            self.real_device.abort()
+            self.real_device.flush()
+            self.real_device.sweep_clear()
+            for e in entries:
+                self.real_device.sweep_add(e)
+            self.real_device.sweep_iterations(0 if self.continuous else 1)
+            self.real_device.sweep_start(self._sweep_id)
 
     def _vrt_receive(self, packet):
+        step = self._vrt_step(packet)
+        if step is None:
+            return
+        self._step_collected(*self._collect_bins(packet, *step))
+        if self._ss_index == len(self.plan):
+            return self._finish_sweep()
+
+    def _vrt_step(self, packet):
+        """
+        Update sweep progress for packet received and return
+        (context, dest, start, take) for collecting its bins, or None
+        if packet contains no bins for this sweep.
+        """
         packet_bytes = packet.size * 4
 
         if packet.is_context_packet():
+            if 'reconnect_gap' in packet.fields:
+                self._restart_sweep()
+                return
             self._vrt_context.update(packet.fields)
             self.context_bytes_received += packet_bytes
             return
@@ -218,20 +509,51 @@ class SweepDevice(object):
         assert 'reflevel' in self._vrt_context, (
             "missing required context, sweep failed")
 
-        freq = self._vrt_context['rffreq']
-
-        if self._ss_index is None:
+        if self._ss_index is None or self._ss_index == len(self.plan):
             self.past_end_bytes_discarded += packet_bytes
             return # more data than we asked for
 
-        fft_start_time = time.time()
-        pow_data = compute_fft(self.real_device, packet, self._vrt_context)
-        # collect and compute bins
-        collect_start_time = time.time()
         ss = self.plan[self._ss_index]
         pass_now = 0 if self._ss_received else ss.bins_pass
         take = min(ss.bins_run - pass_now, ss.bins_keep - self._ss_received)
         start = ss.bins_skip + pass_now
+        dest = self._bins_dispatched
+        self._bins_dispatched += take
+        self._ss_received += take
+        self.data_bytes_processed += take * 4
+
+        if self._ss_received >= ss.bins_keep:
+            self._ss_received = 0
+            self._ss_index += 1
+
+        return (self._vrt_context, dest, start, take)
+
+    def _restart_sweep(self):
+        """
+        Discard the partly received sweep after the connection dropped.
+        The device replays the same sweep, which is collected again
+        from its first step.
+        """
+        self._vrt_context = {}
+        if self._ss_index is None:
+            return
+        self.sweeps_restarted += 1
+        self._ss_index = 0
+        self._ss_received = 0
+        self._new_sweep_buffer()
+
+    def _collect_bins(self, packet, context, dest, start, take):
+        """
+        Compute the FFT of packet and copy the bins selected into the
+        sweep array at dest.  This may be run from a worker thread.
+
+        :returns: (dest, number of bins copied, fft seconds,
+                  collection seconds)
+        """
+        fft_start_time = time.time()
+        pow_data = compute_fft(self.real_device, packet, context)
+        # collect and compute bins
+        collect_start_time = time.time()
 
         # adjust for not-centered pass band
         pbc = self.real_device.properties.PASS_BAND_CENTER[self.rfe_mode]
@@ -241,21 +563,74 @@ class SweepDevice(object):
                 offset = -offset
             start += offset
 
-        self.bin_arrays.append(pow_data[start:start + take])
-        self._ss_received += take
+        collected = pow_data[start:start + take]
+        self.bins[dest:dest + len(collected)] = collected
         collect_stop_time = time.time()
 
-        self.fft_calculation_seconds += collect_start_time - fft_start_time
-        self.bin_collection_seconds += collect_stop_time - collect_start_time
-        self.data_bytes_processed += take * 4
+        return (dest, len(collected),
+            collect_start_time - fft_start_time,
+            collect_stop_time - collect_start_time)
 
-        if self._ss_received < ss.bins_keep:
-            return
+    def _step_collected(self, dest, count, fft_seconds, collection_seconds):
+        """
+        Account for a step collected, called in sweep order.
+        """
+        end = self._bins_filled + count
+        if dest != self._bins_filled:
+            # an earlier step had fewer bins than planned, close the gap
+            # so the sweep is contiguous as when collected serially
+            self.bins[self._bins_filled:end] = self.bins[dest:dest + count]
+        self._bins_filled = end
+        self.fft_calculation_seconds += fft_seconds
+        self.bin_collection_seconds += collection_seconds
+        self._partial_steps_collected += 1
 
-        self._ss_received = 0
-        self._ss_index += 1
-        if self._ss_index < len(self.plan):
-            return
+        if (self.partial_callback
+                and self._partial_steps_collected >= self.partial_steps):
+            self._deliver_partial()
+
+    def _pipelined_sweep(self):
+        """
+        Read packets in this thread while FFTs are computed by a pool
+        of worker threads.  Steps are accounted for in sweep order.
+        """
+        if self._pool is None:
+            self._pool = ThreadPool(self.pipeline_workers)
+        depth = self.pipeline_depth or 2 * self.pipeline_workers
+        pending = deque()
+
+        while self._ss_index < len(self.plan):
+            packet = self.real_device.read()
+            if packet.is_context_packet() and 'reconnect_gap' in packet.fields:
+                # bins still being computed belong to the lost sweep
+                while pending:
+                    pending.popleft().wait()
+            step = self._vrt_step(packet)
+            if step is None:
+                continue
+            # the context dict is updated by later packets
+            context, dest, start, take = step
+            pending.append(self._pool.apply_async(self._collect_bins,
+                (packet, dict(context), dest, start, take)))
+            while pending and (len(pending) >= depth or pending[0].ready()):
+                self._step_collected(*pending.popleft().get())
+
+        while pending:
+            self._step_collected(*pending.popleft().get())
+        return self._finish_sweep()
+
+    def close(self):
+        """
+        Stop the threads used to compute FFTs for pipeline_workers
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def _finish_sweep(self):
+        if self.partial_callback:
+            self._deliver_partial()
 
         # done the complete sweep
         # XXX: in case sweep_iterations() does not work
@@ -264,20 +639,211 @@ class SweepDevice(object):
             self.real_device.abort()
             self.real_device.flush()
 
-        self.bins = np.concatenate(self.bin_arrays)
+        bins = self.bins[:self._bins_filled]
         if self.async_callback:
             self.real_device.vrt_callback = None
-            self.async_callback(self.fstart, self.fstop, self.bins)
+            self.async_callback(self.fstart, self.fstop, bins)
             if self.continuous:
                 self._ss_index = 0
                 self._ss_received = 0
-                self.bins = []
+                self._new_sweep_buffer()
+            return
+        return (self.fstart, self.fstop, bins)
+
+    def _new_sweep_buffer(self):
+        """
+        Allocate the array that bins are collected into for the next
+        sweep.  A new array is used for every sweep so that results
+        already passed to callbacks are never modified.
+        """
+        self.bins = np.empty(sum(ss.bins_keep for ss in self.plan))
+        self.bins.fill(np.nan)
+        self._bins_filled = 0
+        self._bins_dispatched = 0
+        self._partial_offset = 0
+        self._partial_steps_collected = 0
+
+    def _deliver_partial(self):
+        offset = self._partial_offset
+        end = self._bins_filled
+        self._partial_steps_collected = 0
+        if end <= offset:
+            return
+        self._partial_offset = end
+        # one call for each region, so that no part spans a gap
+        for rstart, bin_size, first, last in self._bin_regions:
+            start = max(offset, first)
+            stop = min(end, last)
+            if start < stop:
+                self.partial_callback(
+                    rstart + (start - first) * bin_size,
+                    rstart + (stop - first) * bin_size,
+                    self.bins[start:stop],
+                    start)
+
+
+
+class MultiSweepDevice(object):
+    """
+    Virtual device that sweeps a range of frequencies with a number of
+    real devices at the same time and merges their results.
+
+    The sweep is planned once and its capture steps are divided into
+    contiguous parts, one for each device, so the merged result is
+    the same as a sweep by a single device.  All real devices must be
+    the same model.
+
+    :param real_devices: list of devices that will be used for capturing
+                         data, typically :class:`pyrf.devices.thinkrf.WSA`
+                         instances
+    :param async_callback: callback to use for async operation (not used
+                           if real_devices are using a
+                           :class:`PlainSocketConnector`)
+    """
+    def __init__(self, real_devices, async_callback=None):
+        if not real_devices:
+            raise SweepDeviceError("at least one real device required")
+        prop_types = set(type(d.properties) for d in real_devices)
+        if len(prop_types) != 1:
+            raise SweepDeviceError("all real devices must be the same model")
+
+        self.real_devices = list(real_devices)
+        self.async_callback = async_callback
+        self.sweep_devices = []
+        for i, dev in enumerate(self.real_devices):
+            callback = None
+            if async_callback:
+                callback = self._make_part_callback(i)
+            self.sweep_devices.append(SweepDevice(dev, callback))
+        self._parts = []
+
+    def _make_part_callback(self, i):
+        def part_received(fstart, fstop, bins):
+            self._part_received(i, bins)
+        return part_received
+
+    def capture_power_spectrum(self,
+            fstart, fstop, rbw,
+            device_settings=None,
+            mode='ZIF',
+            continuous=False,
+            min_points=32):
+        """
+        Initiate a capture of power spectral density across all
+        real devices.  Parameters are the same as
+        :meth:`SweepDevice.capture_power_spectrum`
+        """
+        if continuous and not self.async_callback:
+            raise SweepDeviceError(
+                "continuous mode only applies to async operation")
+
+        self.fstart, self.fstop, plan = plan_sweep(self.real_devices[0],
+            fstart, fstop, rbw, mode, min_points)
+        self._parts = [p for p in split_sweep_plan(self.fstart,
+            self.fstop, plan, len(self.sweep_devices)) if p[2]]
+        self._results = [None] * len(self._parts)
+        self._fresh = set()
+
+        if not self._parts:
+            if self.async_callback:
+                self.async_callback(self.fstart, self.fstop, [])
+                return
+            return (self.fstart, self.fstop, [])
+
+        def capture_part(i):
+            pfstart, pfstop, pplan = self._parts[i]
+            return self.sweep_devices[i]._capture_plan(pfstart, pfstop,
+                pplan, device_settings, mode, continuous)
+
+        if self.async_callback:
+            for i in range(len(self._parts)):
+                capture_part(i)
+            return
+
+        errors = []
+        def run_part(i):
+            try:
+                self._results[i] = capture_part(i)[2]
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run_part, args=(i,))
+            for i in range(len(self._parts))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+        return (self.fstart, self.fstop, self._merge())
+
+    @property
+    def sweep_segments(self):
+        segments = []
+        for sd in self.sweep_devices[:len(self._parts)]:
+            segments.extend(sd.sweep_segments)
+        return segments
+
+    def _part_received(self, i, bins):
+        if i >= len(self._parts):
             return
-        return (self.fstart, self.fstop, self.bins)
+        self._results[i] = bins
+        self._fresh.add(i)
+        if len(self._fresh) < len(self._parts):
+            return
+        self._fresh = set()
+        self.async_callback(self.fstart, self.fstop, self._merge())
+
+    def _merge(self):
+        return np.concatenate(self._results)
+
 
+def split_sweep_plan(fstart, fstop, plan, parts):
+    """
+    Divide the capture steps of a sweep plan into contiguous parts
+    with nearly equal numbers of steps.
+
+    :param fstart: actual fstart returned by :func:`plan_sweep`
+    :param fstop: actual fstop returned by :func:`plan_sweep`
+    :param plan: list of :class:`SweepStep` instances
+    :param parts: number of parts
+    :type parts: int
+
+    :returns: list of (fstart, fstop, list of SweepStep instances),
+              one for each part, some may be empty when there are
+              fewer steps than parts.  Concatenating the bins from
+              each part gives the bins of the complete plan.
+    """
+    total_bins = sum(ss.bins_keep for ss in plan)
+    if not total_bins:
+        return [(fstart, fstart, [])] * parts
+    bin_size = float(fstop - fstart) / total_bins
+
+    steps = [(ss, j) for ss in plan for j in range(int(ss.steps))]
+    out = []
+    offset = 0
+    for k in range(parts):
+        mine = steps[len(steps) * k // parts:len(steps) * (k + 1) // parts]
+        part_plan = []
+        part_start = offset
+        while mine:
+            ss, a = mine[0]
+            b = a
+            while mine and mine[0][0] is ss:
+                b = mine.pop(0)[1] + 1
+            lo = max(0, a * ss.bins_run - ss.bins_pass)
+            hi = min(ss.bins_keep, b * ss.bins_run - ss.bins_pass)
+            part_plan.append(ss._replace(
+                fcenter=ss.fcenter + a * ss.fstep,
+                bins_pass=ss.bins_pass if a == 0 else 0,
+                bins_keep=hi - lo))
+            offset += hi - lo
+        out.append((fstart + part_start * bin_size,
+            fstart + offset * bin_size, part_plan))
+    return out
 
 
-def plan_sweep(device, fstart, fstop, rbw, mode, min_points=32):
+def plan_sweep(device, fstart, fstop, rbw, mode, min_points=32,
+        decimation=1):
     """
     :param device: a device class or instance such as
                    :class:`pyrf.devices.thinkrf.WSA`
@@ -291,6 +857,9 @@ def plan_sweep(device, fstart, fstop, rbw, mode, min_points=32):
     :type mode: string
     :param min_points: smallest number of points per capture
     :type min_points: int
+    :param decimation: decimation value, 1 for no decimation
+                       ('ZIF' and 'ZIF left band' modes only)
+    :type decimation: int
 
     The following device properties are used in planning the sweep:
 
@@ -308,6 +877,8 @@ def plan_sweep(device, fstart, fstop, rbw, mode, min_points=32):
       a DC offset and should not be used
     device.properties.TUNING_RESOLUTION
       the smallest tuning increment for fcenter and fstep
+    device.properties.DECIMATED_USABLE
+      the usable fraction of the filter width when decimation is used
 
     :returns: (actual fstart, actual fstop, list of SweepStep instances)
 
@@ -331,6 +902,10 @@ def plan_sweep(device, fstart, fstop, rbw, mode, min_points=32):
     usable2 = prop.USABLE_BW[rfe_mode] / 2.0
     dc_offset2 = prop.DC_OFFSET_BW / 2.0
     full_bw = prop.FULL_BW[rfe_mode]
+    if decimation > 1:
+        assert rfe_mode == 'ZIF', 'decimation only supported in ZIF modes'
+        full_bw = float(full_bw) / decimation
+        usable2 = full_bw * prop.DECIMATED_USABLE / 2.0
 
     fstart = max(prop.MIN_TUNABLE[rfe_mode] - usable2, fstart)
     fstop = min(prop.MAX_TUNABLE[rfe_mode] + (
@@ -342,8 +917,7 @@ def plan_sweep(device, fstart, fstop, rbw, mode, min_points=32):
     points = full_bw / rbw
     points = int(max(min_points, 2 ** math.ceil(math.log(points, 2))))
 
-    decimation = 1
-    bin_size = float(full_bw) / decimation / points
+    bin_size = float(full_bw) / points
 
     left_edge = full_bw / 2.0 - usable2
     left_bin = math.ceil(left_edge / bin_size)
@@ -418,3 +992,97 @@ def plan_sweep(device, fstart, fstop, rbw, mode, min_points=32):
     return (fstart, fstop, out)
 
 
+def plan_sweep_timed(device, fstart, fstop, rbw, timing=None,
+        modes=('ZIF', 'SH'), min_points=32, dwell=0):
+    """
+    Choose the sweep mode and decimation that give the shortest
+    predicted sweep time for the RBW and range requested.
+
+    :param device: a device class or instance such as
+                   :class:`pyrf.devices.thinkrf.WSA`
+    :param fstart: starting frequency in Hz
+    :type fstart: float
+    :param fstop: ending frequency in Hz
+    :type fstop: float
+    :param rbw: requested RBW in Hz (output RBW may be smaller than requested)
+    :type rbw: float
+    :param timing: :class:`pyrf.sweep_timing.SweepTimingModel` for device,
+                   or None to use default values
+    :param modes: sweep modes to consider
+    :param min_points: smallest number of points per capture
+    :type min_points: int
+    :param dwell: dwell time in seconds for each step
+    :type dwell: float
+
+    :returns: :class:`TimedSweepPlan`
+
+    Plans covering less of the range requested than others (by more than
+    one RBW) are never chosen.  Points per capture are always the smallest
+    that satisfy *rbw*, because larger captures only add transfer time.
+    """
+    if timing is None:
+        timing = SweepTimingModel()
+    prop = device.properties
+    candidates = []
+    for mode in modes:
+        rfe_mode = 'SH' if mode == 'SH' else 'ZIF'
+        if rfe_mode not in prop.RFE_MODES:
+            continue
+        decimations = [1]
+        if rfe_mode == 'ZIF' and prop.MIN_DECIMATION.get(rfe_mode):
+            d = prop.MIN_DECIMATION[rfe_mode]
+            while d <= prop.MAX_DECIMATION[rfe_mode]:
+                decimations.append(d)
+                d *= 2
+
+        for decimation in decimations:
+            pfstart, pfstop, plan = plan_sweep(device, fstart, fstop, rbw,
+                mode, min_points, decimation)
+            if not plan or max(ss.points for ss in plan) > MAX_SWEEP_POINTS:
+                continue
+            duration = timing.sweep_time(device, rfe_mode, plan, dwell)
+            coverage = min(pfstop, fstop) - max(pfstart, fstart)
+            candidates.append((coverage,
+                TimedSweepPlan(pfstart, pfstop, plan, mode, duration)))
+
+    if not candidates:
+        return TimedSweepPlan(fstart, fstart, [], modes[0], 0.0)
+    max_coverage = max(c for c, timed in candidates)
+    return min((timed for c, timed in candidates
+        if c >= max_coverage - rbw), key=lambda timed: timed.duration)
+
+
+def find_occupied_regions(fstart, fstop, bins, threshold, guard=0):
+    """
+    Find the frequency ranges of a spectrum with power above a threshold
+
+    :param fstart: frequency of the first bin in Hz
+    :type fstart: float
+    :param fstop: frequency at the end of the last bin in Hz
+    :type fstop: float
+    :param bins: power levels in dBm
+    :param threshold: level in dBm above which a bin is occupied
+    :type threshold: float
+    :param guard: frequency in Hz added to each side of a region,
+                  regions that then overlap are merged
+    :type guard: float
+
+    :returns: list of (fstart, fstop) tuples in increasing order
+    """
+    bins = np.asarray(bins)
+    if not len(bins):
+        return []
+    bin_size = float(fstop - fstart) / len(bins)
+
+    above = np.concatenate(([False], bins > threshold, [False]))
+    edges = np.flatnonzero(above[1:] != above[:-1])
+
+    regions = []
+    for start, stop in zip(edges[::2], edges[1::2]):
+        rstart = max(fstart, fstart + start * bin_size - guard)
+        rstop = min(fstop, fstart + stop * bin_size + guard)
+        if regions and rstart <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], max(rstop, regions[-1][1]))
+        else:
+            regions.append((rstart, rstop))
+    return regions
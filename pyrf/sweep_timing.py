@@ -0,0 +1,316 @@
+import os
+import json
+import time
+import random
+import logging
+
+from pyrf.vrt import I_ONLY
+from pyrf.config import SweepEntry
+from pyrf.units import M
+
+logger = logging.getLogger(__name__)
+
+# SCPI commands sent to set up a sweep in addition to those
+# sent for each sweep entry
+SWEEP_SETUP_COMMANDS = 6
+SWEEP_ENTRY_COMMANDS = 15
+
+TIMING_MODEL_DIR = os.path.join(os.path.expanduser('~'), '.pyrf', 'timing')
+
+# report a calibration this much slower than the saved one
+DEGRADED_RATIO = 1.5
+
+
+class SweepTimingModel(object):
+    """
+    Estimate of the time a device takes to perform sweeps and captures,
+    used for choosing the fastest sweep plan with
+    :func:`pyrf.sweep_device.plan_sweep_timed`.
+
+    :param step_overhead: fixed seconds for each capture step, including
+                          tuning, settling and packet overhead
+    :param byte_time: seconds to transfer each byte of sample data,
+                      the inverse of the usable link throughput
+    :param scpi_latency: seconds for each SCPI query round trip
+    :param command_time: seconds to send each SCPI command
+    """
+    def __init__(self,
+            step_overhead=0.001,
+            byte_time=1.0 / 80e6,
+            scpi_latency=0.001,
+            command_time=0.0001):
+        self.step_overhead = step_overhead
+        self.byte_time = byte_time
+        self.scpi_latency = scpi_latency
+        self.command_time = command_time
+
+    def step_time(self, device, rfe_mode, points, decimation=1, dwell=0):
+        """
+        Return the predicted seconds for a single capture step
+
+        :param device: a device class or instance such as
+                       :class:`pyrf.devices.thinkrf.WSA`
+        :param rfe_mode: radio front end mode, e.g. 'ZIF' or 'SH'
+        :param points: samples captured
+        :param decimation: decimation value
+        :param dwell: dwell time in seconds
+        """
+        return (self.step_overhead + dwell
+            + acquisition_time(device, rfe_mode, points, decimation)
+            + points * sample_bytes(device, rfe_mode) * self.byte_time)
+
+    def sweep_time(self, device, rfe_mode, plan, dwell=0):
+        """
+        Return the predicted seconds to set up and perform a sweep
+
+        :param device: a device class or instance such as
+                       :class:`pyrf.devices.thinkrf.WSA`
+        :param rfe_mode: radio front end mode, e.g. 'ZIF' or 'SH'
+        :param plan: list of :class:`pyrf.sweep_device.SweepStep` instances
+        :param dwell: dwell time in seconds for each step
+        """
+        if not plan:
+            return 0.0
+        total = self.scpi_latency + self.command_time * (
+            SWEEP_SETUP_COMMANDS + SWEEP_ENTRY_COMMANDS * len(plan))
+        for ss in plan:
+            total += ss.steps * self.step_time(device, rfe_mode,
+                ss.points, ss.decimation, dwell)
+        return total
+
+    def to_json_object(self):
+        """
+        Return this model as a dict that may be serialized as JSON
+        """
+        return {
+            'step_overhead': self.step_overhead,
+            'byte_time': self.byte_time,
+            'scpi_latency': self.scpi_latency,
+            'command_time': self.command_time,
+            }
+
+    @classmethod
+    def from_json_object(cls, j):
+        """
+        Create a model from a dict returned by :meth:`to_json_object`
+        """
+        return cls(**dict((k, j[k]) for k in cls().to_json_object() if k in j))
+
+    def __repr__(self):
+        return ('SweepTimingModel(step_overhead=%r, byte_time=%r, '
+            'scpi_latency=%r, command_time=%r)' % (self.step_overhead,
+            self.byte_time, self.scpi_latency, self.command_time))
+
+
+def sample_bytes(device, rfe_mode):
+    """
+    Return the number of bytes transferred for each sample in rfe_mode
+    """
+    if device.properties.DEFAULT_SAMPLE_TYPE.get(rfe_mode) == I_ONLY:
+        return 2
+    return 4
+
+
+def acquisition_time(device, rfe_mode, points, decimation=1):
+    """
+    Return the seconds the device takes to digitize a capture
+    """
+    prop = device.properties
+    sample_rate = float(prop.FULL_BW[rfe_mode])
+    if prop.DEFAULT_SAMPLE_TYPE.get(rfe_mode) == I_ONLY:
+        sample_rate *= 2
+    return points * decimation / sample_rate
+
+
+def device_serial(device_id):
+    """
+    Return the serial number from a device identification string
+    such as the one returned by :meth:`pyrf.devices.thinkrf.WSA.id`,
+    or None if it does not include one
+    """
+    fields = device_id.split(',')
+    if len(fields) < 3 or not fields[2].strip():
+        return None
+    return fields[2].strip()
+
+
+def _model_filename(serial, directory):
+    if directory is None:
+        directory = TIMING_MODEL_DIR
+    return os.path.join(directory, '%s.json' % serial)
+
+
+def save_timing_model(serial, model, directory=None):
+    """
+    Save a timing model for the device with serial number *serial*
+
+    :param serial: device serial number
+    :param model: :class:`SweepTimingModel` to save
+    :param directory: directory to save to, defaults to TIMING_MODEL_DIR
+    """
+    filename = _model_filename(serial, directory)
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    j = dict(model.to_json_object(), serial=serial, calibrated=time.time())
+    with open(filename, 'w') as f:
+        json.dump(j, f, indent=1, sort_keys=True)
+
+
+def load_timing_model(serial, directory=None):
+    """
+    Load the timing model saved for the device with serial number
+    *serial*
+
+    :param serial: device serial number
+    :param directory: directory to load from, defaults to TIMING_MODEL_DIR
+    :returns: :class:`SweepTimingModel` or None if no model was saved
+    """
+    filename = _model_filename(serial, directory)
+    try:
+        with open(filename) as f:
+            return SweepTimingModel.from_json_object(json.load(f))
+    except (IOError, OSError, ValueError, TypeError) as e:
+        if os.path.exists(filename):
+            logger.warning('unable to load timing model %r: %s', filename, e)
+        return None
+
+
+def calibrate_timing(dut,
+        spp_values=(256, 1024, 4096, 16384),
+        step_counts=(1, 8, 32),
+        rfe_modes=('ZIF', 'SH'),
+        fstart=2000 * M,
+        fstep=10 * M,
+        queries=20,
+        save=True,
+        directory=None):
+    """
+    Measure the timing of a connected device and fit a
+    :class:`SweepTimingModel` to the results.
+
+    A series of sweeps and block captures is run with each combination
+    of spp, number of steps and mode.  Per-step overhead and per-byte
+    transfer time are fitted to the measured times by least squares
+    after subtracting the known acquisition time.  SCPI round-trip
+    latency and command time are measured with repeated queries.
+
+    Only blocking connectors are supported.
+
+    :param dut: a connected :class:`pyrf.devices.thinkrf.WSA`
+    :param spp_values: samples per packet to measure
+    :param step_counts: numbers of sweep steps to measure
+    :param rfe_modes: modes to measure, unsupported modes are skipped
+    :param fstart: first sweep step center frequency in Hz
+    :param fstep: sweep step size in Hz
+    :param queries: number of SCPI queries used to measure latency
+    :param save: save the result for this device's serial number and
+                 warn if it is much slower than the result saved before
+    :param directory: directory to save to, defaults to TIMING_MODEL_DIR
+    :returns: :class:`SweepTimingModel`
+    """
+    import numpy as np # import here so docstrings are visible even without numpy
+
+    if dut.async_connector():
+        raise ValueError('timing calibration requires a blocking connector')
+
+    scpi_latency = _time_queries(dut, queries) / queries
+    command_time = max(0.0, (_time_commands(dut, queries)
+        - scpi_latency) / queries)
+
+    dut.reset()
+    dut.request_read_perm()
+    rows = []
+    times = []
+    for rfe_mode in rfe_modes:
+        if rfe_mode not in dut.properties.RFE_MODES:
+            continue
+        dut.rfe_mode(rfe_mode)
+        for spp in spp_values:
+            nbytes = spp * sample_bytes(dut, rfe_mode)
+            acquire = acquisition_time(dut, rfe_mode, spp)
+            for steps in step_counts:
+                elapsed = _time_sweep(dut, rfe_mode, spp, steps,
+                    fstart, fstep)
+                rows.append((steps, steps * nbytes, 1))
+                times.append(elapsed - steps * acquire)
+            elapsed = _time_capture(dut, spp)
+            rows.append((1, nbytes, 1))
+            times.append(elapsed - acquire)
+
+    (step_overhead, byte_time, _setup), _, _, _ = np.linalg.lstsq(
+        np.array(rows, dtype=float), np.array(times), rcond=None)
+    model = SweepTimingModel(
+        step_overhead=max(0.0, step_overhead),
+        byte_time=max(0.0, byte_time),
+        scpi_latency=scpi_latency,
+        command_time=command_time)
+    logger.info('calibrated %s: %r', dut.device_id, model)
+
+    serial = device_serial(dut.device_id)
+    if save and serial is None:
+        logger.warning('no serial number in %r, timing model not saved',
+            dut.device_id)
+    elif save:
+        old = load_timing_model(serial, directory)
+        if old:
+            for name in ('step_overhead', 'byte_time', 'scpi_latency'):
+                if getattr(model, name) > DEGRADED_RATIO * getattr(old, name):
+                    logger.warning('%s %s degraded from %g to %g', serial,
+                        name, getattr(old, name), getattr(model, name))
+        save_timing_model(serial, model, directory)
+    dut.timing_model = model
+    return model
+
+
+def _time_queries(dut, count):
+    start = time.time()
+    for i in range(count):
+        dut.id()
+    return time.time() - start
+
+
+def _time_commands(dut, count):
+    start = time.time()
+    for i in range(count):
+        dut.scpiset(':SYSTEM:FLUSH')
+    dut.id()
+    return time.time() - start
+
+
+def _time_sweep(dut, rfe_mode, spp, steps, fstart, fstep):
+    dut.abort()
+    dut.flush()
+    dut.sweep_clear()
+    dut.sweep_add(SweepEntry(
+        fstart=fstart,
+        fstop=fstart + (steps - 0.5) * fstep,
+        fstep=fstep,
+        spp=spp,
+        ppb=1,
+        rfe_mode=rfe_mode))
+    sweep_id = random.randrange(1, 2**32 - 1)
+    dut.sweep_iterations(1)
+    start = time.time()
+    dut.sweep_start(sweep_id)
+    current_id = None
+    received = 0
+    while received < steps:
+        pkt = dut.read()
+        if pkt.is_context_packet():
+            current_id = pkt.fields.get('sweepid', current_id)
+        elif current_id == sweep_id:
+            received += 1
+    elapsed = time.time() - start
+    dut.abort()
+    dut.flush()
+    return elapsed
+
+
+def _time_capture(dut, spp):
+    dut.abort()
+    dut.flush()
+    start = time.time()
+    dut.capture(spp, 1)
+    while not dut.read().is_data_packet():
+        pass
+    return time.time() - start
@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from pyrf.accumulator import (SpectrumAccumulator, SpectrumAccumulatorError,
+    MAX_HOLD, MIN_HOLD, AVERAGE, EXPONENTIAL_AVERAGE, COUNT_AVERAGE)
+
+
+class TestSpectrumAccumulator(unittest.TestCase):
+    def _update(self, acc, *spectra):
+        for s in spectra:
+            result = acc.update(100, 200, s)
+        return list(np.round(result, 6))
+
+    def test_max_hold(self):
+        acc = SpectrumAccumulator(MAX_HOLD)
+        self.assertEqual(self._update(acc, [-10, -20], [-30, -5]),
+            [-10, -5])
+
+    def test_min_hold_ignores_nan(self):
+        acc = SpectrumAccumulator(MIN_HOLD)
+        self.assertEqual(self._update(acc,
+            [-10, -20], [np.nan, -25]), [-10, -25])
+
+    def test_average_is_linear(self):
+        acc = SpectrumAccumulator(AVERAGE)
+        # mean of 1mW and 3mW is 2mW
+        self.assertEqual(self._update(acc,
+            [0], [10 * np.log10(3)]), [round(10 * np.log10(2), 6)])
+
+    def test_exponential_average(self):
+        acc = SpectrumAccumulator(EXPONENTIAL_AVERAGE, alpha=0.5)
+        self.assertEqual(self._update(acc,
+            [0], [10 * np.log10(3)]), [round(10 * np.log10(2), 6)])
+
+    def test_count_average_forgets(self):
+        acc = SpectrumAccumulator(COUNT_AVERAGE, count=2)
+        self.assertEqual(self._update(acc, [30], [0], [0]), [0])
+        self.assertEqual(acc.spectra, 2)
+
+    def test_reset_on_plan_change(self):
+        acc = SpectrumAccumulator(MAX_HOLD)
+        acc.update(100, 200, [0, 0])
+        result = acc.update(100, 300, [-10, -10])
+        self.assertEqual(list(result), [-10, -10])
+        self.assertEqual(acc.spectra, 1)
+
+    def test_invalid_mode(self):
+        self.assertRaises(SpectrumAccumulatorError,
+            SpectrumAccumulator, 'median')
+
+    def test_averages_skip_nan(self):
+        for mode in (AVERAGE, EXPONENTIAL_AVERAGE, COUNT_AVERAGE):
+            acc = SpectrumAccumulator(mode, count=2, alpha=0.5)
+            self.assertEqual(self._update(acc,
+                [np.nan, 0], [0, 0], [0, np.nan], [0, 0]), [0, 0])
+
+    def test_count_average_bin_never_valid(self):
+        acc = SpectrumAccumulator(COUNT_AVERAGE, count=2)
+        result = acc.update(100, 200, [np.nan, 0])
+        self.assertTrue(np.isnan(result[0]))
+        self.assertEqual(result[1], 0)
@@ -0,0 +1,125 @@
+import unittest
+from collections import deque
+
+from pyrf.capture_device import CaptureDevice
+from pyrf.units import M
+from pyrf.vrt import IQ
+
+
+class FakeCapture(object):
+    """
+    Data packet recording the settings it was captured with
+    """
+    spec_inv = False
+
+    def __init__(self, points, settings):
+        self.data = [0] * points
+        self.freq = settings['freq']
+        self.decimation = settings.get('decimation', 1)
+
+    def is_context_packet(self):
+        return False
+
+
+class FakeContext(object):
+    def __init__(self, fields):
+        self.fields = fields
+
+    def is_context_packet(self):
+        return True
+
+
+class FakeCaptureWSA(object):
+    """
+    Queues a capture with the current settings for each capture
+    request.  When drop is set the next read loses the captures
+    queued and returns a reconnect gap packet instead.
+    """
+    class properties(object):
+        FULL_BW = {'ZIF': 128 * M}
+        USABLE_BW = {'ZIF': 100 * M}
+        PASS_BAND_CENTER = {'ZIF': 0.5}
+        DC_OFFSET_BW = 2 * M
+        DEFAULT_SAMPLE_TYPE = {'ZIF': IQ}
+
+    def __init__(self):
+        self.settings = {}
+        self.queue = deque()
+        self.captures = 0
+        self.points = []
+        self.drop = False
+
+    def async_connector(self):
+        return False
+
+    def apply_device_settings(self, settings):
+        self.settings.update(settings)
+
+    def capture(self, points, ppb):
+        self.captures += 1
+        self.points.append(points)
+        self.queue.append(FakeCapture(points, self.settings))
+
+    def flush(self):
+        self.queue.clear()
+
+    def read(self):
+        if self.drop:
+            self.drop = False
+            self.queue.clear()
+            return FakeContext({'reconnect_gap': 0.5})
+        return self.queue.popleft()
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+class TestCapturePipeline(unittest.TestCase):
+    def assertPaired(self, result):
+        fstart, fstop, data = result
+        packet = data['data_pkt']
+        self.assertEqual((fstart + fstop) / 2, packet.freq)
+        self.assertEqual(fstop - fstart, 128 * M / packet.decimation)
+
+    def test_results_use_settings_requested(self):
+        dut = FakeCaptureWSA()
+        cd = CaptureDevice(dut, pipeline_depth=3)
+        freqs = []
+        for i, decimation in enumerate([1, 4, 1, 8, 16]):
+            result = cd.capture_time_domain('ZIF', (1000 + 100 * i) * M,
+                500000, {'decimation': decimation})
+            self.assertPaired(result)
+            freqs.append(result[2]['data_pkt'].freq)
+        # data lags the requests by the captures already in flight
+        self.assertEqual(freqs, [1000 * M, 1000 * M, 1000 * M,
+            1100 * M, 1200 * M])
+        self.assertEqual(dut.captures, 7)
+        cd.stop()
+        self.assertEqual(len(dut.queue), 0)
+
+    def test_recapture_after_reconnect(self):
+        dut = FakeCaptureWSA()
+        cd = CaptureDevice(dut, pipeline_depth=2)
+        self.assertPaired(cd.capture_time_domain('ZIF', 1000 * M, 500000))
+        dut.drop = True
+        result = cd.capture_time_domain('ZIF', 1100 * M, 500000,
+            {'decimation': 4})
+        self.assertPaired(result)
+        self.assertEqual(result[2]['data_pkt'].freq, 1000 * M)
+        self.assertEqual([c.freq for c in dut.queue], [1100 * M])
+        self.assertEqual(dut.settings['freq'], 1100 * M)
+        self.assertPaired(cd.capture_time_domain('ZIF', 1100 * M, 500000,
+            {'decimation': 4}))
+
+    def test_recapture_keeps_points(self):
+        dut = FakeCaptureWSA()
+        cd = CaptureDevice(dut, pipeline_depth=2)
+        # 128 MHz / 250 kHz rounds up to 512 points
+        self.assertEqual(len(cd.capture_time_domain('ZIF', 1000 * M,
+            250000)[2]['data_pkt'].data), 512)
+        dut.drop = True
+        result = cd.capture_time_domain('ZIF', 1000 * M, 125000)
+        self.assertEqual(len(result[2]['data_pkt'].data), 512)
+        self.assertEqual(dut.points, [512, 512, 1024, 512, 1024])
+        self.assertEqual(len(cd.capture_time_domain('ZIF', 1000 * M,
+            125000)[2]['data_pkt'].data), 1024)
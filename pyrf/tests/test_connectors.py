@@ -0,0 +1,423 @@
+import io
+import socket
+import struct
+import threading
+import time
+import unittest
+
+import numpy as np
+try:
+    from twisted.internet.error import ConnectionLost
+    from twisted.python.failure import Failure
+    from twisted.test.proto_helpers import StringTransport
+except ImportError:
+    StringTransport = None
+
+from pyrf.connectors.asyncio_async import SCPIProtocol, asyncio
+from pyrf.connectors.base import VRTReceiveBuffer
+from pyrf.connectors.blocking import PlainSocketConnector
+from pyrf.connectors.playback import (PlaybackConnector,
+    _context_fields_offset)
+from pyrf.connectors.stats import ConnectorStats
+from pyrf.connectors.threaded import (ThreadedSocketConnector, BLOCK,
+    DROP_OLDEST, DROP_NEWEST)
+from pyrf.connectors.twisted_async import SCPIClient
+from pyrf.devices.thinkrf import WSA
+from pyrf.numpy_util import compute_fft
+from pyrf.simulator.device import SimulatedWSA, DEFAULT_DEVICE_ID
+from pyrf.units import M
+from pyrf.vrt import (vrt_packet_reader, parse_vrt_packet, generate_gap_packet,
+    VRTDIGITIZER, IQ)
+
+
+def data_packet(tsi, samples=512, values=None):
+    """
+    Return an I14Q14 data packet, with I and Q values taken in turn
+    from values or all zero
+    """
+    size = 1 + 4 + samples + 1
+    if values is None:
+        payload = b'\0' * (4 * samples)
+    else:
+        payload = struct.pack('>%dh' % (2 * samples), *values)
+    return (struct.pack('>IIIQ', (1 << 28) | size, 0x90000003, tsi, 0)
+        + payload + struct.pack('>I', 0))
+
+
+def reflevel_packet(reflevel):
+    return struct.pack('>IIIQIhh', (4 << 28) | (0xf << 20) | 7,
+        VRTDIGITIZER, 0, 0, 1 << 24, 0, int(reflevel * 128))
+
+
+def read_packet(connector):
+    return connector.sync_async(vrt_packet_reader(connector.raw_read))
+
+
+def ramp(samples):
+    return [i * 7 % 2000 - 1000 for i in range(2 * samples)]
+
+
+class FakeWSA(object):
+    class properties(object):
+        REFLEVEL_ERROR = 0
+        CAPTURE_FREQ_RANGES = [(0, 20000 * M, IQ)]
+
+
+class TestVRTReceiveBuffer(unittest.TestCase):
+    def test_arbitrary_chunks(self):
+        data = b''.join(data_packet(i) for i in range(5))
+        buf = VRTReceiveBuffer()
+        received = []
+        for i in range(0, len(data), 1000):
+            buf.append(data[i:i + 1000])
+            received.extend(parse_vrt_packet(p).tsi for p in buf.packets())
+        self.assertEqual(received, [0, 1, 2, 3, 4])
+        self.assertEqual(len(buf), 0)
+
+    def test_partial_packet_kept(self):
+        packet = data_packet(7)
+        buf = VRTReceiveBuffer()
+        buf.append(packet[:-1])
+        self.assertEqual(list(buf.packets()), [])
+        buf.append(packet[-1:])
+        self.assertEqual(list(buf.packets()), [packet])
+
+
+class TestGapPacket(unittest.TestCase):
+    def test_gap_packet_fields(self):
+        packet = parse_vrt_packet(generate_gap_packet(1.5))
+        self.assertTrue(packet.is_context_packet())
+        self.assertEqual(packet.fields, {'reconnect_gap': 1.5})
+
+
+class TestConnectorStats(unittest.TestCase):
+    def test_streams_and_recv_calls(self):
+        stats = ConnectorStats()
+        stats.recv_call(3000)
+        stats.packet_received(0x90000001, 40, False)
+        stats.packet_received(0x90000003, 2072, True)
+        stats.packet_received(0x90000003, 2072, True)
+        s = stats.snapshot()
+        self.assertEqual(s['packets'], 3)
+        self.assertEqual(s['bytes'], 4184)
+        self.assertEqual(s['streams'][0x90000003]['packets'], 2)
+        self.assertEqual(s['streams'][0x90000001]['bytes'], 40)
+        self.assertAlmostEqual(s['recv_calls_per_packet'], 1 / 3.0)
+
+    def test_start_latency(self):
+        stats = ConnectorStats()
+        stats.command_sent(':TRACE:SPP 1024')
+        stats.packet_received(0x90000003, 2072, True)
+        self.assertEqual(stats.starts, 0)
+        stats.command_sent(':sweep:list:start 5')
+        stats.packet_received(0x90000001, 40, False)
+        self.assertEqual(stats.starts, 0)
+        stats.packet_received(0x90000003, 2072, True)
+        self.assertEqual(stats.starts, 1)
+        self.assertTrue(stats.start_latency_last >= 0)
+
+    def test_scpi_latency_histogram(self):
+        stats = ConnectorStats()
+        stats.scpi_round_trip(0.00005)
+        stats.scpi_round_trip(0.003)
+        stats.scpi_round_trip(5)
+        histogram = dict(stats.snapshot()['scpi_latency_histogram'])
+        self.assertEqual(histogram[0.0001], 1)
+        self.assertEqual(histogram[0.005], 1)
+        self.assertEqual(histogram[None], 1)
+        self.assertEqual(stats.scpi_latency_max, 5)
+
+
+class TestPlainSocketRead(unittest.TestCase):
+    def setUp(self):
+        self.connector = PlainSocketConnector()
+        self.connector._sock_vrt, self.device = socket.socketpair()
+
+    def tearDown(self):
+        self.connector._sock_vrt.close()
+        self.device.close()
+
+    def test_read_timeout(self):
+        self.assertFalse(self.connector.has_data())
+        self.assertEqual(self.connector.read_packet(timeout=0.01), None)
+        packet = data_packet(7)
+        self.device.sendall(packet[:100])
+        self.assertFalse(self.connector.has_data())
+        self.assertEqual(self.connector.read_packet(timeout=0.01), None)
+        self.device.sendall(packet[100:])
+        self.assertTrue(self.connector.has_data())
+        self.assertEqual(self.connector.read_packet(timeout=0.01).tsi, 7)
+
+    def test_read_many(self):
+        self.device.sendall(b''.join(data_packet(i) for i in range(5)))
+        packets = self.connector.read_many(3, timeout=0.01)
+        self.assertEqual([p.tsi for p in packets], [0, 1, 2])
+        packets = self.connector.read_many(10, timeout=0.01)
+        self.assertEqual([p.tsi for p in packets], [3, 4])
+        self.assertEqual(self.connector.read_many(10, timeout=0.01), [])
+
+    def test_eof(self):
+        self.device.sendall(data_packet(1))
+        self.device.close()
+        self.assertFalse(self.connector.eof())
+        self.assertEqual(self.connector.read_packet(timeout=0.01).tsi, 1)
+        self.assertEqual(self.connector.read_packet(timeout=0.01), False)
+        self.assertTrue(self.connector.eof())
+
+    def test_large_packet_fft(self):
+        values = ramp(512)
+        self.device.sendall(data_packet(1, values=values))
+        packet = read_packet(self.connector)
+        self.assertEqual(packet.data.numpy_array().ravel().tolist(), values)
+        pow_data = compute_fft(FakeWSA, packet, {'reflevel': 0})
+        self.assertEqual(len(pow_data), 512)
+        self.assertTrue(np.isfinite(pow_data).all())
+
+    def test_buffer_reused(self):
+        self.connector.read_chunk_size = 8192
+        self.device.sendall(data_packet(0, values=ramp(512)))
+        held = read_packet(self.connector)
+        buffers = []
+        for i in range(1, 20):
+            self.device.sendall(data_packet(i))
+            self.assertEqual(read_packet(self.connector).tsi, i)
+            if not any(b is self.connector._vrt_buf for b in buffers):
+                buffers.append(self.connector._vrt_buf)
+        # the first buffer is kept while held refers to it, then a
+        # second one is reused for the rest
+        self.assertEqual(len(buffers), 2)
+        self.assertEqual(held.data.numpy_array().ravel().tolist(), ramp(512))
+
+
+class TestThreadedQueue(unittest.TestCase):
+    def _connect(self, **kwargs):
+        self.connector = ThreadedSocketConnector(max_packets=2, **kwargs)
+        self.connector._sock_scpi, self.scpi = socket.socketpair()
+        self.connector._sock_vrt, self.device = socket.socketpair()
+        # start the reader as connect() would, on the socket pair
+        self.connector._reader = threading.Thread(
+            target=self.connector._read_loop)
+        self.connector._reader.daemon = True
+        self.connector._reader.start()
+
+    def tearDown(self):
+        self.connector.disconnect()
+        self.scpi.close()
+        self.device.close()
+
+    def _send(self, packets):
+        self.device.sendall(b''.join(packets))
+        deadline = time.time() + 5
+        while self.connector.packets_received < len(packets):
+            self.assertTrue(time.time() < deadline)
+            time.sleep(0.001)
+
+    def _read_queued(self):
+        packets = []
+        while self.connector.has_data():
+            packet = read_packet(self.connector)
+            packets.append(packet.fields if packet.is_context_packet()
+                else packet.tsi)
+        return packets
+
+    def test_drop_oldest(self):
+        self._connect(policy=DROP_OLDEST)
+        self._send([data_packet(0), reflevel_packet(-10)]
+            + [data_packet(i) for i in range(1, 5)])
+        self.assertEqual(self._read_queued(), [{'reflevel': -10.0}, 3, 4])
+        self.assertEqual(self.connector.dropped_packets, 3)
+        self.assertEqual(self.connector.dropped_bytes,
+            3 * len(data_packet(0)))
+
+    def test_drop_newest(self):
+        self._connect(policy=DROP_NEWEST)
+        self._send([data_packet(i) for i in range(5)])
+        self.assertEqual(self._read_queued(), [0, 1])
+        self.assertEqual(self.connector.dropped_packets, 3)
+
+    def test_block(self):
+        self._connect(policy=BLOCK)
+        self.device.sendall(b''.join(data_packet(i) for i in range(5)))
+        tsis = [read_packet(self.connector).tsi for i in range(5)]
+        self.assertEqual(tsis, [0, 1, 2, 3, 4])
+        self.assertEqual(self.connector.dropped_packets, 0)
+
+    def test_discard_queued(self):
+        self._connect()
+        self._send([data_packet(0), data_packet(1)])
+        self.assertEqual(self.connector.queued_packets(), 2)
+        self.connector.discard_queued()
+        self.assertEqual(self.connector.queued_packets(), 0)
+        self.assertFalse(self.connector.has_data())
+        self.assertEqual(self.connector.read_packet(timeout=0.01), None)
+        self.device.sendall(data_packet(2))
+        self.assertEqual(read_packet(self.connector).tsi, 2)
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+    def get_extra_info(self, name):
+        return None
+
+
+@unittest.skipIf(asyncio is None, 'asyncio is not available')
+class TestAsyncioSCPI(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.transport = FakeTransport()
+        self.protocol = SCPIProtocol(self.loop)
+        self.protocol.connection_made(self.transport)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_unsolicited_reply_dropped(self):
+        one = self.protocol.scpiget(':one?')
+        self.protocol.data_received(b'echo :one?\nnotice\n')
+        two = self.protocol.scpiget(':two?')
+        self.protocol.data_received(b'echo :two?\n')
+        self.assertEqual(one.result(), 'echo :one?\n')
+        self.assertEqual(two.result(), 'echo :two?\n')
+        self.assertEqual(self.transport.written, [b':one?', b':two?'])
+
+
+class TCPStringTransport(StringTransport or object):
+    def setTcpNoDelay(self, enabled):
+        pass
+
+
+@unittest.skipIf(StringTransport is None, 'twisted is not available')
+class TestTwistedSCPI(unittest.TestCase):
+    def setUp(self):
+        self.transport = TCPStringTransport()
+        self.client = SCPIClient()
+        self.client.makeConnection(self.transport)
+
+    def test_unsolicited_reply_dropped(self):
+        replies = []
+        self.client.dataReceived(b'notice\n')
+        self.client.scpiget(':one?\n').addCallback(replies.append)
+        self.assertEqual(self.transport.value(), b':one?\n')
+        self.client.dataReceived(b'echo :one?\nnotice\n')
+        self.client.scpiget(':two?\n').addCallback(replies.append)
+        self.client.dataReceived(b'echo :two?\n')
+        self.assertEqual(replies, ['echo :one?\n', 'echo :two?\n'])
+
+    def test_connection_lost_fails_queries(self):
+        failures = []
+        for cmd in [':one?\n', ':two?\n']:
+            self.client.scpiget(cmd).addErrback(failures.append)
+        self.client.connectionLost(Failure(ConnectionLost()))
+        self.assertEqual([f.type for f in failures], [ConnectionLost] * 2)
+
+
+class RecordingConnector(object):
+    """
+    Serves a simulated device directly, writing each VRT packet read
+    to recording
+    """
+    def __init__(self, recording):
+        self.device = SimulatedWSA()
+        self.recording = recording
+
+    def connect(self, host):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def scpiset(self, cmd):
+        for line in cmd.split('\n'):
+            if line.strip():
+                self.device.scpi(line)
+
+    def scpiset_many(self, cmds):
+        for cmd in cmds:
+            self.scpiset(cmd)
+
+    def scpiget(self, cmd):
+        return self.device.scpi(cmd.strip()) + '\n'
+
+    def sync_async(self, gen):
+        val = None
+        try:
+            while True:
+                val = gen.send(val)
+        except StopIteration:
+            return val
+
+    def read_packet(self, timeout=1):
+        raw = self.device.next_packet(timeout)
+        if raw is None:
+            return None
+        self.recording.write(raw)
+        return parse_vrt_packet(raw)
+
+
+def packet_summary(packet):
+    if packet.is_context_packet():
+        return (packet.stream_id, packet.fields)
+    return (packet.stream_id, packet.tsi, packet.tsf)
+
+
+def data_time(packet):
+    return packet.tsi + packet.tsf * 1e-12
+
+
+class TestContextFieldsOffset(unittest.TestCase):
+    def offset(self, header):
+        return _context_fields_offset(struct.pack('>I', header))
+
+    def test_timestamps(self):
+        self.assertEqual(self.offset(0x50f00007), 24)
+        self.assertEqual(self.offset(0x50400004), 16)
+        self.assertEqual(self.offset(0x50000003), 12)
+
+    def test_class_id(self):
+        self.assertEqual(self.offset(0x58f00009), 32)
+
+
+class TestPlaybackRoundTrip(unittest.TestCase):
+    def setUp(self):
+        self.recording = io.BytesIO()
+        dut = WSA(connector=RecordingConnector(self.recording))
+        dut.connect('simulator')
+        self.live = []
+        for i in range(3):
+            if i:
+                time.sleep(0.1)
+            dut.freq((2400 + 10 * i) * M)
+            dut.capture(1024, 2)
+            # rffreq and reference level context, then the data
+            self.live.extend(dut.read() for j in range(4))
+        times = [data_time(p) for p in self.live
+            if not p.is_context_packet()]
+        self.span = times[-1] - times[0]
+
+    def replay(self, paced):
+        dut = WSA(connector=PlaybackConnector(self.recording, paced=paced,
+            device_identifier=DEFAULT_DEVICE_ID))
+        dut.connect('playback')
+        start = time.time()
+        packets = []
+        while True:
+            packet = dut.read()
+            if packet is False:
+                break
+            packets.append(packet)
+        self.assertTrue(dut.connector.eof())
+        self.assertEqual([packet_summary(p) for p in packets],
+            [packet_summary(p) for p in self.live])
+        return time.time() - start
+
+    def test_unpaced(self):
+        self.assertTrue(self.span >= 0.2)
+        self.assertTrue(self.replay(paced=False) < self.span / 2)
+
+    def test_paced(self):
+        self.assertTrue(self.replay(paced=True) >= self.span - 0.01)
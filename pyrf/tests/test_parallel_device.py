@@ -0,0 +1,159 @@
+import struct
+import time
+import unittest
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+import numpy as np
+
+from pyrf.devices.thinkrf_properties import wsa_properties
+from pyrf.parallel_device import (PacketRing, ParallelStreamDevice,
+    ParallelDeviceError)
+from pyrf.simulator.device import DEFAULT_DEVICE_ID
+from pyrf.simulator.server import SimulatorServer
+from pyrf.units import M
+
+
+def data_packet(tsi, samples):
+    """
+    Return an I14Q14 data packet of samples with I and Q set to tsi
+    """
+    size = 1 + 4 + samples + 1
+    return (struct.pack('>IIIQ', (1 << 28) | size, 0x90000003, tsi, 0)
+        + struct.pack('>h', tsi) * (2 * samples) + struct.pack('>I', 0))
+
+
+class FakeControl(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+
+class TestPacketRing(unittest.TestCase):
+    def assertPacket(self, ring, slot, tsi, samples):
+        packet = ring.packet(slot)
+        self.assertEqual(packet.tsi, tsi)
+        self.assertEqual(packet.size - 6, samples)
+        np.testing.assert_array_equal(packet.data.numpy_array(),
+            np.full((samples, 2), tsi))
+
+    def test_slot_reuse(self):
+        ring = PacketRing(slots=2, max_spp=64)
+        ring.write(0, 1, 0, data_packet(1, 64), {'rffreq': 2450 * M})
+        ring.write(1, 1, 1, data_packet(2, 64), {})
+        ring.write(0, 2, 5, data_packet(3, 16), {'reflevel': -10.0})
+        self.assertEqual(ring.header(0), (2, 5))
+        self.assertEqual(ring.context(0), {'reflevel': -10.0})
+        self.assertPacket(ring, 0, 3, 16)
+        self.assertPacket(ring, 1, 2, 64)
+
+    def test_wraparound(self):
+        ring = PacketRing(slots=3, max_spp=64)
+        for sequence in range(10):
+            slot = sequence % 3
+            ring.write(slot, 1, sequence, data_packet(sequence, 64), {})
+            # the slots filled before this one still hold their packets
+            for earlier in range(max(0, sequence - 2), sequence + 1):
+                self.assertEqual(ring.header(earlier % 3), (1, earlier))
+                self.assertPacket(ring, earlier % 3, earlier, 64)
+
+    def test_packet_too_large(self):
+        ring = PacketRing(slots=2, max_spp=64)
+        self.assertRaises(ParallelDeviceError, ring.write, 0, 1, 0,
+            data_packet(1, 72), {})
+
+
+class TestParallelRead(unittest.TestCase):
+    def setUp(self):
+        # the device without its receiver and worker processes
+        dev = ParallelStreamDevice.__new__(ParallelStreamDevice)
+        dev.ring = PacketRing(slots=8, max_spp=64)
+        dev.properties = wsa_properties(DEFAULT_DEVICE_ID)
+        dev.results_read = 0
+        dev._stream_id = 0
+        dev._done = {}
+        dev._receiver_error = None
+        dev._free = Queue()
+        dev._results = Queue()
+        dev._control = FakeControl()
+        dev.start('SH', 2450 * M, spp=64)
+        self.dev = dev
+
+    def finish(self, slot, stream_id, sequence, value):
+        """
+        Report slot as processed by a worker with a result of 4
+        values, or as failed when value is None
+        """
+        ring = self.dev.ring
+        ring.write(slot, stream_id, sequence, data_packet(slot, 64), {})
+        if value is None:
+            self.dev._results.put((slot, None, None, None))
+            return
+        ring.result(slot, 4)[:] = value
+        self.dev._results.put((slot, 64, 4, False))
+
+    def test_results_in_order(self):
+        self.assertEqual(self.dev._control.sent,
+            [('start', 1, {'freq': 2450 * M, 'rfe_mode': 'SH'}, 64)])
+        self.finish(0, 1, 2, 12.0)
+        self.finish(1, 0, 0, 99.0)  # from the previous stream
+        self.finish(2, 1, 0, 10.0)
+        self.finish(3, 1, 3, None)  # FFT failed
+        self.finish(4, 1, 1, 11.0)
+        self.finish(5, 1, 4, 14.0)
+
+        values = []
+        for i in range(4):
+            fstart, fstop, pow_data = self.dev.read(timeout=1)
+            self.assertTrue(fstart < 2450 * M < fstop)
+            values.append(pow_data[0])
+        self.assertEqual(values, [10.0, 11.0, 12.0, 14.0])
+        self.assertEqual(self.dev.read(timeout=0.01), None)
+        self.assertEqual(self.dev.results_read, 4)
+
+        freed = []
+        while not self.dev._free.empty():
+            freed.append(self.dev._free.get())
+        self.assertEqual(sorted(freed), [0, 1, 2, 3, 4, 5])
+
+    def test_receiver_stopped(self):
+        self.finish(0, 1, 1, 11.0)
+        # the receiver ends before the worker reports its first packet
+        self.dev._results.put((None, 1, 2, 'VRT connection closed'))
+        self.finish(1, 1, 0, 10.0)
+        self.assertEqual(self.dev.read(timeout=1)[2][0], 10.0)
+        self.assertEqual(self.dev.read(timeout=1)[2][0], 11.0)
+        self.assertRaises(ParallelDeviceError, self.dev.read, 1)
+        self.assertFalse(self.dev.streaming)
+        self.assertRaises(ParallelDeviceError, self.dev.start, 'SH',
+            2450 * M, 64)
+
+
+class TestParallelLoopback(unittest.TestCase):
+    def setUp(self):
+        self.server = SimulatorServer(host='127.0.0.1', scpi_port=0,
+            vrt_port=0, data_rate=1e6)
+        self.server.start()
+        self.dev = ParallelStreamDevice('127.0.0.1', workers=1, slots=16,
+            max_spp=1024, connector_kwargs={
+                'scpi_port': self.server.scpi_port,
+                'vrt_port': self.server.vrt_port})
+
+    def tearDown(self):
+        self.dev.close()
+        self.server.stop()
+
+    def test_connection_closed(self):
+        self.dev.start('SH', 2450 * M, spp=1024)
+        while not self.server.packets_sent:
+            time.sleep(0.001)
+        self.server.drop_clients()
+
+        def read_all():
+            while self.dev.read(timeout=5) is not None:
+                pass
+        self.assertRaises(ParallelDeviceError, read_all)
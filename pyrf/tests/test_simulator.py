@@ -0,0 +1,138 @@
+import threading
+import time
+import unittest
+
+from pyrf.connectors.blocking import PlainSocketConnector
+from pyrf.devices.thinkrf import WSA
+from pyrf.numpy_util import compute_fft
+from pyrf.simulator.server import SimulatorServer
+from pyrf.sweep_device import SweepDevice
+from pyrf.units import M
+
+
+class TestSimulatorLoopback(unittest.TestCase):
+    def setUp(self):
+        self.server = SimulatorServer(host='127.0.0.1', scpi_port=0,
+            vrt_port=0)
+        self.server.start()
+        self.dut = WSA(connector=PlainSocketConnector(
+            scpi_port=self.server.scpi_port, vrt_port=self.server.vrt_port))
+        self.dut.connect('127.0.0.1')
+
+    def tearDown(self):
+        # stop with the client still connected
+        self.server.stop()
+        self.assertEqual([t for t in threading.enumerate()
+            if t.name.startswith('pyrf simulator')], [])
+        self.dut.disconnect()
+
+    def test_capture(self):
+        self.dut.rfe_mode('SH')
+        self.dut.freq(2450 * M)
+        self.dut.capture(1024, 1)
+        context = {}
+        while True:
+            packet = self.dut.read(timeout=5)
+            if not packet.is_context_packet():
+                break
+            context.update(packet.fields)
+        self.assertEqual(context['rffreq'], 2450 * M)
+        pow_data = compute_fft(self.dut, packet, context)
+        self.assertTrue(len(pow_data) > 0)
+        # the default signals are well above the noise
+        self.assertTrue(max(pow_data) > min(pow_data) + 20)
+
+    def test_sweep(self):
+        sd = SweepDevice(self.dut)
+        fstart, fstop, spectrum = sd.capture_power_spectrum(
+            2400 * M, 2500 * M, 500e3, {'attenuator': 0})
+        self.assertTrue(fstart <= 2400 * M)
+        self.assertTrue(fstop >= 2500 * M)
+        self.assertTrue(len(spectrum) >= 200)
+        self.assertTrue(max(spectrum) > -50)
+
+
+class TestSimulatorReconnect(unittest.TestCase):
+    def setUp(self):
+        self.server = SimulatorServer(host='127.0.0.1', scpi_port=0,
+            vrt_port=0, data_rate=1e6)
+        self.server.start()
+        self.connector = PlainSocketConnector(reconnect=True,
+            reconnect_delay=0.01, scpi_port=self.server.scpi_port,
+            vrt_port=self.server.vrt_port)
+        self.dut = WSA(connector=self.connector)
+        self.dut.connect('127.0.0.1')
+
+    def tearDown(self):
+        self.dut.disconnect()
+        self.server.stop()
+
+    def restart_device(self):
+        """
+        Drop the connections to a device that lost its settings and
+        sweep list, as when it was power cycled
+        """
+        device = self.server.device
+        device.reset()
+        device.sweep_entries = []
+        self.server.drop_clients()
+
+    def read_stream(self):
+        """
+        Return the custom context fields received up to the next data
+        packet
+        """
+        fields = {}
+        while True:
+            packet = self.dut.read(timeout=5)
+            if not packet.is_context_packet():
+                return fields
+            if 'streamid' in packet.fields:
+                fields.update(packet.fields)
+
+    def test_stream_replayed(self):
+        self.dut.rfe_mode('SH')
+        self.dut.freq(2450 * M)
+        self.dut.stream_start(7)
+        self.assertEqual(self.read_stream(), {'streamid': 7})
+        self.restart_device()
+
+        while True:
+            packet = self.dut.read(timeout=5)
+            if packet.is_context_packet() and 'reconnect_gap' in packet.fields:
+                break
+        self.assertEqual(packet.fields['reconnect_gap'],
+            self.connector.last_gap)
+        self.assertEqual(self.connector.reconnects, 1)
+        # data arrives once the replayed commands have been run
+        self.assertEqual(self.read_stream(), {'streamid': 7})
+        settings = self.server.device.settings
+        self.assertEqual((settings['rfe_mode'], settings['freq']),
+            ('SH', 2450 * M))
+        self.assertTrue(self.server.device.streaming)
+
+    def test_sweep_restarted(self):
+        sd = SweepDevice(self.dut)
+        dropped = []
+
+        def drop_mid_sweep():
+            # wait for the first packets of the sweep
+            while not self.server.packets_sent:
+                time.sleep(0.001)
+            dropped.append(len(self.server.device.sweep_entries))
+            self.restart_device()
+        dropper = threading.Thread(target=drop_mid_sweep)
+        dropper.start()
+        fstart, fstop, spectrum = sd.capture_power_spectrum(
+            1000 * M, 3000 * M, 100e3, {'attenuator': 0})
+        dropper.join()
+
+        self.assertEqual(self.connector.reconnects, 1)
+        self.assertTrue(self.connector.last_gap > 0)
+        self.assertEqual(sd.sweeps_restarted, 1)
+        # the sweep list was replayed to the restarted device
+        self.assertTrue(dropped[0] > 0)
+        self.assertEqual(len(self.server.device.sweep_entries), dropped[0])
+        self.assertAlmostEqual(fstart, 1000 * M, delta=100e3)
+        self.assertAlmostEqual(fstop, 3000 * M, delta=100e3)
+        self.assertTrue(max(spectrum) > -50)
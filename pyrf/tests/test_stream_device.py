@@ -0,0 +1,91 @@
+import unittest
+
+import numpy as np
+
+from pyrf.stream_device import (IQRingBuffer, StreamDeviceError,
+    StreamCaptureDevice)
+from pyrf.units import M
+from pyrf.vrt import IQ, VRT_IFDATA_I14Q14
+
+
+class TestIQRingBuffer(unittest.TestCase):
+    def test_wrap(self):
+        ring = IQRingBuffer(8, np.float32)
+        ring.write(np.arange(5))
+        ring.write(np.arange(5, 11))
+        self.assertEqual(ring.oldest, 3)
+        self.assertEqual(list(ring.read(3, 8)), list(range(3, 11)))
+        self.assertEqual(list(ring.latest(4)), [7, 8, 9, 10])
+
+    def test_write_larger_than_buffer(self):
+        ring = IQRingBuffer(4, np.float32)
+        ring.write(np.arange(10))
+        self.assertEqual(ring.written, 10)
+        self.assertEqual(list(ring.latest(4)), [6, 7, 8, 9])
+
+    def test_overwritten(self):
+        ring = IQRingBuffer(4, np.float32)
+        ring.write(np.arange(6))
+        self.assertRaises(StreamDeviceError, ring.read, 1, 2)
+        self.assertRaises(StreamDeviceError, ring.read, 4, 3)
+
+
+class FakeIQ(object):
+    def __init__(self, values):
+        self.values = values
+
+    def numpy_array(self):
+        return np.stack([self.values, np.zeros(len(self.values))], 1)
+
+
+class FakePacket(object):
+    stream_id = VRT_IFDATA_I14Q14
+    spec_inv = False
+    sample_loss = False
+
+    def __init__(self, values):
+        self.data = FakeIQ(values)
+
+    def is_context_packet(self):
+        return False
+
+
+class FakeStreamDevice(object):
+    """
+    Streams packets of 100 samples where sample n has I value n
+    """
+    class properties(object):
+        FULL_BW = {'ZIF': 100 * M}
+        USABLE_BW = {'ZIF': 80 * M}
+        PASS_BAND_CENTER = {'ZIF': 0.5}
+        DC_OFFSET_BW = 2 * M
+        DEFAULT_SAMPLE_TYPE = {'ZIF': IQ}
+        REFLEVEL_ERROR = 0
+
+    def __init__(self):
+        self.sent = 0
+
+    def async_connector(self):
+        return False
+
+    def read(self):
+        values = np.arange(self.sent, self.sent + 100)
+        self.sent += 100
+        return FakePacket(values)
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+class TestStreamCaptureDevice(unittest.TestCase):
+    def test_level_trigger_pre_history(self):
+        dev = StreamCaptureDevice(FakeStreamDevice(), buffer_samples=1000)
+        dev.start('ZIF', 2400 * M, 256)
+        # trigger on the first sample with I value >= 250
+        dev.arm(50 / 100e6, 150 / 100e6, level=20 * np.log10(249.5 / 2. ** 13))
+        index, pre, samples = dev.read_triggered()
+        self.assertEqual(index, 250)
+        self.assertEqual(pre, 50)
+        self.assertEqual(len(samples), 200)
+        self.assertEqual(samples[pre].real * 2 ** 13, 250)
+        self.assertEqual(samples[0].real * 2 ** 13, 200)
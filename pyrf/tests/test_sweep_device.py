@@ -1,7 +1,13 @@
 import unittest
+from contextlib import contextmanager
 
-from pyrf.sweep_device import plan_sweep, SweepStep
+import numpy as np
+
+from pyrf.sweep_device import (plan_sweep, SweepStep, find_occupied_regions,
+    split_sweep_plan, plan_sweep_timed, SweepDevice)
+from pyrf.sweep_timing import SweepTimingModel
 from pyrf.units import M
+from pyrf.vrt import IQ, VRT_IFDATA_I14Q14
 
 
 class WSA42(object):
@@ -21,6 +27,107 @@ class WSA42(object):
         DECIMATED_USABLE = 0.5
         DC_OFFSET_BW = 2*M
         TUNING_RESOLUTION = 100000
+        DEFAULT_SAMPLE_TYPE = {'ZIF':IQ}
+
+
+class FakeIQ(object):
+    def __init__(self, values):
+        self.values = values
+
+    def numpy_array(self):
+        return self.values
+
+
+class FakeDataPacket(object):
+    stream_id = VRT_IFDATA_I14Q14
+    spec_inv = False
+
+    def __init__(self, values):
+        self.data = FakeIQ(values)
+        self.size = len(values) + 6
+
+    def is_context_packet(self):
+        return False
+
+
+class FakeContextPacket(object):
+    size = 7
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def is_context_packet(self):
+        return True
+
+
+class FakeSweepWSA(WSA42):
+    """
+    Answers each sweep with noise captures seeded by their frequency,
+    so that repeated sweeps return the same spectrum.  When loud is
+    set, captures tuned outside its (fstart, fstop) ranges are 60 dB
+    quieter.  Each frequency in tones adds a tone to the captures that
+    include it.  The capture tuned to short, if set, has a quarter of
+    the samples requested.
+    """
+    class properties(WSA42.properties):
+        PASS_BAND_CENTER = {'ZIF':0.5}
+        REFLEVEL_ERROR = 0
+        CAPTURE_FREQ_RANGES = [(0, 20000*M, IQ)]
+
+    timing_model = None
+
+    def __init__(self):
+        self.sweeps = 0
+        self.entries = []
+        self.packets = []
+        self.loud = None
+        self.tones = []
+        self.short = None
+
+    def async_connector(self):
+        return False
+
+    @contextmanager
+    def batch(self):
+        yield
+
+    def sweep_clear(self):
+        self.entries = []
+
+    def sweep_add(self, entry):
+        self.entries.append(entry)
+
+    def sweep_start(self, sweep_id):
+        self.sweeps += 1
+        self.packets = []
+        for e in self.entries:
+            freq = e.fstart
+            while freq <= e.fstop:
+                self.packets.append(FakeContextPacket({'sweepid': sweep_id,
+                    'rffreq': freq, 'reflevel': 0}))
+                rand = np.random.RandomState(int(freq) % 2**32)
+                values = rand.randint(-2000, 2000, (e.spp, 2))
+                if self.loud is not None and not any(
+                        lo <= freq <= hi for lo, hi in self.loud):
+                    values = values // 1000
+                n = np.arange(e.spp)
+                for tone in self.tones:
+                    if abs(tone - freq) >= 62.5*M:
+                        continue
+                    phase = 2 * np.pi * (tone - freq) / (125*M) * n
+                    values = values + (np.array([np.cos(phase),
+                        np.sin(phase)]).T * 4000).astype(int)
+                if freq == self.short:
+                    values = values[:e.spp // 4]
+                self.packets.append(FakeDataPacket(values))
+                freq += e.fstep
+
+    def read(self):
+        return self.packets.pop(0)
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
 
 class TestPlanSweep(unittest.TestCase):
     def _plan42(self, start, stop, rbw, expected, min_points=128,
@@ -127,3 +234,186 @@ class TestPlanSweep(unittest.TestCase):
     #         (90*M, 0, 1, 8192, 655, 1507, 460),])
 
 
+
+class TestSplitSweepPlan(unittest.TestCase):
+    def test_split_triple_two_parts(self):
+        fstart, fstop, plan = plan_sweep(WSA42, 100*M, 196*M, 500000,
+            mode='ZIF left band', min_points=128)
+        self.assertEquals(split_sweep_plan(fstart, fstop, plan, 2), [
+            (100*M, 132*M, [SweepStep(133*M, 32*M, 0, 1, 256, 62, 64, 0, 64)]),
+            (132*M, 196*M, [SweepStep(165*M, 32*M, 0, 1, 256, 62, 64, 0, 128)]),
+            ])
+
+    def test_split_triple_three_parts(self):
+        fstart, fstop, plan = plan_sweep(WSA42, 100*M, 196*M, 500000,
+            mode='ZIF left band', min_points=128)
+        self.assertEquals(split_sweep_plan(fstart, fstop, plan, 3), [
+            (100*M, 132*M, [SweepStep(133*M, 32*M, 0, 1, 256, 62, 64, 0, 64)]),
+            (132*M, 164*M, [SweepStep(165*M, 32*M, 0, 1, 256, 62, 64, 0, 64)]),
+            (164*M, 196*M, [SweepStep(197*M, 32*M, 0, 1, 256, 62, 64, 0, 64)]),
+            ])
+
+    def test_split_more_parts_than_steps(self):
+        fstart, fstop, plan = plan_sweep(WSA42, 100*M, 132*M, 500000,
+            mode='ZIF left band', min_points=128)
+        parts = split_sweep_plan(fstart, fstop, plan, 2)
+        self.assertEquals(parts[0], (100*M, 100*M, []))
+        self.assertEquals(parts[1], (fstart, fstop, plan))
+
+
+class TestPlanSweepTimed(unittest.TestCase):
+    def test_wide_span_not_decimated(self):
+        timed = plan_sweep_timed(WSA42, 100*M, 1000*M, 500000,
+            modes=('ZIF left band',))
+        self.assertEquals(timed.mode, 'ZIF left band')
+        self.assertEquals([ss.decimation for ss in timed.plan], [1])
+        self.assertEquals(timed.duration, SweepTimingModel().sweep_time(
+            WSA42, 'ZIF', timed.plan))
+
+    def test_narrow_span_decimated(self):
+        timed = plan_sweep_timed(WSA42, 1000*M, 1001*M, 1000,
+            modes=('ZIF left band',))
+        _, _, plan = plan_sweep(WSA42, 1000*M, 1001*M, 1000,
+            'ZIF left band')
+        self.assertTrue(timed.plan[0].decimation > 1)
+        self.assertTrue(timed.duration < SweepTimingModel().sweep_time(
+            WSA42, 'ZIF', plan))
+        self.assertTrue(timed.fstart <= 1000*M)
+        self.assertTrue(timed.fstop >= 1001*M - 1000)
+
+    def test_empty_range(self):
+        timed = plan_sweep_timed(WSA42, 2400*M, 2400*M, 500,
+            modes=('ZIF left band',))
+        self.assertEquals(timed.plan, [])
+
+class TestFindOccupiedRegions(unittest.TestCase):
+    def test_no_signal(self):
+        self.assertEquals(find_occupied_regions(100*M, 200*M,
+            [-100] * 100, -80), [])
+
+    def test_single_region(self):
+        bins = [-100] * 100
+        bins[10:20] = [-50] * 10
+        self.assertEquals(find_occupied_regions(100*M, 200*M,
+            bins, -80), [(110*M, 120*M)])
+
+    def test_guard_merges_and_clips(self):
+        bins = [-100] * 100
+        bins[0:2] = [-50] * 2
+        bins[10:20] = [-50] * 10
+        bins[23:25] = [-50] * 2
+        self.assertEquals(find_occupied_regions(100*M, 200*M,
+            bins, -80, guard=2*M), [(100*M, 104*M), (108*M, 127*M)])
+
+
+
+class TestAdaptiveSweep(unittest.TestCase):
+    def test_changed_settings_sweep_coarse_again(self):
+        dut = FakeSweepWSA()
+        sd = SweepDevice(dut)
+        settings = {'attenuator': 1}
+        sd.capture_adaptive_spectrum(100*M, 196*M, 100000, 500000, 100,
+            settings, mode='ZIF left band', min_points=128)
+        sd.capture_adaptive_spectrum(100*M, 196*M, 100000, 500000, 100,
+            settings, mode='ZIF left band', min_points=128)
+        self.assertEquals(dut.sweeps, 1)
+        settings['attenuator'] = 0
+        sd.capture_adaptive_spectrum(100*M, 196*M, 100000, 500000, 100,
+            settings, mode='ZIF left band', min_points=128)
+        self.assertEquals(dut.sweeps, 2)
+
+    def test_close_signals_in_order(self):
+        dut = FakeSweepWSA()
+        dut.loud = []
+        dut.tones = [150*M, 152*M]
+        sd = SweepDevice(dut)
+        fstart, fstop, bins, regions = sd.capture_adaptive_spectrum(
+            100*M, 296*M, 100000, 500000, -35, {}, mode='ZIF left band',
+            guard=240000, min_points=128)
+        # two occupied regions whose planned sweeps overlap
+        (astart, astop), (bstart, bstop) = sd._coarse_map[3]
+        self.assertTrue(bstart - astop < 100000)
+        fine = [r for r in regions if r.rbw < 500000]
+        self.assertEquals(len(fine), 1)
+        self.assertAlmostEquals(fine[0].fstart, astart, delta=100000)
+        self.assertAlmostEquals(fine[0].fstop, bstop, delta=100000)
+
+        self.assertEquals((regions[0].fstart, regions[-1].fstop),
+            (fstart, fstop))
+        offset = 0
+        for r, n in zip(regions, regions[1:] + [None]):
+            self.assertEquals(r.offset, offset)
+            offset += r.length
+            if n is not None:
+                self.assertTrue(r.fstop <= n.fstart)
+        self.assertEquals(offset, len(bins))
+
+
+class TestPartialSweep(unittest.TestCase):
+    def test_parts_cover_sweep(self):
+        parts = []
+        sd = SweepDevice(FakeSweepWSA(),
+            partial_callback=lambda *args: parts.append(args))
+        fstart, fstop, bins = sd.capture_power_spectrum(100*M, 296*M,
+            500000, {}, mode='ZIF left band', min_points=128)
+        self.assertEquals(len(parts), 7)
+        self.assertEquals(parts[0][0], fstart)
+        self.assertEquals(parts[-1][1], fstop)
+        for a, b in zip(parts, parts[1:]):
+            self.assertEquals(a[1], b[0])
+            self.assertEquals(a[3] + len(a[2]), b[3])
+        self.assertEquals(list(np.concatenate([p[2] for p in parts])),
+            list(bins))
+
+    def test_adaptive_parts_within_regions(self):
+        dut = FakeSweepWSA()
+        dut.loud = [(150*M, 170*M), (250*M, 270*M)]
+        sd = SweepDevice(dut)
+        sd.capture_adaptive_spectrum(100*M, 296*M, 100000, 500000, -60,
+            {}, mode='ZIF left band', min_points=128)
+        parts = []
+        sd.partial_callback = lambda *args: parts.append(args)
+        # coarse map is reused, only the occupied regions are swept
+        fstart, fstop, bins, regions = sd.capture_adaptive_spectrum(
+            100*M, 296*M, 100000, 500000, -60,
+            {}, mode='ZIF left band', min_points=128)
+        self.assertEquals(dut.sweeps, 3)
+        fine = [r for r in regions if r.rbw < 500000]
+        self.assertEquals(len(fine), 2)
+        first = 0
+        for r in fine:
+            rparts = [p for p in parts
+                if first <= p[3] < first + r.length]
+            self.assertEquals(rparts[0][0], r.fstart)
+            self.assertEquals(rparts[-1][1], r.fstop)
+            for pfstart, pfstop, pbins, offset in rparts:
+                self.assertAlmostEquals(pfstart,
+                    r.fstart + (offset - first) * r.rbw)
+                self.assertAlmostEquals(pfstop,
+                    pfstart + len(pbins) * r.rbw)
+            self.assertEquals(sum(len(p[2]) for p in rparts), r.length)
+            first += r.length
+
+
+class TestPipelinedSweep(unittest.TestCase):
+    def _sweep(self, short=None, **kwargs):
+        dut = FakeSweepWSA()
+        dut.short = short
+        sd = SweepDevice(dut, **kwargs)
+        try:
+            return sd.capture_power_spectrum(100*M, 296*M, 500000, {},
+                mode='ZIF left band', min_points=128)[2]
+        finally:
+            sd.close()
+
+    def test_same_as_serial(self):
+        serial = self._sweep()
+        pipelined = self._sweep(pipeline_workers=2, pipeline_depth=3)
+        self.assertEquals(list(pipelined), list(serial))
+
+    def test_short_capture_leaves_no_gap(self):
+        serial = self._sweep(short=165*M)
+        pipelined = self._sweep(short=165*M, pipeline_workers=2)
+        self.assertEquals(list(pipelined), list(serial))
+        self.assertFalse(np.isnan(pipelined).any())
+        self.assertEquals(len(pipelined), len(self._sweep()) - 62)
@@ -0,0 +1,32 @@
+import shutil
+import tempfile
+import unittest
+
+from pyrf.sweep_timing import (SweepTimingModel, save_timing_model,
+    load_timing_model, device_serial)
+
+
+class TestTimingModelPersistence(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        model = SweepTimingModel(step_overhead=0.002, byte_time=1e-8,
+            scpi_latency=0.0005, command_time=0.00005)
+        save_timing_model('123456', model, self.directory)
+        loaded = load_timing_model('123456', self.directory)
+        self.assertEqual(loaded.to_json_object(), model.to_json_object())
+
+    def test_missing(self):
+        self.assertEqual(load_timing_model('654321', self.directory), None)
+
+    def test_device_serial(self):
+        self.assertEqual(device_serial(
+            'ThinkRF,WSA5000-220,123456,4.0.0'), '123456')
+
+    def test_device_serial_missing(self):
+        self.assertEqual(device_serial('ThinkRF,WSA5000-220,,4.0.0'), None)
+        self.assertEqual(device_serial('SIMULATOR'), None)
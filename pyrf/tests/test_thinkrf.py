@@ -0,0 +1,256 @@
+import unittest
+
+import pyrf.devices.thinkrf
+from pyrf.devices.thinkrf import WSA
+from pyrf.units import M
+
+WSA_ID = 'ThinkRF,WSA5000-220 v3,123456,4.2.0\n'
+
+
+class FakeConnector(object):
+    """
+    Records each write of SCPI commands and answers queries from
+    the replies dict, where a list of replies is answered in turn
+    """
+    def __init__(self, replies=None):
+        self.replies = {':*idn?': WSA_ID}
+        self.replies.update(replies or {})
+        self.writes = []
+
+    def connect(self, host):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def scpiset(self, cmd):
+        self.writes.append([cmd])
+
+    def scpiset_many(self, cmds):
+        self.writes.append(list(cmds))
+
+    def _reply(self, cmd):
+        reply = self.replies[cmd]
+        if isinstance(reply, list):
+            # replies given in turn, the last one repeated
+            return reply.pop(0) if len(reply) > 1 else reply[0]
+        return reply
+
+    def scpiget(self, cmd):
+        self.writes.append([cmd])
+        return self._reply(cmd)
+
+    def scpiget_many(self, cmds):
+        self.writes.append(list(cmds))
+        return [self._reply(cmd) for cmd in cmds]
+
+    def sync_async(self, gen):
+        val = None
+        try:
+            while True:
+                val = gen.send(val)
+        except StopIteration:
+            return val
+
+
+class TestTimingModel(unittest.TestCase):
+    def setUp(self):
+        self.loaded = []
+        self._load = pyrf.devices.thinkrf.load_timing_model
+        pyrf.devices.thinkrf.load_timing_model = self.loaded.append
+
+    def tearDown(self):
+        pyrf.devices.thinkrf.load_timing_model = self._load
+
+    def test_loaded_when_used(self):
+        dut = WSA(connector=FakeConnector())
+        dut.connect('wsa')
+        self.assertEqual(self.loaded, [])
+        dut.timing_model
+        dut.timing_model
+        self.assertEqual(self.loaded, ['123456'])
+
+    def test_no_serial(self):
+        dut = WSA(connector=FakeConnector({
+            ':*idn?': 'ThinkRF,WSA5000-220 v3,,4.2.0\n'}))
+        dut.connect('wsa')
+        self.assertEqual(dut.timing_model, None)
+        self.assertEqual(self.loaded, [])
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.connector = FakeConnector()
+        self.dut = WSA(connector=self.connector)
+        self.dut.connect('wsa')
+        del self.connector.writes[:]
+
+    def test_batch_single_write(self):
+        with self.dut.batch():
+            self.dut.freq(2400 * M)
+            with self.dut.batch():
+                self.dut.antenna(2)
+            self.assertEqual(self.connector.writes, [])
+        self.assertEqual(self.connector.writes, [[
+            ':FREQ:CENTER 2400000000\n', ':INPUT:ANTENNA 2']])
+
+    def test_batch_discarded_on_error(self):
+        try:
+            with self.dut.batch():
+                self.dut.freq(2400 * M)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(self.connector.writes, [])
+        # the device never got the setting, so it is not elided
+        self.dut.freq(2400 * M)
+        self.assertEqual(self.connector.writes,
+            [[':FREQ:CENTER 2400000000\n']])
+
+    def test_nested_batch_error(self):
+        with self.dut.batch():
+            self.dut.freq(2400 * M)
+            try:
+                with self.dut.batch():
+                    self.dut.antenna(2)
+                    raise ValueError()
+            except ValueError:
+                pass
+            self.dut.decimation(4)
+        self.assertEqual(self.connector.writes, [[
+            ':FREQ:CENTER 2400000000\n', ':SENSE:DECIMATION 4\n']])
+
+    def test_batch_decimation_verified_after(self):
+        self.connector.replies['SENSE:DECIMATION?'] = ['1\n']
+        with self.dut.batch():
+            self.dut.decimation(1)
+            self.dut.freq(2400 * M)
+        self.assertEqual(self.connector.writes, [
+            [':SENSE:DECIMATION 1\n', ':FREQ:CENTER 2400000000\n'],
+            ['SENSE:DECIMATION?']])
+
+        # firmware < 2.5.3 needs 0 to disable decimation
+        self.dut.invalidate_state_cache()
+        self.connector.replies['SENSE:DECIMATION?'] = ['0\n']
+        del self.connector.writes[:]
+        with self.dut.batch():
+            self.dut.decimation(1)
+        self.assertEqual(self.connector.writes, [
+            [':SENSE:DECIMATION 1\n'], ['SENSE:DECIMATION?'],
+            [':SENSE:DECIMATION 0\n']])
+
+
+class TestScpiGetMany(unittest.TestCase):
+    def test_scpiget_many_order(self):
+        connector = FakeConnector({':TRACE:SPP?': '1024\n',
+            ':FREQ:CENTER?': '2400000000\n'})
+        dut = WSA(connector=connector)
+        dut.connect('wsa')
+        del connector.writes[:]
+        responses = dut.scpiget_many([':TRACE:SPP?', ':FREQ:CENTER?',
+            ':TRACE:SPP?'])
+        self.assertEqual(responses, ['1024\n', '2400000000\n', '1024\n'])
+        self.assertEqual(len(connector.writes), 1)
+
+
+STATE_REPLIES = {
+    ':INPUT:MODE?': 'ZIF\n',
+    ':FREQ:CENTER?': '2400000000\n',
+    'FREQ:SHIFT?': '0\n',
+    'SENSE:DECIMATION?': '4\n',
+    ':INPUT:ATTENUATOR?': '1\n',
+    ':INPut:GAIN:HDR?': '-10 dB\n',
+    ':OUTPUT:IQ:MODE?': 'DIGITIZER\n',
+    ':SOURCE:REFERENCE:PLL?': 'INT\n',
+    'INPUT:GAIN:RF?': 'HIGH\n',
+    ':TRACE:SPP?': '1024\n',
+    ':TRACE:BLOCK:PACKETS?': '1\n',
+    ':TRIGGER:TYPE?': 'NONE\n',
+    ':TRIGGER:LEVEL?': '2400000000,2500000000,-100\n',
+    }
+
+
+class TestStateCache(unittest.TestCase):
+    def setUp(self):
+        self.connector = FakeConnector(STATE_REPLIES)
+        self.dut = WSA(connector=self.connector)
+        self.dut.connect('wsa')
+        del self.connector.writes[:]
+
+    def test_repeated_set_elided(self):
+        self.dut.gain('HIGH')
+        self.dut.gain('high')
+        self.dut.freq(2400 * M)
+        self.dut.freq(2400 * M)
+        self.assertEqual(self.connector.writes, [
+            [':INPUT:GAIN:RF HIGH\n'], [':FREQ:CENTER 2400000000\n']])
+        self.assertEqual(self.dut.elided_sets, 2)
+
+    def test_query_cached(self):
+        self.assertEqual(self.dut.gain(), 'high')
+        self.assertEqual(self.dut.gain(), 'high')
+        self.dut.gain('HIGH')
+        self.assertEqual(self.connector.writes, [['INPUT:GAIN:RF?']])
+        self.assertEqual(self.dut.cached_queries, 1)
+        self.assertEqual(self.dut.elided_sets, 1)
+
+    def test_reset_invalidates(self):
+        self.dut.freq(2400 * M)
+        self.dut.reset()
+        self.dut.freq(2400 * M)
+        self.assertEqual(self.connector.writes, [
+            [':FREQ:CENTER 2400000000\n'], [':*rst'],
+            [':FREQ:CENTER 2400000000\n']])
+
+    def test_errors_invalidate(self):
+        self.connector.replies[':SYSTEM:ERROR?'] = [
+            '-221,"Settings conflict"\n', '0,"No error"\n']
+        self.dut.freq(2400 * M)
+        self.assertEqual(self.dut.errors(), [(-221, 'Settings conflict')])
+        self.dut.freq(2400 * M)
+        self.assertEqual(self.connector.writes[-1],
+            [':FREQ:CENTER 2400000000\n'])
+        self.assertEqual(self.dut.elided_sets, 0)
+
+    def test_no_errors_keeps_cache(self):
+        self.connector.replies[':SYSTEM:ERROR?'] = '0,"No error"\n'
+        self.dut.freq(2400 * M)
+        self.assertEqual(self.dut.errors(), [])
+        self.dut.freq(2400 * M)
+        self.assertEqual(self.dut.elided_sets, 1)
+
+    def test_sweep_start_invalidates_sweep_keys(self):
+        self.dut.freq(2400 * M)
+        self.dut.pll_reference('EXT')
+        self.dut.sweep_start()
+        self.dut.freq(2400 * M)
+        self.dut.pll_reference('EXT')
+        self.assertEqual(self.connector.writes, [
+            [':FREQ:CENTER 2400000000\n'], [':SOURCE:REFERENCE:PLL EXT'],
+            [':sweep:list:start'], [':FREQ:CENTER 2400000000\n']])
+        self.assertEqual(self.dut.elided_sets, 1)
+
+    def test_snapshot_restore(self):
+        snapshot = self.dut.snapshot_state()
+        self.assertEqual(len(self.connector.writes), 1)
+        self.assertEqual(snapshot, {'rfe_mode': 'ZIF', 'freq': 2400 * M,
+            'fshift': 0.0, 'decimation': 4, 'attenuator': True,
+            'hdr_gain': -10, 'iq_output_path': 'DIGITIZER',
+            'pll_reference': 'INT', 'spp': 1024, 'ppb': 1,
+            'trigger': {'type': 'NONE'}})
+
+        # the device already has every setting
+        self.dut.restore_state(snapshot)
+        self.assertEqual(len(self.connector.writes), 1)
+
+        self.dut.invalidate_state_cache()
+        self.dut.restore_state(snapshot)
+        self.assertEqual(len(self.connector.writes), 2)
+        cmds = self.connector.writes[1]
+        self.assertEqual(cmds[0], ':INPUT:MODE ZIF')
+        self.assertEqual(sorted(cmds[1:]), sorted([
+            ':FREQ:CENTER 2400000000\n', ':FREQ:SHIFT 0\n',
+            ':SENSE:DECIMATION 4\n', ':INPUT:ATTENUATOR 1',
+            ':INPut:GAIN:HDR -10\n', ':OUTPUT:IQ:MODE DIGITIZER',
+            ':SOURCE:REFERENCE:PLL INT', ':TRACE:SPP 1024\n',
+            ':TRACE:BLOCK:PACKETS 1\n', ':TRIGGER:TYPE NONE']))
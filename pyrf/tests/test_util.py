@@ -0,0 +1,41 @@
+import unittest
+
+from pyrf.util import (capture_geometry, frequency_axis,
+    compute_usable_bins, adjust_usable_fstart_fstop, capture_center_freq)
+from pyrf.units import M
+from pyrf.vrt import IQ
+
+
+class WSA42(object):
+    class properties(object):
+        FULL_BW = {'ZIF': 128 * M}
+        USABLE_BW = {'ZIF': 66 * M}
+        PASS_BAND_CENTER = {'ZIF': 0.5}
+        DC_OFFSET_BW = 2 * M
+        DEFAULT_SAMPLE_TYPE = {'ZIF': IQ}
+        MIN_TUNABLE = {'ZIF': 50 * M, 'DD': 0}
+
+
+class TestCaptureGeometry(unittest.TestCase):
+    def test_matches_uncached(self):
+        prop = WSA42.properties
+        usable_bins = compute_usable_bins(prop, 'ZIF', 1024, 1, 0)
+        expected = adjust_usable_fstart_fstop(prop, 'ZIF', 1024, 1,
+            2400 * M, False, usable_bins)
+        geometry = capture_geometry(prop, 'ZIF', 1024, 1, 0, 2400 * M, False)
+        self.assertEqual(list(geometry.usable_bins), expected[0])
+        self.assertEqual((geometry.fstart, geometry.fstop), expected[1:])
+        self.assertTrue(geometry is capture_geometry(
+            prop, 'ZIF', 1024, 1, 0, 2400 * M, False))
+
+    def test_frequency_axis_shared_read_only(self):
+        axis = frequency_axis(100 * M, 200 * M, 11)
+        self.assertEqual(axis[1], 110 * M)
+        self.assertTrue(axis is frequency_axis(100 * M, 200 * M, 11))
+        self.assertRaises(ValueError, axis.__setitem__, 0, 0)
+
+    def test_capture_center_freq(self):
+        prop = WSA42.properties
+        self.assertEqual(capture_center_freq(prop, 'ZIF', 2400 * M),
+            2400 * M)
+        self.assertEqual(capture_center_freq(prop, 'DD', 2400 * M), 0)
@@ -0,0 +1,40 @@
+import struct
+import unittest
+
+import numpy as np
+
+from pyrf.vrt import parse_vrt_packet, ZERO_COPY_MIN
+
+
+def i14q14_packet(values):
+    samples = len(values) // 2
+    return (struct.pack('>IIIQ', (1 << 28) | (samples + 6), 0x90000003, 0, 0)
+        + struct.pack('>%dh' % len(values), *values) + struct.pack('>I', 0))
+
+
+def i24_packet(values):
+    return (struct.pack('>IIIQ', (1 << 28) | (len(values) + 6), 0x90000006,
+        0, 0) + struct.pack('>%di' % len(values), *values)
+        + struct.pack('>I', 0))
+
+
+class TestParseVRTPacket(unittest.TestCase):
+    def test_iq_numpy_array(self):
+        values = [i % 4000 - 2000 for i in range(2 * ZERO_COPY_MIN)]
+        for raw in (i14q14_packet(values), bytearray(i14q14_packet(values))):
+            packet = parse_vrt_packet(raw)
+            data = packet.data.numpy_array()
+            self.assertEqual(data.shape, (ZERO_COPY_MIN, 2))
+            self.assertEqual(data.ravel().tolist(), values)
+
+    def test_small_iq_numpy_array(self):
+        packet = parse_vrt_packet(i14q14_packet([1, -2, 3, -4]))
+        self.assertEqual(packet.data.numpy_array().tolist(),
+            [[1, -2], [3, -4]])
+
+    def test_i24_numpy_array(self):
+        values = [i * 1000 - 500000 for i in range(ZERO_COPY_MIN)]
+        data = parse_vrt_packet(i24_packet(values)).data.numpy_array()
+        self.assertEqual(data.dtype.kind, 'i')
+        self.assertEqual(data.tolist(), values)
+        self.assertEqual(np.asarray(data, dtype=float)[1], values[1])
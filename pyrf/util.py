@@ -1,7 +1,11 @@
 import math
+from collections import namedtuple
 
 from pyrf.vrt import I_ONLY
 
+# limit on the number of configurations kept by the caches below
+GEOMETRY_CACHE_SIZE = 256
+
 def read_data_and_context(dut, points=1024):
     """
     Initiate capture of one data packet, wait for and return data packet
@@ -112,6 +116,93 @@ def adjust_usable_fstart_fstop(dut_prop, rfe_mode, points, decimation,
     return usable_bins, fstart, fstop
 
 
+class CaptureGeometry(namedtuple('CaptureGeometry', '''
+        usable_bins
+        fstart
+        fstop
+        ''')):
+    """
+    Usable bins and frequency range of a capture, as returned by
+    :func:`compute_usable_bins` followed by
+    :func:`adjust_usable_fstart_fstop`
+
+    .. attribute:: usable_bins
+
+       tuple of (start, run) usable bin ranges
+
+    .. attribute:: fstart
+
+       frequency of the first bin in Hz
+
+    .. attribute:: fstop
+
+       frequency of the last bin in Hz
+    """
+    __slots__ = []
+
+
+_capture_geometry_cache = {}
+
+def capture_geometry(dut_prop, rfe_mode, points, decimation, fshift,
+        freq, spec_inv):
+    """
+    Return a :class:`CaptureGeometry` for the given capture
+    configuration.  Results are cached because the configuration
+    rarely changes from one capture to the next.
+    """
+    key = (dut_prop, rfe_mode, points, decimation, fshift, freq,
+        bool(spec_inv))
+    geometry = _capture_geometry_cache.get(key)
+    if geometry is not None:
+        return geometry
+
+    usable_bins = compute_usable_bins(dut_prop, rfe_mode, points,
+        decimation, fshift)
+    usable_bins, fstart, fstop = adjust_usable_fstart_fstop(dut_prop,
+        rfe_mode, points, decimation, freq, spec_inv, usable_bins)
+    geometry = CaptureGeometry(tuple(usable_bins), fstart, fstop)
+
+    if len(_capture_geometry_cache) >= GEOMETRY_CACHE_SIZE:
+        _capture_geometry_cache.clear()
+    _capture_geometry_cache[key] = geometry
+    return geometry
+
+
+def capture_center_freq(dut_prop, rfe_mode, freq):
+    """
+    Return the center frequency of captures made in *rfe_mode* with
+    the device tuned to *freq*.  Modes that can't be tuned are
+    centered on the device's minimum tunable frequency.
+    """
+    # FIXME: add a "can I tune in this mode?" device property instead
+    # of listing modes here
+    if rfe_mode in ('DD', 'IQIN'):
+        return dut_prop.MIN_TUNABLE[rfe_mode]
+    return freq
+
+
+_frequency_axis_cache = {}
+
+def frequency_axis(fstart, fstop, points):
+    """
+    Return a read-only numpy array of *points* frequencies from fstart
+    to fstop, shared between all callers using the same values
+    """
+    key = (fstart, fstop, points)
+    axis = _frequency_axis_cache.get(key)
+    if axis is not None:
+        return axis
+
+    import numpy as np # import here so docstrings are visible even without numpy
+    axis = np.linspace(fstart, fstop, points)
+    axis.flags.writeable = False
+
+    if len(_frequency_axis_cache) >= GEOMETRY_CACHE_SIZE:
+        _frequency_axis_cache.clear()
+    _frequency_axis_cache[key] = axis
+    return axis
+
+
 def trim_to_usable_fstart_fstop(bins, usable_bins, fstart, fstop):
     """
     Returns (trimmed bins, trimmed usable_bins,
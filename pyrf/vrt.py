@@ -12,6 +12,8 @@ VRTRECEIVER = 0x90000001
 VRTDIGITIZER = 0x90000002
 VRTCUSTOM = 0x90000004
 VRTSPECA = 0x5370eca0
+# generated by pyrf connectors to mark data lost while reconnecting
+VRTGAP = 0x5370eca1
 VRT_IFDATA_I14Q14 = 0x90000003
 VRT_IFDATA_I14 = 0x90000005
 VRT_IFDATA_I24 = 0x90000006
@@ -31,6 +33,10 @@ CTX_STREAMID = (1 << 1)
 I_ONLY = 'i_only'
 IQ = 'iq'
 
+# reads of this many bytes or more are returned as memoryviews of the
+# received data instead of copies
+ZERO_COPY_MIN = 1024
+
 class InvalidDataReceived(Exception):
     pass
 
@@ -53,7 +59,7 @@ def vrt_packet_reader(raw_read):
 
     if packet_type in (VRTCONTEXT, VRTCUSTOMCONTEXT):
         packet_size = (size - 1) * 4
-        context_data = yield raw_read(packet_size)
+        context_data = _as_bytes((yield raw_read(packet_size)))
         yield ContextPacket(packet_type, count, size, context_data,
             has_timestamp)
 
@@ -70,6 +76,40 @@ def vrt_packet_reader(raw_read):
         raise InvalidDataReceived("unknown packet type: %s" % packet_type)
 
 
+def parse_vrt_packet(data):
+    """
+    Parse a complete VRT packet and return an object with its data.
+
+    :param data: the bytes of exactly one VRT packet
+    """
+    view = memoryview(data)
+    position = [0]
+    def raw_read(num):
+        start = position[0]
+        position[0] = start + num
+        return read_view(view, start, num)
+
+    reader = vrt_packet_reader(raw_read)
+    value = None
+    try:
+        while True:
+            value = reader.send(value)
+    except StopIteration:
+        return value
+
+
+def read_view(view, start, num):
+    """
+    Return *num* bytes of memoryview *view* from *start*, as a
+    memoryview without copying when there are ZERO_COPY_MIN or more
+    and as a string otherwise.  Data returned this way is accepted
+    by :class:`IQData` and :class:`DataArray`.
+    """
+    data = view[start:start + num]
+    if num < ZERO_COPY_MIN:
+        return data.tobytes()
+    return data
+
 
 class ContextPacket(object):
     """
@@ -102,6 +142,7 @@ class ContextPacket(object):
             VRTDIGITIZER: self._parse_digitizer_context,
             VRTCUSTOM: self._parse_custom_context,
             VRTSPECA: self._parse_speca_context,
+            VRTGAP: self._parse_gap_context,
         }.get(self.stream_id)
 
         if parse:
@@ -191,6 +232,10 @@ class ContextPacket(object):
             self.fields['unknown'] = (indicators, data)
 
 
+    def _parse_gap_context(self, indicators, data):
+        (self.fields['reconnect_gap'],) = struct.unpack(">d", data[:8])
+
+
     def is_data_packet(self):
         """
         :returns: False
@@ -223,6 +268,25 @@ class ContextPacket(object):
             ) + str(self.fields) + "]"
 
 
+def _as_bytes(data):
+    """
+    Return data received as a memoryview as a string
+    """
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return data
+
+
+def _numpy_buffer(data):
+    """
+    Return data in a form accepted by numpy.frombuffer, which on
+    Python 2 does not accept memoryviews
+    """
+    if sys.version_info[0] < 3:
+        return _as_bytes(data)
+    return data
+
+
 class IQData(object):
     """
     Data Packet values as a lazy collection of (I, Q) tuples
@@ -246,7 +310,7 @@ class IQData(object):
 
     def _update_data(self):
         self._data = array.array('h')
-        self._data.fromstring(self._strdata)
+        self._data.fromstring(_as_bytes(self._strdata))
         if sys.byteorder == 'little':
             self._data.byteswap()
 
@@ -285,8 +349,7 @@ class IQData(object):
                   [ -44,   80]], dtype=int16)
         """
         import numpy
-        a = numpy.frombuffer(self._strdata, dtype=numpy.int16)
-        a = a.newbyteorder('>')
+        a = numpy.frombuffer(_numpy_buffer(self._strdata), dtype='>i2')
         a.shape = (-1, 2)
         return a
 
@@ -309,7 +372,7 @@ class DataArray(object):
             2: 'h',
             4: 'l' if array.array('l').itemsize == 4 else 'i',
             }[self._bytes_per_sample])
-        self._data.fromstring(self._strdata)
+        self._data.fromstring(_as_bytes(self._strdata))
         if self._bytes_per_sample > 1 and sys.byteorder == 'little':
             self._data.byteswap()
 
@@ -336,13 +399,10 @@ class DataArray(object):
         return a numpy array for this data
         """
         import numpy
-        a = numpy.frombuffer(self._strdata, dtype={
-            1: numpy.int8,
-            2: numpy.int16,
-            4: numpy.int32,}[self._bytes_per_sample])
-        if self._bytes_per_sample > 1:
-            a = a.newbyteorder('>')
-        return a
+        return numpy.frombuffer(_numpy_buffer(self._strdata), dtype={
+            1: 'i1',
+            2: '>i2',
+            4: '>i4',}[self._bytes_per_sample])
 
 
 class DataPacket(object):
@@ -414,3 +474,17 @@ def generate_speca_packet(data, count=0):
         )
     return ''.join((header, payload, padding)), (count + 1) & 0x0f
 
+
+def generate_gap_packet(seconds, count=0):
+    """
+    :param seconds: time in seconds that no data was received because
+                    the connection was being re-established
+    :param count: int count for the header of this packet
+
+    :returns: vrt packet bytes for a context packet with a
+              'reconnect_gap' field
+    """
+    return struct.pack('>IId',
+        (VRTCUSTOMCONTEXT << 28) | ((count & 0x0f) << 16) | 4,
+        VRTGAP,
+        seconds)
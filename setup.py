@@ -25,7 +25,8 @@ setup(
     version=release,
     author='ThinkRF Corporation',
     author_email='support@thinkrf.com',
-    packages=['pyrf', 'pyrf.devices', 'pyrf.connectors', 'pyrf.gui'],
+    packages=['pyrf', 'pyrf.devices', 'pyrf.connectors', 'pyrf.gui',
+        'pyrf.simulator'],
     url='https://github.com/pyrf/pyrf',
     license='BSD',
     description='API for RF receivers including ThinkRF WSA platforms',
@@ -58,6 +59,9 @@ setup(
         'gui_scripts': [
             "rtsa-gui = pyrf.gui.spectrum_analyzer:main",
             ],
+        'console_scripts': [
+            "pyrf-simulator = pyrf.simulator.__main__:main",
+            ],
         },
     **extras
     )